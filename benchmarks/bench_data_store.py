@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Compares the size and the writing and loading times of the data of a dense map written as CSV by ``Data_Sink`` and as a
+binary ``Data_Store``, compressed and raw.
+
+Run from the repository root::
+
+    py -3 benchmarks/bench_data_store.py
+
+The map is a grid of points over the simulated quadrupole with averaged readings, i.e. the columns X, Y, Z, Rotation, Data,
+Unit, Std and Samples, and one point out of 50 out of the motion bounds. The rows are written in batches of 500, as in a run.
+'load_data' is what the analysis tools do (``mapper_field_map.load_data()``: points and values of the points with a value),
+'all columns' reads every column, with ``csv.reader`` for the CSV file and ``load_store()`` for the stores.
+"""
+import csv
+import os
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mapper_data_sink import Data_Sink
+from mapper_data_store import Data_Store, load_store
+from mapper_field_map import load_data
+from mapper_probe_simulator import quadrupole_field
+
+POINTS = (41, 41, 161)
+FLUSH_ROWS = 500
+HEADER = ['X', 'Y', 'Z', 'Rotation', 'Data', 'Unit', 'Std', 'Samples']
+
+
+def make_rows(rng):
+    """Builds the rows of the map, as the ``Datalogger`` writes them.
+    """
+    axes = (np.linspace(-50, 50, POINTS[0]), np.linspace(-50, 50, POINTS[1]), np.linspace(-400, 400, POINTS[2]))
+    points = np.stack([axis.ravel() for axis in np.meshgrid(*axes, indexing='ij')], axis=1).tolist()
+    rows = []
+    for i, (x, y, z) in enumerate(points):
+        if i % 50 == 49:
+            rows.append([x, y, z, 90.0, 'out of motion bounds'])
+        else:
+            value = quadrupole_field(x, y, z, 90.0) + rng.normal(0, 0.01)
+            rows.append([x, y, z, 90.0, round(value, 6), 'G', round(abs(rng.normal(0, 0.01)), 6), int(rng.integers(20, 26))])
+    return rows
+
+
+def write(sink, rows):
+    """Writes the rows through a sink and returns the time taken.
+    """
+    start = perf_counter()
+    with sink:
+        for row in rows:
+            sink.write_row(row)
+    return perf_counter() - start
+
+
+def load_csv_columns(filename):
+    """Reads every column of a data CSV file with ``csv.reader``, converting the numbers to floats.
+    """
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = [[] for name in header]
+        for row in reader:
+            for i, name in enumerate(header):
+                cell = row[i] if i < len(row) else ''
+                if name.startswith('Unit'):
+                    columns[i].append(cell)
+                else:
+                    try:
+                        columns[i].append(float(cell))
+                    except ValueError:
+                        columns[i].append(np.nan)
+    return {name : np.array(values) for name, values in zip(header, columns)}
+
+
+def best_time(function, repeats = 3):
+    """Returns the shortest of a few runs of a function, in seconds.
+    """
+    times = []
+    for i in range(repeats):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    rows = make_rows(np.random.default_rng(0))
+    folder = tempfile.mkdtemp()
+    files = {'csv' : os.path.join(folder, 'data.csv'),
+             'store' : os.path.join(folder, 'data.mapdata'),
+             'store (raw)' : os.path.join(folder, 'data_raw.mapdata')}
+    sinks = {'csv' : Data_Sink(files['csv'], HEADER, FLUSH_ROWS),
+             'store' : Data_Store(files['store'], HEADER, FLUSH_ROWS),
+             'store (raw)' : Data_Store(files['store (raw)'], HEADER, FLUSH_ROWS, compress=False)}
+
+    print('%d rows' % len(rows))
+    print('%-12s %10s %10s %16s %16s' % ('format', 'size (MB)', 'write (s)', 'load_data (s)', 'all columns (s)'))
+    for name, filename in files.items():
+        write_time = write(sinks[name], rows)
+        load_time = best_time(lambda: load_data(filename))
+        if name == 'csv':
+            columns_time = best_time(lambda: load_csv_columns(filename), 1)
+        else:
+            columns_time = best_time(lambda: load_store(filename))
+        print('%-12s %10.2f %10.2f %16.3f %16.3f' % (name, os.path.getsize(filename) / 1e6, write_time, load_time, columns_time))
+
+    # the same points and values from every file
+    reference = load_data(files['csv'])
+    for name in ('store', 'store (raw)'):
+        loaded = load_data(files[name])
+        assert np.array_equal(reference[0], loaded[0]) and np.array_equal(reference[1], loaded[1]), name
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Measures how many points per second ``Field_Map`` interpolates, for a map on a grid and for the same map as scattered points,
+and how close the interpolated field is to the true one.
+
+Run from the repository root::
+
+    py -3 benchmarks/bench_field_map.py
+
+The maps sample the quadrupole of ``Probe_Simulator`` on a grid such as those of ``Points_Generator``. The 'scattered' maps use
+the same points, shuffled and shifted by a fraction of the step, so that they no longer fill a grid, which is the case of custom
+paths. The queries are random points inside the map, and the error is measured against ``quadrupole_field()`` on a subset of them.
+The scattered maps need scipy.
+"""
+import os
+import sys
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mapper_field_map import Field_Map
+from mapper_probe_simulator import quadrupole_field
+
+QUERIES = 2000000
+ERROR_QUERIES = 20000
+ROTATION = 0.0
+# X, Y and Z of the grid in mm
+GRID = (np.linspace(-50, 50, 21), np.linspace(-50, 50, 21), np.linspace(-400, 400, 81))
+
+field = np.vectorize(quadrupole_field)
+
+
+def make_points(jitter, rng):
+    """Builds the points of the map, shifted by up to ``jitter`` times the step of each axis.
+    """
+    points = np.stack([axis.ravel() for axis in np.meshgrid(*GRID, indexing='ij')], axis=1)
+    if jitter > 0:
+        steps = np.array([axis[1] - axis[0] for axis in GRID])
+        points[:, :2] += rng.uniform(-jitter, jitter, (len(points), 2)) * steps[:2]
+        rng.shuffle(points)
+    return points
+
+
+def run(field_map, queries, truth):
+    """Returns the queries per second, the share of queries answered and the maximum and RMS error against the true field.
+    """
+    start = perf_counter()
+    values = field_map.query(queries)
+    elapsed = perf_counter() - start
+    errors = values[:len(truth)] - truth
+    errors = errors[~np.isnan(errors)]
+    return len(queries) / elapsed, np.mean(~np.isnan(values)), np.max(np.abs(errors)), np.sqrt(np.mean(errors ** 2))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    low = np.array([axis[0] for axis in GRID])
+    high = np.array([axis[-1] for axis in GRID])
+    queries = rng.uniform(low, high, (QUERIES, 3))
+    truth = field(queries[:ERROR_QUERIES, 0], queries[:ERROR_QUERIES, 1], queries[:ERROR_QUERIES, 2], ROTATION)
+
+    print('%d queries on a %s grid' % (QUERIES, ' x '.join(str(len(axis)) for axis in GRID)))
+    print('%-12s %-9s %10s %14s %9s %11s %11s' % ('map', 'method', 'build (s)', 'queries/s', 'answered', 'max err (G)', 'rms err (G)'))
+    for name, jitter, methods in (('grid', 0.0, ('grid', 'nearest')), ('scattered', 0.2, ('linear', 'nearest'))):
+        points = make_points(jitter, rng)
+        values = field(points[:, 0], points[:, 1], points[:, 2], ROTATION)
+        for method in methods:
+            start = perf_counter()
+            field_map = Field_Map(points, values, 'G', method)
+            build = perf_counter() - start
+            # the Delaunay interpolation is much slower, a tenth of the queries is enough to time it
+            count = QUERIES if method != 'linear' else QUERIES // 10
+            rate, answered, max_error, rms_error = run(field_map, queries[:count], truth)
+            print('%-12s %-9s %10.3f %14.0f %8.1f%% %11.4f %11.4f' % (name, method, build, rate, 100 * answered, max_error, rms_error))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Measures how many probe frames per second ``Frame_Parser`` parses, and how many bad frames it accepts, compared with the
+number search that was used before it.
+
+Run from the repository root::
+
+    py -3 benchmarks/bench_frame_parser.py
+
+The frames are built by ``Probe_Simulator.make_frame()`` without opening a pseudo terminal, with the probe held at a fixed position.
+A value is counted as wrong if it is further than 10 standard deviations of the noise from the true field: these are bad frames
+that the parser accepted. The frames of the 'grammar' scenario use every unit, signs, exponents and the range and overload flags.
+"""
+import os
+import re
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mapper_frame_parser import Frame_Parser
+from mapper_probe_simulator import Probe_Simulator, quadrupole_field
+
+FRAMES = 200000
+NOISE = 0.01
+POSITION = (-50.0, 0.0, 0.0, 170.0)
+
+SCENARIOS = {
+    'clean' : {},
+    'drop 1% bytes' : {'drop_probability' : 0.01},
+    'garble 10% lines' : {'garble_probability' : 0.1},
+    'drop 1% and garble 10%' : {'drop_probability' : 0.01, 'garble_probability' : 0.1},
+}
+
+GRAMMAR_FRAMES = ['-6.191G', '+6.191G', '-1.2e-3T', '1.2E+2 mT', '12.50kG', '12.50kG*', '350.0mG', '15.2uT', 'OL', '-OL G',
+                  '6.191X', '', '-6.1#1G', '--6.191G', '-6191G', '-.191G', '-6.191G-6.191G']
+
+
+def search_parse(frame):
+    """The parser used before ``Frame_Parser``: the first number found anywhere in the frame, and its last character as the unit.
+    A frame such as '--6.191G' made it raise ValueError, which is counted as rejected here.
+    """
+    match = re.search('-*[0-9]{1,5}\\.[0-9]{1,4}', frame)
+    if match is None:
+        return None
+    try:
+        return float(match.group(0)), frame[-1]
+    except ValueError:
+        return None
+
+
+def make_frames(errors):
+    """Builds the frames of a scenario, split at their end of line characters like ``Probe_Session`` reads them.
+    """
+    simulator = Probe_Simulator(lambda: POSITION, noise=NOISE, seed=0, **errors)
+    data = b''.join(simulator.make_frame(0.0) for i in range(FRAMES))
+    return [line.decode('ascii', errors='replace') for line in data.split(b'\n')]
+
+
+def run(parse, frames, true_value):
+    """Parses every frame and returns the frames per second, the number of values accepted and the number of wrong values.
+    """
+    start = perf_counter()
+    readings = [parse(frame) for frame in frames]
+    elapsed = perf_counter() - start
+    values = [reading[0] for reading in readings if reading is not None]
+    wrong = sum(1 for value in values if abs(value - true_value) > 10 * NOISE)
+    return len(frames) / elapsed, len(values), wrong
+
+
+if __name__ == "__main__":
+    true_value = quadrupole_field(*POSITION)
+    print('%-24s %-14s %12s %10s %8s' % ('scenario', 'parser', 'frames/s', 'accepted', 'wrong'))
+    print('(Frame_Parser with decimals=3 is shown as \'3 decimals\')')
+    for name, errors in SCENARIOS.items():
+        frames = make_frames(errors)
+        parsers = (('search', lambda frame: search_parse(frame.strip())), ('Frame_Parser', Frame_Parser().parse),
+                   ('3 decimals', Frame_Parser(decimals=3).parse))
+        for parser_name, parse in parsers:
+            rate, accepted, wrong = run(parse, frames, true_value)
+            print('%-24s %-14s %12.0f %10d %8d' % (name, parser_name, rate, accepted, wrong))
+
+    print('\n%-16s %-22s %s' % ('frame', 'search', 'Frame_Parser (in G)'))
+    parser = Frame_Parser('G')
+    for frame in GRAMMAR_FRAMES:
+        print('%-16s %-22s %s' % (repr(frame), search_parse(frame), parser.parse(frame)))
+    parser.print_stats()
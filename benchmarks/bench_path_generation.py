@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Compares the vectorized ``Points_Generator.generate()`` against the original loop implementation.
+
+Run from the repository root::
+
+    py -3 benchmarks/bench_path_generation.py
+
+For each profile, both versions are timed and their point clouds are compared. The loop version drops a final (0, 0) XY point
+(it trimmed trailing zeros to find the end of the array), so that case is reported as a known difference rather than a failure.
+"""
+import contextlib
+import io
+import os
+import sys
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mapper_base import Mapper
+from mapper_points_generator import Points_Generator
+
+
+def legacy_generate(gen):
+    """Loop version of ``Points_Generator.generate()`` as it was before vectorization, kept here as the reference.
+
+    Args:
+        gen (Points_Generator): generator whose configurations are used
+
+    Returns:
+        numpy array: point cloud with 4 columns for X, Y, Z and rotation
+    """
+    order_inc = True
+    order_dec = False
+
+    if gen.shape == "cylinder":
+        num_cols_half = gen.radius / gen.xy_spacing
+        num_cols = int(2 * gen.radius / gen.xy_spacing + 1)
+        pos_xy = np.arange(-gen.xy_spacing * num_cols_half, gen.xy_spacing * (num_cols_half + 1), gen.xy_spacing)
+        points_xy = np.zeros([num_cols * num_cols, 2])
+        index = 0
+        order = order_inc
+        for i in range(num_cols):
+            columns = range(0, num_cols, 1) if order == order_inc else range(num_cols-1, -1, -1)
+            for j in columns:
+                x = pos_xy[i]
+                y = pos_xy[j]
+                if (x * x + y * y <= gen.radius * gen.radius):
+                    points_xy[index][0] = x
+                    points_xy[index][1] = y
+                    index += 1
+            order = not(order)
+
+    elif gen.shape == "rectangular":
+        num_x_half = gen.x_range/gen.x_spacing/2
+        num_y_half = gen.y_range/gen.y_spacing/2
+        num_x = int(gen.x_range/gen.x_spacing) + 1
+        num_y = int(gen.y_range/gen.y_spacing) + 1
+        pos_x = np.arange(-gen.x_spacing * num_x_half, gen.x_spacing * (num_x_half + 1), gen.x_spacing)
+        pos_y = np.arange(-gen.y_spacing * num_y_half, gen.y_spacing * (num_y_half + 1), gen.y_spacing)
+        points_xy = np.zeros([num_x * num_y, 2])
+        index = 0
+        order = order_inc
+        for i in range(num_x):
+            rows = range(0, num_y, 1) if order == order_inc else range(num_y-1, -1, -1)
+            for j in rows:
+                points_xy[index][0] = pos_x[i]
+                points_xy[index][1] = pos_y[j]
+                index += 1
+            order = not(order)
+
+    points_xy_1D_trim = np.trim_zeros(points_xy.flatten(), trim = 'b')
+    if (len(points_xy_1D_trim) % 2 != 0):
+        points_xy_1D_trim = np.append(points_xy_1D_trim, 0)
+    points_xy = np.reshape(points_xy_1D_trim, (-1, 2))
+    num_points_xy = len(points_xy)
+
+    num_z = int(gen.z_range/gen.z_spacing) + 1
+    num_z_half = int(gen.z_range/gen.z_spacing/2) + 1
+    pos_z = np.arange(- gen.z_spacing * (num_z_half - 1), gen.z_spacing * (num_z_half + 1), gen.z_spacing)
+
+    points = np.zeros([num_points_xy * num_z * len(gen.rotation_angles), 4])
+    index = 0
+    order = order_inc
+    for angle in gen.rotation_angles:
+        for i in range(num_points_xy):
+            heights = range(0, num_z, 1) if order == order_inc else range(num_z-1, -1, -1)
+            for j in heights:
+                points[index] = [points_xy[i][0], points_xy[i][1], pos_z[j], angle]
+                index += 1
+            order = not(order)
+    return points
+
+
+def make_generator(profile):
+    """Creates a ``Points_Generator`` from a profile dictionary, as if it had been loaded by ``Config_Setter``.
+    """
+    config = {'path_filename' : 'path/bench.csv', 'path_edges_filename' : 'path/bench_edges.csv',
+              'probe_stop_time_sec' : 5.0, 'x_offset' : 250, 'y_offset' : 250, 'z_offset' : 500}
+    config.update(profile)
+    Mapper.config_dict = config
+    return Points_Generator()
+
+
+def time_call(function, repeat):
+    """Returns the best time in seconds over ``repeat`` calls, and the result of the last call. Console output is discarded.
+    """
+    best = float('inf')
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            result = function()
+            best = min(best, perf_counter() - start)
+    return best, result
+
+
+PROFILES = {
+    'rectangular (shipped)' : {'shape' : 'rectangular', 'x_range' : 100, 'x_spacing' : 50, 'y_range' : 0, 'y_spacing' : 2,
+                               'rotation_points' : [170.0], 'z_range' : 1000, 'z_spacing' : 250},
+    'cylinder (shipped)' : {'shape' : 'cylinder', 'radius' : 100, 'xy_spacing' : 50, 'rotation_points' : [0, 45, 90],
+                            'z_range' : 100, 'z_spacing' : 50},
+    'rectangular 100k' : {'shape' : 'rectangular', 'x_range' : 200, 'x_spacing' : 4, 'y_range' : 100, 'y_spacing' : 2,
+                          'rotation_points' : [0.0, 90.0], 'z_range' : 380, 'z_spacing' : 20},
+    'origin only' : {'shape' : 'rectangular', 'x_range' : 0, 'x_spacing' : 10, 'y_range' : 0, 'y_spacing' : 10,
+                     'rotation_points' : [0.0], 'z_range' : 100, 'z_spacing' : 10},
+    'cylinder 1M' : {'shape' : 'cylinder', 'radius' : 100, 'xy_spacing' : 1, 'rotation_points' : [0, 90],
+                     'z_range' : 30, 'z_spacing' : 2},
+}
+
+
+if __name__ == "__main__":
+    print('%-24s %10s %12s %12s %9s  %s' % ('profile', 'points', 'loop (s)', 'numpy (s)', 'speedup', 'same order'))
+    for name, profile in PROFILES.items():
+        gen = make_generator(profile)
+        numpy_time, points = time_call(lambda: (gen.generate(), gen.points)[1], 5)
+        loop_time, legacy_points = time_call(lambda: legacy_generate(gen), 1)
+
+        if np.array_equal(points, legacy_points):
+            same = 'yes'
+        elif len(points) > len(legacy_points) and np.array_equal(points[:len(legacy_points)], legacy_points) \
+                and not np.any(points[len(legacy_points):, 0:2]):
+            same = 'yes, plus the final (0, 0) column the loop version dropped'
+        else:
+            same = 'NO'
+        print('%-24s %10d %12.4f %12.4f %8.0fx  %s' % (name, len(points), loop_time, numpy_time, loop_time / numpy_time, same))
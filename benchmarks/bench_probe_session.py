@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Load-tests ``Probe_Session`` against a ``Probe_Simulator`` sending frames on a pseudo terminal (Linux or macOS only).
+
+Run from the repository root::
+
+    py -3 benchmarks/bench_probe_session.py
+
+For each scenario the simulator sends frames at a high rate for a few seconds, with the probe held at a fixed position, while the
+background reader of ``Probe_Session`` parses them. The table shows how many frames were sent and parsed, the parse errors, and
+how many parsed values are wrong, i.e. further than 10 standard deviations of the noise from the true field: these are bad frames
+that the parser accepted.
+"""
+import os
+import sys
+from time import sleep
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mapper_probe import Probe_Session
+from mapper_probe_simulator import Probe_Simulator, quadrupole_field
+
+DURATION = 3.0
+RATE = 2000.0
+NOISE = 0.01
+POSITION = (-50.0, 0.0, 0.0, 170.0)
+
+SCENARIOS = {
+    'clean' : {},
+    'drop 0.1% bytes' : {'drop_probability' : 0.001},
+    'drop 1% bytes' : {'drop_probability' : 0.01},
+    'garble 1% lines' : {'garble_probability' : 0.01},
+    'garble 10% lines' : {'garble_probability' : 0.1},
+    'drop 1% and garble 10%' : {'drop_probability' : 0.01, 'garble_probability' : 0.1},
+}
+
+
+if __name__ == "__main__":
+    true_value = quadrupole_field(*POSITION)
+    print('%-24s %8s %8s %8s %12s %8s' % ('scenario', 'sent', 'parsed', 'errors', 'parsed/s', 'wrong'))
+    for name, errors in SCENARIOS.items():
+        with Probe_Simulator(lambda: POSITION, frame_rate=RATE, noise=NOISE, seed=0, **errors) as simulator:
+            with Probe_Session(simulator.port) as probe_session:
+                probe_session.start_reader(int(RATE * DURATION * 2))
+                sleep(DURATION)
+                probe_session.stop_reader()
+                timestamps, values, units = probe_session.buffer.since(0)
+                parse_errors = probe_session.parser.failure_count()
+            frames_sent = simulator.frames_sent
+        wrong = np.count_nonzero(np.abs(values - true_value) > 10 * NOISE)
+        print('%-24s %8d %8d %8d %12.0f %8d' % (name, frames_sent, len(values), parse_errors, len(values) / DURATION, wrong))
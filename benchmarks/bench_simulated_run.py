@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Runs full mapping paths on simulated stages and compares the simulated run time with the estimate of ``Points_Generator``.
+
+Run from the repository root::
+
+    py -3 benchmarks/bench_simulated_run.py
+
+Each profile is generated twice, in the generated order and reordered by ``Path_Optimizer``, and run by ``Controller.run()`` with
+'motion_backend' set to 'simulated' and a clock that does not wait ('sim_time_scale' of 0), without data collection. The simulated
+stages have no serial overhead, so the estimate is shown without its move overhead. The simulated time also includes the
+first move, from the home position to the start of the path.
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mapper_base import Mapper
+from mapper_points_generator import Points_Generator
+from mapper_controller import Controller
+
+
+def make_config(profile, folder, optimize):
+    """Creates the configurations of a simulated run, as if they had been loaded by ``Config_Setter``.
+    """
+    config = {'path_filename' : os.path.join(folder, 'path.csv'), 'path_edges_filename' : os.path.join(folder, 'path_edges.csv'),
+              'data_filename' : os.path.join(folder, 'data.csv'), 'comm_port_zaber' : 'SIM', 'comm_port_probe' : 'SIM',
+              'collect_data' : 'False', 'probe_stop_time_sec' : 0.5, 'x_offset' : 250, 'y_offset' : 250, 'z_offset' : 500,
+              'x_accel' : 25, 'y_accel' : 25, 'z_accel' : 25, 'motion_backend' : 'simulated', 'sim_time_scale' : 0,
+              'optimize_path' : str(optimize)}
+    config.update(profile)
+    return config
+
+
+PROFILES = {
+    'rectangular (shipped)' : {'shape' : 'rectangular', 'x_range' : 100, 'x_spacing' : 50, 'y_range' : 0, 'y_spacing' : 2,
+                               'rotation_points' : [170.0], 'z_range' : 1000, 'z_spacing' : 250},
+    'cylinder (shipped)' : {'shape' : 'cylinder', 'radius' : 100, 'xy_spacing' : 50, 'rotation_points' : [0, 45, 90],
+                            'z_range' : 100, 'z_spacing' : 50},
+    'rectangular 2k' : {'shape' : 'rectangular', 'x_range' : 100, 'x_spacing' : 10, 'y_range' : 40, 'y_spacing' : 10,
+                        'rotation_points' : [0.0, 90.0], 'z_range' : 180, 'z_spacing' : 10},
+}
+
+
+if __name__ == "__main__":
+    print('%-24s %-10s %8s %14s %14s %10s' % ('profile', 'order', 'points', 'estimate (s)', 'simulated (s)', 'wall (s)'))
+    for name, profile in PROFILES.items():
+        for optimize in (False, True):
+            with tempfile.TemporaryDirectory() as folder:
+                Mapper.config_dict = make_config(profile, folder, optimize)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    generator = Points_Generator()
+                    generator.run()
+                    phases = generator.estimate_time(generator.path_filename, Mapper.config_dict['probe_stop_time_sec'])
+
+                    controller = Controller()
+                    start = perf_counter()
+                    controller.run()
+                    wall_time = perf_counter() - start
+                simulated_time = controller.backend.now()
+            print('%-24s %-10s %8d %14.1f %14.1f %10.2f' % (name, 'optimized' if optimize else 'generated', phases['points'],
+                                                           phases['total'] - phases['overhead'], simulated_time, wall_time))
@@ -6,6 +6,9 @@ from mapper_base import Mapper
 from mapper_config_setter import Config_Setter
 from mapper_points_generator import Points_Generator
 from mapper_controller import Controller
+from mapper_motion_backend import create_backend
+from mapper_stage_session import Stage_Session
+from mapper_warning_monitor import Stage_Warning_Error
 import sys, getopt
 
 
@@ -17,35 +20,40 @@ def init(argv):
 
     Extracts the ``profile_name`` from the '-p' argument. If not found, defaults to ``profile = 'test_rectangular'``
 
+    Checks for the '--resume' argument, which resumes the interrupted mapping run of the profile on startup.
+
     The ``config_name`` and ``profile_name`` are printed to terminal.
 
     Args:
         argv: list of arguments when starting the program
 
     Returns:
-        (string, string): name of the config JSON file, name of the profile in config JSON file
+        (string, string, bool): name of the config JSON file, name of the profile in config JSON file, True if the run should be resumed
     """
     config_file = 'config.json'
     profile_name = 'test_rectangular'
+    resume = False
 
     # get the config_file and profile_name from arguments when opening the file
     try:
-        opts, args = getopt.getopt(argv,"hc:p:",["config_filename=","profile_name="])
+        opts, args = getopt.getopt(argv,"hc:p:",["config_filename=","profile_name=","resume"])
     except getopt.GetoptError:
-        print('main.py -c <config_filename> -p <profile_name>')
+        print('main.py -c <config_filename> -p <profile_name> [--resume]')
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
-            print('main.py -c <config_filename> -p <profile_name>')
+            print('main.py -c <config_filename> -p <profile_name> [--resume]')
             sys.exit()
-        elif opt in ("-c"):
+        elif opt in ("-c", "--config_filename"):
             config_file = arg
-        elif opt in ("-p"):
+        elif opt in ("-p", "--profile_name"):
             profile_name = arg
+        elif opt == "--resume":
+            resume = True
     print('Config file is ', config_file)
     print('Profile name is ', profile_name)
 
-    return config_file, profile_name
+    return config_file, profile_name, resume
 
     
 
@@ -59,13 +67,20 @@ def main(argv):
     used to instantiate ``Mapper`` object. As well, ``Config_Setter``, ``Points_Generator``, ``Controller`` are 
     all instantiated. These objects may be updated or recreated throughout the main loop.
 
-    The user is then brought to a menu that contains five options:
+    A single ``Stage_Session`` is shared by every ``Controller``: the connection to the stages is opened by the first operation 
+    that needs it and kept open, with the detected devices and applied settings, until the configurations change or the program exits.
+
+    If the program was started with '--resume', the interrupted mapping run is resumed first (see ``Controller.run()``), 
+    and the user is brought to the menu once it is done or interrupted again.
+
+    The user is then brought to a menu that contains six options:
 
     0) Change configurations
     1) Generate path for mapping and for edges
     2) Home the mapper
     3) Run mapper along edges of mapping path
     4) Start mapper in full mapping path
+    5) Show the timing profile of the last mapping run
 
     The user can also quit the program by pressing Q. 
 
@@ -89,6 +104,9 @@ def main(argv):
         Note that this option should be run whenever configurations are directly changed in the 
         JSON file. If using option 0\) of the menu, no need to run this option.
 
+        A path that was already generated with the same configurations is not generated again: it is left in place, or 
+        copied from the cache of recent paths, see ``Path_Cache``.
+
     **Home the mapper**
 
         Homes the mapper as the name suggests. This will home all axes -- it is recommended to home after a long 
@@ -105,9 +123,18 @@ def main(argv):
         Starts moving the mapper in full mapping path and taking data.
 
         Creates a new instance of the ``Controller`` object to ensure all configuration changes are captured and runs its ``run()`` function.
+
+        The run can be interrupted with Ctrl-C, in which case the data collected so far is saved and the user returns to the menu.
+
+        If 'refine_tolerance' is set in the profile, points are then added where the field changes quickly, see ``Controller.run_adaptive()``.
+
+    **Show the timing profile of the last mapping run**
+
+        Prints how long the points of the last run spent moving, waiting for the stages, settling, reading the probe and writing 
+        the data, with percentiles for each phase. See ``Run_Profiler`` and ``Controller.print_profile()``.
     """
     # Get filenames
-    config_file, profile_name = init(argv)
+    config_file, profile_name, resume = init(argv)
 
     # Initialize mapper object
     Mapper(config_file, profile_name)
@@ -115,60 +142,103 @@ def main(argv):
     # Initialize
     config_setter = Config_Setter()
     points_generator = Points_Generator()
-    controller = Controller()
-
-    while True:
-        # Main menu-ish thing
-        print('\n******************** Main Menu ********************\n')
-        print('0) Change configurations')
-        print('1) Generate path for mapping and for edges')
-        print('2) Home the mapper')
-        print('3) Run mapper along edges of mapping path')
-        print('4) Start mapper in full mapping path')
-        print('\nPress Q to exit the program')
-
-        # Home stages before magnets turn on
-        inputStr = input('\nEnter the number of operation you would like to perform: ')
-        if inputStr [0] == '0':
-            # Ask user to input json profile name
-            config_setter = Config_Setter()
-
-            # Ask user to change settings 
-            config_setter.run()
-
-            # Run the point generator to convert everything in json to path and write to CSV file
-            inputStr = input('\nSetting now updated. Ready to rewrite path CSV? True (T) to start CSV writing, Quit (Q) to exit the program, and press any key to go back to settings. ')
-            if inputStr [0] == 'T' or inputStr [0] == 't':
+
+    # the connection to the stages is opened by the first operation and kept open until the program exits
+    stage_session = Stage_Session(create_backend(Mapper.config_dict))
+    try:
+        controller = Controller(stage_session)
+
+        if resume:
+            try:
+                if controller.refine_tolerance is not None:
+                    controller.run_adaptive(resume=True)
+                else:
+                    controller.run(resume=True)
+            except KeyboardInterrupt:
+                print('\n*************** Mapping interrupted by user ***************\n')
+            except Stage_Warning_Error as error:
+                print('\n*************** Mapping stopped: {} ***************\n'.format(error))
+
+        while True:
+            # Main menu-ish thing
+            print('\n******************** Main Menu ********************\n')
+            print('0) Change configurations')
+            print('1) Generate path for mapping and for edges')
+            print('2) Home the mapper')
+            print('3) Run mapper along edges of mapping path')
+            print('4) Start mapper in full mapping path')
+            print('5) Show the timing profile of the last mapping run')
+            print('\nPress Q to exit the program')
+
+            # Home stages before magnets turn on
+            inputStr = input('\nEnter the number of operation you would like to perform: ')
+            if inputStr [0] == '0':
+                # Ask user to input json profile name
+                config_setter = Config_Setter()
+
+                # Ask user to change settings 
+                config_setter.run()
+
+                # the COMM port or the motion backend may have changed
+                stage_session.close()
+                stage_session = Stage_Session(create_backend(Mapper.config_dict))
+
+                # Run the point generator to convert everything in json to path and write to CSV file
+                inputStr = input('\nSetting now updated. Ready to rewrite path CSV? True (T) to start CSV writing, Quit (Q) to exit the program, and press any key to go back to settings. ')
+                if inputStr [0] == 'T' or inputStr [0] == 't':
+                    # the edges are generated by run(), which skips both paths if they are up to date or cached
+                    points_generator = Points_Generator()
+                    points_generator.run()
+                    continue
+                elif inputStr [0] == 'Q' or inputStr [0] == 'q':
+                    print('\n*************** Program cancelled by user. ***************\n')
+                    break
+                else:
+                    continue
+            elif inputStr [0] == '1':
                 points_generator = Points_Generator()
                 points_generator.run()
-                points_generator.generate_edges()
-                continue
+            elif inputStr [0] == '2':
+                controller = Controller(stage_session)
+                controller.home()
+            elif inputStr [0] == '3':
+                if not points_generator.path_is_current():
+                    points_generator.generate_edges()
+                controller = Controller(stage_session)
+                try:
+                    controller.run_edges()
+                except Stage_Warning_Error as error:
+                    print('\n*************** Edges run stopped: {} ***************\n'.format(error))
+                pass
+            elif inputStr [0] == '4':
+                controller = Controller(stage_session)
+                try:
+                    if controller.refine_tolerance is not None:
+                        controller.run_adaptive()
+                    else:
+                        controller.run()
+                except KeyboardInterrupt:
+                    # data collected so far has already been written and closed by the controller
+                    print('\n*************** Mapping interrupted by user ***************\n')
+                    print('Start the program with --resume to continue this run.')
+                    continue
+                except Stage_Warning_Error as error:
+                    # data collected so far has already been written and closed by the controller
+                    print('\n*************** Mapping stopped: {} ***************\n'.format(error))
+                    print('Check the stages, then start the program with --resume to continue this run.')
+                    continue
+                print('\n*************** Program finished ***************\n')
+            elif inputStr [0] == '5':
+                controller = Controller(stage_session)
+                controller.print_profile()
             elif inputStr [0] == 'Q' or inputStr [0] == 'q':
                 print('\n*************** Program cancelled by user. ***************\n')
                 break
             else:
                 continue
-        elif inputStr [0] == '1':
-            points_generator = Points_Generator()
-            points_generator.run()
-            points_generator.generate_edges()
-        elif inputStr [0] == '2':
-            controller = Controller()
-            controller.home()
-        elif inputStr [0] == '3':
-            points_generator.generate_edges()
-            controller = Controller()
-            controller.run_edges()
-            pass
-        elif inputStr [0] == '4':
-            controller = Controller()
-            controller.run()
-            print('\n*************** Program finished ***************\n')
-        elif inputStr [0] == 'Q' or inputStr [0] == 'q':
-            print('\n*************** Program cancelled by user. ***************\n')
-            break
-        else:
-            continue
+    finally:
+        # the connection is closed however the program exits, e.g. on an error or Ctrl+C at the menu
+        stage_session.close()
 
 
 
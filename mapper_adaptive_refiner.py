@@ -0,0 +1,286 @@
+from itertools import product
+import numpy as np
+
+# coordinates closer than this, in mm or degrees, are the same point
+TOLERANCE = 1e-6
+
+
+def point_keys(points):
+    """Rounds points to ``TOLERANCE`` so that they can be looked up in a dictionary, e.g. -0.0 and 0.0 give the same key.
+
+    Args:
+        points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+
+    Returns:
+        list: one tuple of 4 integers per point
+    """
+    return [tuple(key) for key in np.round(np.asarray(points, dtype=float) / TOLERANCE).astype(np.int64).tolist()]
+
+
+def order_points(points):
+    """Orders points like the paths of ``Points_Generator``: rotation, then X, then Y change slowest and Z fastest, with every
+    other Z column reversed so that the probe does not go back to the same end of the magnet for every column.
+
+    Args:
+        points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+
+    Returns:
+        numpy array: the same points in path order
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 4)
+    points = points[np.lexsort((points[:, 2], points[:, 1], points[:, 0], points[:, 3]))]
+    new_column = np.any(points[1:, [0, 1, 3]] != points[:-1, [0, 1, 3]], axis=1)
+    columns = np.split(points, np.flatnonzero(new_column) + 1)
+    return np.concatenate([column[::-1] if i % 2 else column for i, column in enumerate(columns)]) if len(points) else points
+
+
+class Adaptive_Refiner():
+    """The ``Adaptive_Refiner`` class chooses where to add points to a coarse map, so that the mapping time is spent where the
+    field changes quickly (e.g. near the pole tips) instead of on a uniform fine grid.
+
+    The coarse map is cut into cells: boxes with a measured point at every corner, between neighbouring coordinates of the grid
+    of each rotation angle. Axes along which the map is flat (e.g. Y for a map of the horizontal plane) are left out, so a cell
+    is a box, a rectangle or a segment. The field inside a cell is interpolated linearly from its corners (see ``Field_Map``),
+    and the error of this interpolation is estimated from the data, separately along each axis:
+
+    * for a coarse cell, by the change of the field along the edges of the cell in that direction, i.e. the local gradient
+      times the size of the cell
+    * for a cell made by splitting another one, by how far the interpolation over the larger cell was from the field measured
+      at the middle of its edges in that direction. This stops the refinement where the field changes quickly but evenly,
+      e.g. across a quadrupole, where the linear interpolation is already right, while it goes on where the gradient
+      changes, e.g. in its fringe field.
+
+    The cells are made by ``start()``, then each call to ``next_points()`` is one refinement level: every cell with an error over ``tolerance`` is split in two along the
+    axes over the tolerance, and the corners of the new cells that have not been measured yet are returned, cells with the
+    largest error first. Once they are measured and added with ``add_data()``, only the new cells are checked at the next level.
+    Refinement stops when every cell is within the tolerance, the cells would become smaller than ``min_spacing``, or
+    ``max_levels`` levels have been added.
+
+    Cells with a corner that has no reading (e.g. out of the motion bounds, or outside of a cylinder) are not refined. With
+    several probes, a cell is refined if the field of any probe changes by more than ``tolerance``.
+    """
+    def __init__(self, tolerance, min_spacing = 1.0, max_levels = 3):
+        """Initializes the ``Adaptive_Refiner`` class.
+
+        Args:
+            tolerance (float): largest interpolation error of the field in a cell, in the unit of the data, e.g. 0.5 for 0.5 G
+            min_spacing (float, optional): smallest distance between points along any axis, in mm. Defaults to 1.0.
+            max_levels (int, optional): number of times a coarse cell may be split. Defaults to 3.
+        """
+        self.tolerance = tolerance
+        self.min_spacing = min_spacing
+        self.max_levels = max_levels
+
+        # field of every measured point, one dictionary per probe, keyed by point_keys()
+        self.values = []
+        # cells to check at the next level: rotation, lower corner (X, Y, Z), size (X, Y, Z, 0 along flat axes), level and the
+        # cell it was split from (None for coarse cells)
+        self.cells = []
+        # keys of points returned by next_points() that were never measured, e.g. out of bounds, so that they are not asked again
+        self.requested = set()
+        # number of cells left in self.cells without being split by the last next_points(), because they did not fit in max_points
+        self.deferred = 0
+
+
+    def start(self, path_chunks):
+        """Cuts the coarse map into cells, for the first level of refinement.
+
+        Only the coordinates of the grid of each rotation angle are kept, so a large path can be read one chunk at a time.
+
+        Args:
+            path_chunks (iterable): numpy arrays of points of the coarse map, of shape (n, 4), columns X, Y, Z and rotation, e.g.
+                                    the path it was run along from ``iter_path_chunks()``
+        """
+        # rounded coordinates along X, Y and Z of the points of each rotation angle, keyed by the rounded angle
+        grid_axes = {}
+        for chunk in path_chunks:
+            keys = np.round(np.asarray(chunk, dtype=float).reshape(-1, 4) / TOLERANCE).astype(np.int64)
+            for rotation in np.unique(keys[:, 3]).tolist():
+                selected = keys[keys[:, 3] == rotation]
+                axes = grid_axes.setdefault(rotation, [set(), set(), set()])
+                for axis in range(3):
+                    axes[axis].update(np.unique(selected[:, axis]).tolist())
+        self.cells = self.coarse_cells(grid_axes)
+
+
+    def add_data(self, points, values, probe = 0):
+        """Adds the readings of one probe.
+
+        Args:
+            points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation, e.g. from ``load_data()``
+            values (numpy array): field at each point
+            probe (int, optional): index of the probe, for data files with several probes. Defaults to 0.
+        """
+        while len(self.values) <= probe:
+            self.values.append({})
+        self.values[probe].update(zip(point_keys(points), np.asarray(values, dtype=float).tolist()))
+
+
+    def coarse_cells(self, grid_axes):
+        """Cuts the grid of each rotation angle into cells.
+
+        Args:
+            grid_axes (dict): coordinates along X, Y and Z of the grid of each rotation angle, as sets of integers rounded to
+                              ``TOLERANCE``, keyed by the rounded angle
+
+        Returns:
+            list: cells as (rotation, lower corner, size, level, None)
+        """
+        cells = []
+        for rotation in sorted(grid_axes):
+            axes = [np.array(sorted(coordinates), dtype=float) * TOLERANCE for coordinates in grid_axes[rotation]]
+            rotation = rotation * TOLERANCE
+            # cells between neighbouring coordinates, a flat axis has a single coordinate and a size of 0
+            lowers = [axis[:-1] if len(axis) > 1 else axis for axis in axes]
+            sizes = [np.diff(axis) if len(axis) > 1 else np.zeros(1) for axis in axes]
+            for index in product(*[range(len(lower)) for lower in lowers]):
+                lower = np.array([lowers[axis][i] for axis, i in enumerate(index)])
+                size = np.array([sizes[axis][i] for axis, i in enumerate(index)])
+                cells.append((rotation, lower, size, 0, None))
+        return cells
+
+
+    def cell_points(self, cell, steps = 1):
+        """Points of a regular grid over a cell, in the order of ``numpy.meshgrid(indexing='ij')``.
+
+        Args:
+            cell (tuple): rotation, lower corner, size, level and larger cell of the cell
+            steps (int/list, optional): number of intervals along each axis that is not flat, or a list with one number per axis.
+                                        Defaults to 1, i.e. the corners of the cell.
+
+        Returns:
+            numpy array: points of shape (n, 4), columns X, Y, Z and rotation
+        """
+        rotation, lower, size, level, parent = cell
+        steps = np.broadcast_to(steps, 3)
+        ranges = [lower[axis] + size[axis] * np.arange(steps[axis] + 1) / steps[axis] if size[axis] > 0 else lower[axis:axis + 1]
+                  for axis in range(3)]
+        grid = np.stack([axis.ravel() for axis in np.meshgrid(*ranges, indexing='ij')], axis=1)
+        return np.column_stack((grid, np.full(len(grid), rotation)))
+
+
+    def corner_values(self, cell, values):
+        """Field at the corners of a cell, as an array with one dimension per axis: 2 long, or 1 long along flat axes.
+
+        Args:
+            cell (tuple): rotation, lower corner, size, level and larger cell of the cell
+            values (dict): field of the measured points of one probe
+
+        Returns:
+            numpy array: field at each corner, or None if a corner has no reading
+        """
+        rotation, lower, size, level, parent = cell
+        corners = [values.get(key) for key in point_keys(self.cell_points(cell))]
+        return None if None in corners else np.array(corners).reshape([2 if length > 0 else 1 for length in size])
+
+
+    def interpolate(self, cell, corners, points):
+        """Interpolates the field linearly inside a cell from its corners.
+
+        Args:
+            cell (tuple): rotation, lower corner, size, level and larger cell of the cell
+            corners (numpy array): field at the corners, from ``corner_values()``
+            points (numpy array): points inside the cell, of shape (n, 4)
+
+        Returns:
+            numpy array: field at each point
+        """
+        rotation, lower, size, level, parent = cell
+        corner_points = self.cell_points(cell)
+        weights = np.ones((len(points), len(corner_points)))
+        for axis in np.flatnonzero(size > 0):
+            fraction = ((points[:, axis] - lower[axis]) / size[axis])[:, None]
+            upper = corner_points[:, axis] > lower[axis] + TOLERANCE
+            weights *= np.where(upper, fraction, 1.0 - fraction)
+        return weights @ corners.ravel()
+
+
+    def cell_errors(self, cell):
+        """Estimated error of the linear interpolation of the field in a cell along each axis, the largest over every probe.
+
+        Args:
+            cell (tuple): rotation, lower corner, size, level and larger cell of the cell
+
+        Returns:
+            numpy array: estimated error along X, Y and Z, 0 along flat axes, or None if no probe has a reading at every corner
+        """
+        rotation, lower, size, level, parent = cell
+        errors = None
+        for values in self.values:
+            corners = self.corner_values(cell, values)
+            if corners is None:
+                continue
+            probe_errors = np.zeros(3)
+            if parent is None:
+                for axis in np.flatnonzero(size > 0):
+                    probe_errors[axis] = np.max(np.abs(np.diff(corners, axis=axis)))
+            else:
+                # the field measured at the middle of the edges of the larger cell, against its interpolation. It is the same
+                # for all the halves of the larger cell, so that a half where the field happens to vanish is refined like the others
+                parent_corners = self.corner_values(parent, values)
+                steps = np.where(parent[2] > size + TOLERANCE, 2, 1)
+                points = self.cell_points(parent, steps)
+                middle = (np.abs(points[:, :3] - (parent[1] + parent[2] / 2)) < TOLERANCE) & (steps > 1)
+                measured = [values.get(key) for key in point_keys(points)]
+                known = np.array([value is not None for value in measured])
+                misses = np.zeros(len(points))
+                misses[known] = np.abs(np.array([value for value in measured if value is not None])
+                                       - self.interpolate(parent, parent_corners, points[known]))
+                for axis in range(3):
+                    edge_middle = middle[:, axis] & (np.sum(middle, axis=1) == 1)
+                    if np.any(edge_middle):
+                        probe_errors[axis] = np.max(misses[edge_middle])
+            errors = probe_errors if errors is None else np.maximum(errors, probe_errors)
+        return errors
+
+
+    def next_points(self, max_points = None):
+        """Splits the cells over the tolerance and returns the points to measure for the next level.
+
+        Args:
+            max_points (int, optional): largest number of points returned, e.g. to fit a time budget. The cells with the largest
+                                        error are split first; a cell whose points do not fit is skipped and kept in ``self.cells``
+                                        for the next call, and counted in ``self.deferred``. Defaults to None, i.e. no limit.
+
+        Returns:
+            numpy array: points of shape (n, 4), columns X, Y, Z and rotation, in path order (see ``order_points()``). Empty if
+                         they have all been measured already or none fit in ``max_points``. The map is refined once
+                         ``self.cells`` is empty too.
+        """
+        candidates = []
+        for cell in self.cells:
+            rotation, lower, size, level, parent = cell
+            if level >= self.max_levels:
+                continue
+            errors = self.cell_errors(cell)
+            if errors is None:
+                continue
+            # split along the axes over the tolerance, as long as the halves stay larger than min_spacing
+            split = (errors > self.tolerance) & (size / 2 >= self.min_spacing - TOLERANCE)
+            if np.any(split):
+                candidates.append((np.max(errors[split]), cell, split))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        measured = set(self.requested)
+        for values in self.values:
+            measured.update(values)
+        new_points = {}
+        self.cells = []
+        self.deferred = 0
+        for error, cell, split in candidates:
+            steps = np.where(split, 2, 1)
+            points = self.cell_points(cell, steps)
+            added = {key : point for key, point in zip(point_keys(points), points) if key not in measured and key not in new_points}
+            if max_points is not None and len(new_points) + len(added) > max_points:
+                # a smaller cell further down may still fit, this one is checked again by the next call
+                self.cells.append(cell)
+                self.deferred += 1
+                continue
+            new_points.update(added)
+            # the halves of the cell are checked at the next level
+            rotation, lower, size, level, parent = cell
+            for corner in product(*[(0, 1) if split[axis] else (0,) for axis in range(3)]):
+                self.cells.append((rotation, lower + np.array(corner) * size / steps, size / steps, level + 1, cell))
+
+        self.requested.update(new_points)
+        return order_points(list(new_points.values()))
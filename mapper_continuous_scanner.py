@@ -0,0 +1,398 @@
+import threading
+from time import monotonic
+import numpy as np
+from zaber_motion import Units, Measurement
+from mapper_base import Mapper
+from mapper_probe import Frame_Buffer
+
+
+def split_columns(points):
+    """Splits a path into Z columns: runs of consecutive points with the same X, Y and rotation, in which Z only goes one way.
+
+    Paths from ``Points_Generator`` are made of such columns, since Z is the fastest changing axis.
+
+    Args:
+        points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+
+    Returns:
+        list: numpy arrays of points, one per column, in path order
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        return []
+
+    # a new column starts where X, Y or rotation changes...
+    new_column = np.any(points[1:, [0, 1, 3]] != points[:-1, [0, 1, 3]], axis=1)
+    # ...or where Z changes direction
+    steps = np.sign(np.diff(points[:, 2]))
+    turns = np.zeros(len(steps), dtype=bool)
+    turns[1:] = (steps[1:] * steps[:-1]) < 0
+    starts = np.flatnonzero(new_column | turns) + 1
+    return np.split(points, starts)
+
+
+def interpolate_column(z_targets, reading_times, values, sample_times, positions):
+    """Estimates the field at the given Z positions from readings taken while Z was moving.
+
+    The Z position of every reading is first interpolated from the position samples at the time of the reading. The field is then
+    interpolated linearly between the two readings closest in Z to each target. Targets outside of the Z range covered by the
+    readings cannot be estimated and get NaN.
+
+    Args:
+        z_targets (numpy array): Z positions at which the field is wanted
+        reading_times (numpy array): ``time.monotonic()`` timestamps of the probe readings
+        values (numpy array): field values of the probe readings
+        sample_times (numpy array): ``time.monotonic()`` timestamps of the position samples, increasing
+        positions (numpy array): Z positions of the position samples
+
+    Returns:
+        numpy array: field at each target, NaN where there is no reading on both sides of the target
+    """
+    z_targets = np.asarray(z_targets, dtype=float)
+    result = np.full(len(z_targets), np.nan)
+
+    if len(sample_times) == 0:
+        return result
+    # only readings taken while the position is known can be placed
+    inside = (reading_times >= sample_times[0]) & (reading_times <= sample_times[-1])
+    if np.count_nonzero(inside) < 2:
+        return result
+    reading_z = np.interp(reading_times[inside], sample_times, positions)
+    values = values[inside]
+
+    # np.interp needs increasing positions
+    order = np.argsort(reading_z, kind='stable')
+    reading_z = reading_z[order]
+    values = values[order]
+    covered = (z_targets >= reading_z[0]) & (z_targets <= reading_z[-1])
+    result[covered] = np.interp(z_targets[covered], reading_z, values)
+    return result
+
+
+class Position_Sampler():
+    """The ``Position_Sampler`` class polls the position of one Zaber axis from a background thread and stores every sample,
+    timestamped with ``time.monotonic()``, in a ``Frame_Buffer`` (the unit column holds 'mm'). Its samples are matched in time
+    with the probe readings buffered by ``Probe_Session``.
+
+    An exception while reading the position (e.g. a lost connection) stops the thread and is passed on to the main thread by
+    ``check()`` and ``wait_for_sample()``.
+    """
+    def __init__(self, axis, offset = 0.0, interval = 0.02, capacity = 65536):
+        """Initializes the ``Position_Sampler`` class. Sampling starts with ``start()``.
+
+        Args:
+            axis (Axis): Zaber axis to poll
+            offset (float, optional): stage position in mm of the magnet center, subtracted from every sample so positions are
+                                      stored in magnet coordinates. Defaults to 0.0.
+            interval (float, optional): time between two samples in seconds. Defaults to 0.02.
+            capacity (int, optional): number of samples kept. Defaults to 65536, i.e. about 20 minutes at the default interval.
+        """
+        self.axis = axis
+        self.offset = offset
+        self.interval = interval
+        self.buffer = Frame_Buffer(capacity)
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.error = None
+
+
+    def start(self):
+        """Starts the background thread.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.sample_loop, name='position-sampler', daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        """Stops the background thread and waits for it to exit. The buffer is kept so it can still be read.
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+
+    def sample_loop(self):
+        """Body of the background thread. Each sample is timestamped halfway between the request and the reply.
+        """
+        while not self.stop_event.is_set():
+            request_time = monotonic()
+            try:
+                position = self.axis.get_position(Units.LENGTH_MILLIMETRES)
+            except Exception as error:
+                self.error = error
+                return
+            reply_time = monotonic()
+            self.buffer.append((request_time + reply_time) / 2, position - self.offset, 'mm')
+            self.stop_event.wait(self.interval)
+
+
+    def check(self):
+        """Raises the error that stopped the background thread, if any.
+        """
+        if self.error is not None:
+            raise self.error
+
+
+    def wait_for_sample(self, not_before, timeout):
+        """Blocks until a sample with a timestamp at or after ``not_before`` is available and returns the first such sample.
+
+        Args:
+            not_before (float): ``time.monotonic()`` timestamp
+            timeout (float): maximum time to wait in seconds
+
+        Returns:
+            (float, float, string): timestamp, position and unit of the sample
+
+        Raises:
+            RuntimeError: if no sample arrived within ``timeout``. The error of the background thread is raised instead if it stopped.
+        """
+        deadline = monotonic() + timeout
+        while True:
+            # wait in short steps, so that a failure of the background thread is noticed without waiting for the whole timeout
+            sample = self.buffer.wait_for_reading(not_before, min(max(deadline - monotonic(), 0.0), 0.1))
+            self.check()
+            if sample is not None:
+                return sample
+            if monotonic() >= deadline:
+                raise RuntimeError('No Z position sample for {:.1f} s during the continuous scan.'.format(timeout))
+
+
+class Continuous_Scanner(Mapper):
+    """The ``Continuous_Scanner`` class inherits ``Mapper``. It maps a path by sweeping Z continuously through each column of points
+    instead of stopping at every point, which is much faster for coarse survey maps.
+
+    For every Z column (see ``split_columns()``):
+
+    1. The stages move to the first point of the column with ``Controller.moveXYZR()``, so the usual order of motion is kept,
+       and wait ``probe_stop_time_sec`` for the oscillation to damp out.
+    2. The Z positions of the column are uploaded to the Z device as a live stream of straight lines (zaber_motion's stream API),
+       at a maximum speed of ``self.scan_speed``. The stream does not stop between lines.
+    3. While the stream runs, a ``Position_Sampler`` records the Z position, and the probe readings keep arriving in the
+       ``Frame_Buffer`` of each ``Probe_Session``.
+    4. Once the stream is done, the field of every probe at every point of the column is interpolated from its readings with 
+       ``interpolate_column()`` and written with the same columns as a discrete run.
+
+    The Z device must support streams (e.g. an X-MCC controller or an integrated X-LRQ stage). The probe buffer must be large
+    enough to hold the readings of a whole column, see 'probe_buffer_size'.
+
+    Args:
+        Mapper: Mapper class that contains variables with key configurations.
+    """
+    def __init__(self):
+        """Creates an instance of the ``Continuous_Scanner`` class.
+
+        ==========================   ==============================    =============================================================
+        Variable name                Related setting in config.json    Description
+        ==========================   ==============================    =============================================================
+        ``self.scan_speed``          'scan_speed'                      Speed of the Z sweep in mm/s (optional, defaults to 5.0)
+        ``self.sample_interval``     'position_sample_sec'             Time between two Z position samples in seconds (optional,
+                                                                       defaults to 0.02)
+        ``self.start_dwell``         'probe_stop_time_sec'             Time waited at the start of each column in seconds
+        ==========================   ==============================    =============================================================
+        """
+        self.config_dict = Mapper.config_dict
+        self.scan_speed = self.config_dict.get('scan_speed', 5.0)
+        self.sample_interval = self.config_dict.get('position_sample_sec', 0.02)
+        self.start_dwell = self.config_dict['probe_stop_time_sec']
+
+        self.columns_scanned = 0
+        self.points_missed = 0
+
+
+    def stream_column(self, deviceZ, z_positions, z_offset):
+        """Sweeps Z through ``z_positions`` with a live stream and blocks until the motion is done.
+
+        Args:
+            deviceZ (Device): Zaber device of the Z stage
+            z_positions (numpy array): Z positions in magnet coordinates, in mm
+            z_offset (float): stage position of the magnet center in mm
+        """
+        stream = deviceZ.streams.get_stream(1)
+        stream.setup_live(1)
+        try:
+            stream.set_max_speed(self.scan_speed, Units.VELOCITY_MILLIMETRES_PER_SECOND)
+            # send every line before the motion starts, so the stream never runs out of lines
+            stream.cork()
+            for z in z_positions:
+                stream.line_absolute(Measurement(float(z) + z_offset, Units.LENGTH_MILLIMETRES))
+            stream.uncork()
+            stream.wait_until_idle()
+        finally:
+            stream.disable()
+
+
+    def column_timeout(self, column, probe_sessions):
+        """Longest time to wait for a position sample or a probe reading while a column is scanned: twice the time of the sweep
+        at ``self.scan_speed``, which leaves room for the acceleration, plus the timeout of the probes.
+
+        Args:
+            column (numpy array): points of shape (n, 4) with the same X, Y and rotation
+            probe_sessions (list): open probe connections (``Probe_Session``)
+
+        Returns:
+            float: time in seconds
+        """
+        return 2 * abs(column[-1, 2] - column[0, 2]) / self.scan_speed + probe_sessions[0].timeout
+
+
+    def wait_for_reading_at_rest(self, sampler, probe_sessions, not_before, timeout):
+        """Blocks until a reading of every probe is available between two position samples taken at or after ``not_before``.
+        The stages must not move after ``not_before``, so that the readings are placed exactly at the rest position.
+
+        A probe without a reading within ``timeout`` is skipped, its points at this end of the column are then left without a
+        value, but the position samples must arrive (see ``Position_Sampler.wait_for_sample()``).
+
+        Args:
+            sampler (Position_Sampler): running position sampler
+            probe_sessions (list): open probe connections (``Probe_Session``) with their background readers running
+            not_before (float): ``time.monotonic()`` timestamp
+            timeout (float): maximum time to wait for each sample or reading in seconds, see ``column_timeout()``
+        """
+        sample = sampler.wait_for_sample(not_before, timeout)
+        readings = [probe_session.buffer.wait_for_reading(sample[0], timeout) for probe_session in probe_sessions]
+        reading_times = [reading[0] for reading in readings if reading is not None]
+        if len(reading_times) > 0:
+            sampler.wait_for_sample(max(reading_times), timeout)
+
+
+    def scan_column(self, controller, deviceZ, column, probe_sessions):
+        """Sweeps one column and writes the interpolated field at each of its points.
+
+        If the position of Z cannot be read, or no sample arrives within ``column_timeout()``, the axes are stopped and the
+        error is raised.
+
+        Args:
+            controller (Controller): controller with its axes set up, used for the move to the start of the column
+            deviceZ (Device): Zaber device of the Z stage
+            column (numpy array): points of shape (n, 4) with the same X, Y and rotation
+            probe_sessions (list): open probe connections (``Probe_Session``) with their background readers running
+        """
+        x, y, z_start, rot = column[0].tolist()
+        controller.moveXYZR(x, y, z_start, rot, Units.LENGTH_MILLIMETRES, Units.ANGLE_DEGREES)
+        controller.check_warnings()
+        controller.backend.sleep(self.start_dwell)
+
+        timeout = self.column_timeout(column, probe_sessions)
+        sampler = Position_Sampler(controller.axisZ, controller.z_offset, self.sample_interval)
+        sampler.start()
+        try:
+            # readings can only be placed once the position is known, so the scan starts with the first sample
+            scan_start = sampler.wait_for_sample(0, timeout)[0]
+            # one reading at rest on each end of the column, between two position samples, so the first and last points
+            # of the column can be interpolated
+            self.wait_for_reading_at_rest(sampler, probe_sessions, scan_start, timeout)
+            self.stream_column(deviceZ, column[1:, 2], controller.z_offset)
+            self.wait_for_reading_at_rest(sampler, probe_sessions, monotonic(), timeout)
+        except Exception:
+            # the stages may still be moving
+            controller.stop_axes()
+            raise
+        finally:
+            sampler.stop()
+        controller.check_warnings()
+        controller.position = tuple(column[-1].tolist())
+
+        sample_times, positions, _ = sampler.buffer.since(scan_start)
+        fields = []
+        units = []
+        for probe_session in probe_sessions:
+            reading_times, values, probe_units = probe_session.buffer.since(scan_start)
+            fields.append(interpolate_column(column[:, 2], reading_times, values, sample_times, positions))
+            units.append(str(probe_units[0]) if len(probe_units) > 0 else '')
+
+        for index, (x, y, z, rot) in enumerate(column.tolist()):
+            data = [x, y, z, rot]
+            for probe_fields, unit in zip(fields, units):
+                if np.isnan(probe_fields[index]):
+                    # with several probes, the unit column is kept empty so the columns of the next probe stay in place
+                    data += ['no reading in scan'] + ([''] if len(probe_sessions) > 1 else [])
+                else:
+                    data += [round(float(probe_fields[index]), 6), unit]
+            if 'no reading in scan' in data:
+                self.points_missed += 1
+            print(data)
+            controller.datalogger.write_row(data)
+        self.columns_scanned += 1
+
+
+    def run(self, controller, deviceZ, path_chunks, probe_sessions):
+        """This is the main function accessed from the outside, called by ``Controller.run()`` when 'scan_mode' is 'continuous'.
+
+        Points out of the range of motion are logged as such and left out of their column. Columns of a single point have nothing
+        to sweep and are mapped with ``Controller.map_points()``.
+
+        Args:
+            controller (Controller): controller with its axes set up
+            deviceZ (Device): Zaber device of the Z stage
+            path_chunks (iterable): numpy arrays of points with 4 columns for X, Y, Z and rotation
+            probe_sessions (list): open probe connections (``Probe_Session``) with their background readers running
+        """
+        # a column may be split across two chunks, so the points after the last break of a chunk wait for the next chunk
+        pending = np.zeros([0, 4])
+        pending_in_bounds = np.zeros(0, dtype=bool)
+        for chunk in path_chunks:
+            in_bounds = np.array([controller.verify_bounds(*point) for point in chunk.tolist()], dtype=bool)
+            points = np.concatenate((pending, chunk))
+            in_bounds = np.concatenate((pending_in_bounds, in_bounds))
+
+            # runs of points in bounds are split into columns, the other points are logged in path order
+            breaks = np.flatnonzero(in_bounds[1:] != in_bounds[:-1]) + 1
+            runs = np.split(np.arange(len(points)), breaks)
+            for run in runs[:-1]:
+                self.map_run(controller, deviceZ, points[run], in_bounds[run[0]], probe_sessions, last = True)
+            last_run = runs[-1]
+            pending = self.map_run(controller, deviceZ, points[last_run], in_bounds[last_run[0]], probe_sessions, last = False)
+            pending_in_bounds = np.full(len(pending), in_bounds[last_run[0]])
+        if len(pending) > 0:
+            self.map_run(controller, deviceZ, pending, pending_in_bounds[0], probe_sessions, last = True)
+        self.print_stats()
+
+
+    def map_run(self, controller, deviceZ, points, in_bounds, probe_sessions, last):
+        """Maps consecutive points that are either all in or all out of the range of motion.
+
+        Args:
+            controller (Controller): controller with its axes set up
+            deviceZ (Device): Zaber device of the Z stage
+            points (numpy array): points of shape (n, 4)
+            in_bounds (boolean): True if the points are within the range of motion
+            probe_sessions (list): open probe connections (``Probe_Session``) with their background readers running
+            last (boolean): False if the next chunk may continue the last column of ``points``, in which case that column is not mapped
+
+        Returns:
+            numpy array: points left for the next chunk
+        """
+        if not in_bounds:
+            for x, y, z, rot in points.tolist():
+                controller.datalogger.log_data(x, y, z, rot, in_bounds=False)
+            return np.zeros([0, 4])
+
+        columns = split_columns(points)
+        pending = np.zeros([0, 4]) if last else columns.pop()
+        for column in columns:
+            self.map_column(controller, deviceZ, column, probe_sessions)
+        return pending
+
+
+    def map_column(self, controller, deviceZ, column, probe_sessions):
+        """Maps one column, by sweeping it with ``scan_column()`` or with a discrete move if it has a single point.
+
+        Args:
+            controller (Controller): controller with its axes set up
+            deviceZ (Device): Zaber device of the Z stage
+            column (numpy array): points of shape (n, 4) with the same X, Y and rotation
+            probe_sessions (list): open probe connections (``Probe_Session``) with their background readers running
+        """
+        if len(column) == 1:
+            controller.map_points([column], probe_sessions)
+        else:
+            self.scan_column(controller, deviceZ, column, probe_sessions)
+
+
+    def print_stats(self):
+        """Prints the number of columns swept and of points that could not be interpolated.
+        """
+        print('Swept %d Z columns, %d points had no reading on both sides.'
+              % (self.columns_scanned, self.points_missed))
@@ -1,15 +1,27 @@
 #!/usr/bin/env python3
-from time import sleep
-from rx import throw
-from zaber_motion import Units, Library
-from zaber_motion.ascii import Connection
-from zaber_motion.ascii import WarningFlags
-from zaber_motion.ascii import SettingConstants
-from csv import reader, writer
+from contextlib import contextmanager, ExitStack
+from time import monotonic, time
+from zaber_motion import Units
 from mapper_base import Mapper
 from mapper_datalogger import Datalogger
-import serial
-import re
+from mapper_probe import Probe_Session
+from mapper_frame_parser import Frame_Parser
+from mapper_data_sink import Data_Sink
+from mapper_data_store import Data_Store, store_filename
+from mapper_path_io import iter_csv_chunks, iter_path_chunks, npy_filename
+from mapper_settle_detector import Settle_Detector
+from mapper_sample_averager import Sample_Averager
+from mapper_continuous_scanner import Continuous_Scanner
+from mapper_motion_backend import create_backend
+from mapper_stage_session import Stage_Session
+from mapper_probe_simulator import create_probe_simulator
+from mapper_run_journal import Run_Journal, journal_filename, file_hash
+from mapper_warning_monitor import Warning_Monitor
+from mapper_run_profiler import Run_Profiler, profile_filename, print_profile_report
+from mapper_adaptive_refiner import Adaptive_Refiner
+from mapper_field_map import load_data
+import numpy as np
+import os
 
 class Controller (Mapper):
     """The Controller class inherits ``Mapper``. This class contains functions that home and move the Zaber stages.
@@ -18,11 +30,14 @@ class Controller (Mapper):
     Args:
         Mapper: Mapper class that contains variables with key configurations.
     """
-    def __init__(self): 
+    def __init__(self, stage_session = None): 
         """Creates an instance of the Controller class.
 
         Loads configurations from the Mapper superclass -- in particular, it contains ``self.config_dict`` with key configurations.
 
+        The stages are reached through ``stage_session``, a ``Stage_Session`` shared with other controllers so the connection stays open 
+        between operations (see ``main.py``). Without one, the controller opens its own connection for every operation.
+
         Information about the settings in code:
 
         * General configurations:
@@ -34,7 +49,17 @@ class Controller (Mapper):
         ``self.path_edges_filename``   'path_edges_filename'             Path to the CSV that stores the mapping path boundaries
         ``self.data_filename``         'data_filename'                   Path to CSV that stores mapping data
         ``self.comm_port_zaber``       'comm_port_zaber'                 COMM port that connects to Zaber device
-        ``self.comm_port_probe``       'comm_port_probe'                 COMM port that connects to the probe/Arduino interface
+        ``self.backend``               'motion_backend'                  'zaber' to run the real stages, 'simulated' to run simulated stages 
+                                                                         (optional, defaults to 'zaber', see ``create_backend()``)
+        ``self.comm_port_probe``       'comm_port_probe'                 COMM port that connects to the probe/Arduino interface, or a list of 
+                                                                         ports to read several probes at each point, e.g. one per axis of a 
+                                                                         3-axis Hall probe (see ``probe_sessions()``)
+        ``self.probe_backend``         'probe_backend'                   'serial' to read the probe on ``self.comm_port_probe``, 'simulated' to 
+                                                                         read a ``Probe_Simulator`` instead (optional, defaults to 'serial')
+        ``self.path_chunk_size``       'path_chunk_size'                 Number of path points read from file at a time (optional, 
+                                                                         defaults to 10000)
+        ``self.path_run_filename``     'path_format'                     Path file actually run: the CSV, or its binary '.npy' copy if 
+                                                                         'path_format' is 'npy' (optional, defaults to 'csv')
         ============================   ==============================    =============================================================
 
         * Motion related configurations:
@@ -57,6 +82,13 @@ class Controller (Mapper):
         ``self.max_accelX``        'x_accel'                         Maximum acceleration of the X direction stage in mm/s^2
         ``self.max_accelY``        'y_accel'                         Maximum acceleration of the Y direction stage in mm/s^2
         ``self.max_accelZ``        'z_accel'                         Maximum acceleration of the Z direction stage in mm/s^2
+        ``self.motion_mode``       'motion_mode'                     'sequential' to always move Z after X, Y and rotation, 'concurrent' to 
+                                                                     move all axes together when the move stays in the safe envelope 
+                                                                     (optional, defaults to 'sequential')
+        ``self.safe_envelope``     'safe_envelope'                   Box in magnet coordinates where the probe is clear of the magnet, e.g. 
+                                                                     {"x" : [-100, 100], "y" : [-50, 50], "z" : [-1000, -300]}, in mm. 
+                                                                     An "r" range in degrees may be added. (optional, defaults to None, 
+                                                                     i.e. no concurrent moves)
         ========================   ==============================    =============================================================
         
         * Data collection related configurations:
@@ -65,8 +97,66 @@ class Controller (Mapper):
         Variable name               Related setting in config.json    Description
         =========================   ==============================    =============================================================
         ``self.probe_stop_time``      'probe_stop_time_sec'             Time probe pauses at each spot in seconds (float value)
+        ``self.probe_buffer_size``    'probe_buffer_size'               Number of probe readings kept by the background reader (optional, 
+                                                                      defaults to 4096)
+        ``self.probe_unit``           'probe_unit'                      Unit every reading is converted to, e.g. 'G', see ``Frame_Parser`` 
+                                                                      (optional, defaults to None, i.e. the unit sent by the probe)
+        ``self.accept_range_change``  'probe_accept_range_change'       True to keep the readings the probe flags as taken while changing 
+                                                                      range (optional, defaults to False)
+        ``self.probe_decimals``       'probe_decimals'                  Number of decimals the probe always sends, frames with another number 
+                                                                      have lost digits and are rejected (optional, defaults to None, i.e. 
+                                                                      any number)
+        ``self.settle_mode``          'settle_mode'                     'fixed' to pause for ``self.probe_stop_time`` at each spot, 'adaptive' 
+                                                                      to wait until the field readings settle (optional, defaults to 'fixed')
+        ``self.settle_detector``      'settle_window_sec'               Length of the last readings used to check the field has settled, in 
+                                                                      seconds. Should last at least one period of the oscillation of the 
+                                                                      probe (optional, defaults to 0.5)
+                                      'settle_min_readings'             Least number of readings in that window (optional, defaults to 5)
+                                      'probe_noise'                     Standard deviation of the readings at rest, in the probe unit 
+                                                                      (optional, defaults to 'sim_probe_noise' with the simulated probe, 
+                                                                      else 0.01)
+                                      'settle_variance_threshold'       Variance of the readings below which the field has settled, in the 
+                                                                      probe unit squared (optional, defaults to 4 times the variance of 
+                                                                      the noise, see ``Settle_Detector``)
+                                      'settle_min_sec'                  Minimum dwell in adaptive mode in seconds (optional, defaults to 0.5)
+                                      'settle_max_sec'                  Maximum dwell in adaptive mode in seconds (optional, defaults to 
+                                                                      ``self.probe_stop_time``)
+        ``self.sample_averager``      'samples_per_point'               Number of probe readings averaged at each point, see ``Sample_Averager``. 
+                                                                      Above 1, the standard deviation and number of readings kept are 
+                                                                      added to every row (optional, defaults to 1, i.e. no averager. 
+                                                                      Not used by continuous scans)
+                                      'sample_statistic'                'mean', 'median', 'trimmed_mean' or 'mad' (optional, defaults to 'mad')
+                                      'sample_trim_fraction'            Fraction of the readings removed at each end by 'trimmed_mean' 
+                                                                      (optional, defaults to 0.1)
+                                      'sample_mad_threshold'            Number of scaled MADs beyond which 'mad' rejects a reading (optional, 
+                                                                      defaults to 3.5)
         ``self.collect_data``         'collect_data'                    True if probe is installed and taking data
                                                                       False if you do not wish to take data
+        ``self.data_run_filename``    'data_format'                     'csv' to write the data as CSV into ``self.data_filename``, 'columnar' 
+                                                                      to write it into a compact binary ``Data_Store`` named after it, 
+                                                                      ending in '.mapdata' (optional, defaults to 'csv')
+        ``self.data_flush_rows``      'data_flush_rows'                 Number of data rows written to the file at once (optional, 
+                                                                      defaults to 50)
+        ``self.data_flush_sec``       'data_flush_sec'                  Maximum time in seconds a data row is held before being written 
+                                                                      (optional, defaults to 30.0)
+        ``self.journal_filename``     'journal_filename'                JSON file recording the progress of the run, see ``Run_Journal`` 
+                                                                      (optional, defaults to the data file name ending in '.journal.json')
+        ``self.scan_mode``            'scan_mode'                       'discrete' to stop at every point, 'continuous' to sweep each Z column 
+                                                                      with ``Continuous_Scanner`` (optional, defaults to 'discrete')
+        ``self.profile_run``          'profile_run'                     True to record the time spent in each phase of every point, see 
+                                                                      ``Run_Profiler`` (optional, defaults to True)
+        ``self.profile_filename``     'profile_filename'                CSV file storing the timing profile of the last run (optional, defaults 
+                                                                      to the data file name ending in '.profile.csv')
+        ``self.refine_tolerance``     'refine_tolerance'                Largest interpolation error of the map in the probe unit, e.g. 0.5, 
+                                                                      see ``run_adaptive()`` and ``Adaptive_Refiner`` (optional, defaults 
+                                                                      to None, i.e. no refinement)
+        ``self.refine_min_spacing``   'refine_min_spacing'              Smallest distance between refined points along any axis in mm 
+                                                                      (optional, defaults to 1.0)
+        ``self.refine_max_levels``    'refine_max_levels'               Number of times a cell of the path grid may be split (optional, 
+                                                                      defaults to 3)
+        ``self.refine_time_budget``   'refine_time_budget_sec'          Time after which no more points are added, counted from the start of 
+                                                                      the run, including the sessions it was resumed from, in seconds 
+                                                                      (optional, defaults to None, i.e. no limit)
         =========================   ==============================    =============================================================
 
         The class also instantiates a ``datalogger`` class on startup. The datalogger class is based on the COMM ports and data path specified.
@@ -79,6 +169,12 @@ class Controller (Mapper):
         self.data_filename = self.config_dict['data_filename']
         self.comm_port_zaber = self.config_dict['comm_port_zaber']
         self.comm_port_probe = self.config_dict['comm_port_probe']
+        self.probe_ports = self.comm_port_probe if isinstance(self.comm_port_probe, list) else [self.comm_port_probe]
+        if stage_session is None:
+            stage_session = Stage_Session(create_backend(self.config_dict), keep_open=False)
+        self.stage_session = stage_session
+        self.backend = stage_session.backend
+        self.probe_backend = self.config_dict.get('probe_backend', 'serial')
 
         # offset values ie origin
         self.x_offset = self.config_dict['x_offset']
@@ -92,22 +188,74 @@ class Controller (Mapper):
 
         # data collection
         self.probe_stop_time = self.config_dict['probe_stop_time_sec']
+        self.probe_buffer_size = self.config_dict.get('probe_buffer_size', 4096)
+        self.probe_unit = self.config_dict.get('probe_unit', None)
+        self.accept_range_change = self.config_dict.get('probe_accept_range_change', False)
+        self.probe_decimals = self.config_dict.get('probe_decimals', None)
+        self.settle_mode = self.config_dict.get('settle_mode', 'fixed')
+        self.settle_detector = Settle_Detector(self.config_dict.get('settle_window_sec', 0.5),
+                                               self.config_dict.get('settle_min_readings', 5),
+                                               self.config_dict.get('probe_noise', self.config_dict.get('sim_probe_noise', 0.01)),
+                                               self.config_dict.get('settle_variance_threshold'),
+                                               self.config_dict.get('settle_min_sec', 0.5),
+                                               self.config_dict.get('settle_max_sec', self.probe_stop_time))
         if self.config_dict['collect_data'][0] == 'F' or self.config_dict['collect_data'][0] == 'f':
             self.collect_data = False
         else:
             self.collect_data = True
+        self.data_format = self.config_dict.get('data_format', 'csv')
+        if self.data_format == 'columnar':
+            self.data_run_filename = store_filename(self.data_filename)
+        else:
+            self.data_run_filename = self.data_filename
+        self.data_flush_rows = self.config_dict.get('data_flush_rows', 50)
+        self.data_flush_sec = self.config_dict.get('data_flush_sec', 30.0)
+        self.scan_mode = self.config_dict.get('scan_mode', 'discrete')
+        # several readings per point, continuous scans interpolate between readings instead
+        if self.config_dict.get('samples_per_point', 1) > 1 and self.scan_mode != 'continuous':
+            self.sample_averager = Sample_Averager(self.config_dict['samples_per_point'],
+                                                   self.config_dict.get('sample_statistic', 'mad'),
+                                                   self.config_dict.get('sample_trim_fraction', 0.1),
+                                                   self.config_dict.get('sample_mad_threshold', 3.5))
+        else:
+            self.sample_averager = None
+        self.journal_filename = self.config_dict.get('journal_filename', journal_filename(self.data_run_filename))
+        self.profile_run = self.config_dict.get('profile_run', True)
+        self.profile_filename = self.config_dict.get('profile_filename', profile_filename(self.data_filename))
+        self.profiler = Run_Profiler()
+        self.refine_tolerance = self.config_dict.get('refine_tolerance', None)
+        self.refine_min_spacing = self.config_dict.get('refine_min_spacing', 1.0)
+        self.refine_max_levels = self.config_dict.get('refine_max_levels', 3)
+        self.refine_time_budget = self.config_dict.get('refine_time_budget_sec', None)
+
+        # number of path points read from file at a time
+        self.path_chunk_size = self.config_dict.get('path_chunk_size', 10000)
+
+        # read the binary copy of the path written by the Points_Generator instead of the CSV
+        if self.config_dict.get('path_format', 'csv') == 'npy':
+            self.path_run_filename = npy_filename(self.path_filename)
+        else:
+            self.path_run_filename = self.path_filename
+
+        # motion mode, see moveXYZR()
+        self.motion_mode = self.config_dict.get('motion_mode', 'sequential')
+        self.safe_envelope = self.config_dict.get('safe_envelope', None)
+        self.position = None
+        self.merged_moves = 0
+        self.sequential_moves = 0
+
+        # warning flags are polled in the background during runs, see check_warnings()
+        self.warning_monitor = Warning_Monitor(self.config_dict.get('warning_poll_sec', 1.0),
+                                               self.config_dict.get('warning_actionable_flags', None))
 
         # datalogger instance
-        self.datalogger = Datalogger(self.data_filename, self.comm_port_probe)
+        self.datalogger = Datalogger(self.data_filename, self.comm_port_probe, self.sample_averager)
 
        
     # Function to home the staegs
     def home(self):
-        Library.enable_device_db_store()
-        with Connection.open_serial_port(self.comm_port_zaber) as connection:
-            # establish serial connections
-            self.device_list = connection.detect_devices()
-            print("Found {} devices".format(len(self.device_list)))
+        with self.stage_session.use() as stages:
+            self.device_list = stages.device_list
 
             # home all devices 
             for device in self.device_list:
@@ -116,6 +264,39 @@ class Controller (Mapper):
                 self.check_warnings()
 
 
+    def setup_stages(self, stages):
+        """Gets the axes of the open ``Stage_Session`` and limits the acceleration of the X, Y and Z stages to ``self.max_accelX``, 
+        ``self.max_accelY`` and ``self.max_accelZ``. Settings already applied during the session are not sent again.
+
+        Args:
+            stages (Stage_Session): open stage session
+        """
+        self.device_list = stages.device_list
+        self.axisX = stages.axes['x']
+        self.axisY = stages.axes['y']
+        self.axisZ = stages.axes['z']
+        self.axisR = stages.axes['r']
+
+        # the stages may have been moved since the last run, so the first move is always sequential
+        self.position = None
+
+        # set max acceleration in each direction
+        stages.set_setting('x', 'accel', self.max_accelX, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
+        stages.set_setting('y', 'accel', self.max_accelY, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
+        stages.set_setting('z', 'accel', self.max_accelZ, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
+
+
+    def stop_axes(self):
+        """Stops the four axes, e.g. after an error in the middle of a move. Errors while stopping an axis (e.g. the connection
+        is lost) are ignored so that the other axes are still stopped and the error that led here is the one raised.
+        """
+        for axis in (self.axisX, self.axisY, self.axisZ, self.axisR):
+            try:
+                axis.stop()
+            except Exception:
+                pass
+
+
     # Function for moving in XYZ
     def moveXYZR(self, Xval, Yval, Zval, angle, unitXYZ, unitR):
         """Move the linear stages according to the position and rotation values given. The positions given are absolute.
@@ -127,6 +308,12 @@ class Controller (Mapper):
         stages moving together, blocking the funtion, and Z stage only moves after the other three motions have completed.
         This order of movements helps avoid collision with the magnet surface while moving into position.
 
+        If ``self.motion_mode`` is 'concurrent' and ``is_move_safe()`` finds that the whole move stays inside ``self.safe_envelope``, 
+        all four axes are started together instead. The number of merged and sequential moves is counted in ``self.merged_moves`` 
+        and ``self.sequential_moves``.
+
+        The time spent sending the moves and waiting for the stages to stop is recorded by ``self.profiler`` ('move' and 'wait_idle').
+
         Args:
             Xval (float/int): targeted position on X axis in mapper coordinates
             Yval (float/int): targeted position on Y axis in mapper coordinates
@@ -135,18 +322,130 @@ class Controller (Mapper):
             unitXYZ (Units): unit for linear motion, must be a Zaber Units type, e.g. Units.LENGTH_MILLIMETRES
             unitR (Units): unit for rotational motion, must be a Zaber Units type, e.g. Units.ANGLE_DEGREES
         """
+        target = (Xval, Yval, Zval, angle)
+        concurrent = self.motion_mode == 'concurrent' and self.is_move_safe(self.position, target)
+
         self.axisX.move_absolute(self.x_offset + Xval, unitXYZ, wait_until_idle=False)
         # Y axis is vertical stage. Since our motor is mount at the top of the stage, a smaller commanded position 
         # corresponds to a higher position, we thus subtract the commanded position instead of adding it to the y offset
         self.axisY.move_absolute(self.y_offset - Yval, unitXYZ, wait_until_idle=False)
         self.axisR.move_absolute(angle, unitR, wait_until_idle=False)
+        if concurrent:
+            # the whole move is clear of the magnet, no need to wait before moving Z
+            self.axisZ.move_absolute(Zval + self.z_offset, unitXYZ, wait_until_idle=False)
+        self.profiler.lap('move')
         self.axisX.wait_until_idle()
         self.axisY.wait_until_idle()
         self.axisR.wait_until_idle()
+        self.profiler.lap('wait_idle')
 
-        self.axisZ.move_absolute(Zval + self.z_offset, unitXYZ, wait_until_idle=False)
+        if concurrent:
+            self.merged_moves += 1
+        else:
+            self.axisZ.move_absolute(Zval + self.z_offset, unitXYZ, wait_until_idle=False)
+            self.sequential_moves += 1
+            self.profiler.lap('move')
         self.axisZ.wait_until_idle()
-        
+        self.profiler.lap('wait_idle')
+        self.position = target
+
+
+    def is_move_safe(self, start, end):
+        """Checks whether moving all axes at once from ``start`` to ``end`` keeps the probe inside ``self.safe_envelope``.
+
+        Each axis moves monotonically from its start to its end position, so the probe always stays inside the box spanned by the two 
+        points, whatever the speed of each axis. The move is safe if that box is inside the envelope.
+
+        Args:
+            start (tuple): current position (X, Y, Z, rotation) in magnet coordinates, or None if unknown
+            end (tuple): targeted position (X, Y, Z, rotation) in magnet coordinates
+
+        Returns:
+            boolean: True if all axes can move together, False if Z must wait for the other axes
+        """
+        if start is None or self.safe_envelope is None:
+            return False
+        for axis, index in (('x', 0), ('y', 1), ('z', 2), ('r', 3)):
+            if axis not in self.safe_envelope:
+                if axis == 'r':
+                    continue
+                return False
+            low, high = self.safe_envelope[axis]
+            if min(start[index], end[index]) < low or max(start[index], end[index]) > high:
+                return False
+        return True
+
+
+    def magnet_position(self):
+        """Reads the current position of the stages and converts it to magnet coordinates, the reverse of ``moveXYZR()``.
+
+        Returns:
+            (float, float, float, float): X, Y, Z in mm and rotation in degrees
+        """
+        return (self.axisX.get_position(Units.LENGTH_MILLIMETRES) - self.x_offset,
+                self.y_offset - self.axisY.get_position(Units.LENGTH_MILLIMETRES),
+                self.axisZ.get_position(Units.LENGTH_MILLIMETRES) - self.z_offset,
+                self.axisR.get_position(Units.ANGLE_DEGREES))
+
+
+    @contextmanager
+    def probe_comm_ports(self):
+        """Provides the COMM ports of the probes, ``self.probe_ports``, for the duration of a ``with`` block.
+
+        If ``self.probe_backend`` is 'simulated', one ``Probe_Simulator`` per port, configured by ``create_probe_simulator()``, is started 
+        on a pseudo terminal, measuring the field at ``magnet_position()``, and stopped at the end of the block. Like the axes of a 
+        3-axis Hall probe, the simulated probe number i measures the field turned by 90 degrees times i. The axes must be set up first.
+
+        Yields:
+            list: names of the COMM ports to open
+        """
+        if self.probe_backend != 'simulated':
+            yield self.probe_ports
+            return
+        with ExitStack() as stack:
+            probe_simulators = [stack.enter_context(create_probe_simulator(self.config_dict, self.magnet_position, 90.0 * index))
+                                for index in range(len(self.probe_ports))]
+            yield [probe_simulator.port for probe_simulator in probe_simulators]
+            for probe_simulator in probe_simulators:
+                print('Simulated probe sent %d frames, garbled %d and dropped %d bytes.'
+                      % (probe_simulator.frames_sent, probe_simulator.frames_garbled, probe_simulator.bytes_dropped))
+
+
+    @contextmanager
+    def probe_sessions(self):
+        """Opens a ``Probe_Session`` on every probe port for the duration of a ``with`` block, each with its own ``Frame_Parser`` 
+        and background reader, so that all probes are read concurrently. The latency and parser statistics of every probe are 
+        printed at the end of the block.
+
+        Yields:
+            list: open ``Probe_Session`` of every probe, in the order of ``self.probe_ports``
+        """
+        with ExitStack() as stack:
+            comm_ports = stack.enter_context(self.probe_comm_ports())
+            probe_sessions = []
+            for comm_port in comm_ports:
+                parser = Frame_Parser(self.probe_unit, self.accept_range_change, self.probe_decimals)
+                probe_session = stack.enter_context(Probe_Session(comm_port, parser=parser))
+                # readings are buffered in the background, including while the stages move
+                probe_session.start_reader(self.probe_buffer_size)
+                probe_sessions.append(probe_session)
+            try:
+                yield probe_sessions
+            finally:
+                for index, probe_session in enumerate(probe_sessions):
+                    label = 'Probe' if len(probe_sessions) == 1 else 'Probe {} ({})'.format(index + 1, self.probe_ports[index])
+                    if self.scan_mode != 'continuous':
+                        # readings of a continuous scan are not requested one at a time
+                        probe_session.print_latency_stats(label)
+                    probe_session.parser.print_stats(label)
+
+
+    def print_motion_stats(self):
+        """Prints how many moves were made with all axes together and how many with Z after the other axes.
+        """
+        if self.motion_mode == 'concurrent':
+            print('Moves with all axes together: %d, moves with Z after X, Y and rotation: %d'
+                  % (self.merged_moves, self.sequential_moves))
 
 
     def verify_bounds(self, Xval, Yval, Zval, angle):
@@ -179,18 +478,100 @@ class Controller (Mapper):
 
     # Get warning flags
     def check_warnings(self):
-        """Checks for Zaber warning flags across all Zaber devices and prints them to user console.
+        """Checks for Zaber warning flags across all Zaber devices.
+
+        While ``self.warning_monitor`` is running (see ``watch_warnings()``), the flags are polled by its background thread and this
+        only raises the error it recorded, without communicating with the devices. Otherwise, the flags of every device are read and
+        printed to user console.
+
+        Raises:
+            Stage_Warning_Error: if the warning monitor found an actionable flag
         """
+        if self.warning_monitor.is_running():
+            self.warning_monitor.check()
+            return
         for dev in self.device_list:
             warning_flags = dev.warnings.get_flags()
             if len(warning_flags) > 0:
                 print(f"Device is stalling (or flag: {warning_flags})!")
+
+
+    @contextmanager
+    def watch_warnings(self, stages):
+        """Polls the warning flags of the stages in the background for the duration of a ``with`` block, and prints how many 
+        times each flag appeared at the end.
+
+        Args:
+            stages (Stage_Session): open stage session
+
+        Yields:
+            Warning_Monitor: the running ``self.warning_monitor``
+        """
+        self.warning_monitor.start(stages.device_list)
+        try:
+            yield self.warning_monitor
+        finally:
+            self.warning_monitor.stop()
+            self.warning_monitor.print_summary()
+
+
+    @contextmanager
+    def record_profile(self, start_index = 0, resume = False):
+        """Records the timing profile of the points mapped in a ``with`` block into ``self.profile_filename``, see ``Run_Profiler``. 
+        Nothing is recorded if ``self.profile_run`` is False, or for continuous scans, which do not stop at each point.
+
+        Args:
+            start_index (int, optional): index in the path of the first point. Defaults to 0.
+            resume (bool, optional): True to append to the profile of the resumed run. Defaults to False.
+        """
+        if not self.profile_run or (self.collect_data and self.scan_mode == 'continuous'):
+            yield
+            return
+        mode = 'a' if resume and os.path.exists(self.profile_filename) else 'w'
+        self.profiler.open(self.profile_filename, mode, start_index)
+        try:
+            yield
+        finally:
+            self.profiler.close()
+            print('Timing profile written to {}, see option 5 of the main menu.'.format(self.profile_filename))
+
+
+    def print_profile(self):
+        """Prints the timing profile of the last run, see ``print_profile_report()``.
+        """
+        print_profile_report(self.profile_filename)
             
 
+    def data_sink(self, mode, on_checkpoint = None, path_file = True):
+        """Creates the sink that writes the data of a run into ``self.data_run_filename``: a ``Data_Sink`` for CSV files, or a
+        ``Data_Store`` if ``self.data_format`` is 'columnar'. A new store starts with the metadata of the run: profile, config
+        file and snapshot of the configurations, path file and its hash, and start time.
+
+        Args:
+            mode (string): 'w' to start a new file, 'a' to append to it
+            on_checkpoint (function, optional): called with the sink after every checkpoint. Defaults to None.
+            path_file (bool, optional): True if the run follows ``self.path_run_filename``. Defaults to True.
+
+        Returns:
+            Data_Sink: sink to use in a ``with`` block
+        """
+        if self.data_format != 'columnar':
+            return Data_Sink(self.data_run_filename, self.datalogger.header, self.data_flush_rows, self.data_flush_sec,
+                             mode, on_checkpoint)
+        metadata = {'profile' : Mapper.profile,
+                    'config_filename' : Mapper.config_filename,
+                    'config' : self.config_dict,
+                    'path_filename' : self.path_run_filename if path_file else None,
+                    'path_hash' : file_hash(self.path_run_filename) if path_file and mode == 'w' else None,
+                    'start_time' : time()}
+        return Data_Store(self.data_run_filename, self.datalogger.header, self.data_flush_rows, self.data_flush_sec,
+                          mode, on_checkpoint, metadata)
+
+
     def run_edges(self):
         """This function runs the mapper through the edges of the mapping path. 
 
-        This function will require connection to Zaber stages. It does not home any stages automatically. The acceleration will 
+        This function will require connection to Zaber stages, or simulated stages (see ``self.backend``). It does not home any stages automatically. The acceleration will 
         be limited to that of ``self.max_accelX``, ``self.max_accelY``, ``self.max_accelZ`` respectively. 
 
         This function will also be reading the CSV filespecified in ``self.points_edges``, which contains the edges path. The program 
@@ -199,50 +580,58 @@ class Controller (Mapper):
         When running the edges path, 1 second of damping time is used. This time is currently not configurable. It is chosen so the 
         mapper can move quickly through all points on the edges. No data is taken and connection to the probe is not required.
         """
-        Library.enable_device_db_store()
-
-        with Connection.open_serial_port(self.comm_port_zaber) as connection:
-            # establish serial connections
-            self.device_list = connection.detect_devices()
-
-            # initialize structures for devices and axis
-            deviceX = self.device_list[1] # transverse horizontal, second stage
-            deviceY = self.device_list[2] # transverse vertical, third stage
-            deviceZ = self.device_list[0] # parallel to beamline, first stage
-            deviceR = self.device_list[3] # last rotation stage
-
-            self.axisX = deviceX.get_axis(1)
-            self.axisY = deviceY.get_axis(1)
-            self.axisZ = deviceZ.get_axis(1)
-            self.axisR = deviceR.get_axis(1)
-
-            # set max acceleration in each direction
-            deviceX.settings.set('accel', self.max_accelX, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
-            deviceY.settings.set('accel', self.max_accelY, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
-            deviceZ.settings.set('accel', self.max_accelZ, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
-
-            # actually run the stages
-            with open(self.path_edges_filename, 'r') as read_obj:
-                csv_reader = reader(read_obj)
-                header = next(csv_reader)
-
-                # Check file is not empty
-                if header != None:
-                    for row in csv_reader:
-                        x,y,z,rot = [float(i) for i in row]
+        with self.stage_session.use() as stages:
+            self.setup_stages(stages)
+
+            with self.watch_warnings(stages):
+                # actually run the stages, reading the path one chunk at a time
+                for chunk in iter_csv_chunks(self.path_edges_filename, self.path_chunk_size):
+                    for x,y,z,rot in chunk.tolist():
                         # move the mapper to position
                         self.moveXYZR(x,y,z, rot, Units.LENGTH_MILLIMETRES, Units.ANGLE_DEGREES)
                         self.check_warnings()
                         # Wait for oscillation to damp out
-                        sleep(1)
+                        self.backend.sleep(1)
+                self.print_motion_stats()
 
             
 
+    def map_points(self, path_chunks, probe_sessions):
+        """Moves to every point of the mapping path and logs one reading at each point. Called by ``run()`` once the stages, 
+        the data file and the probe session are ready.
+
+        Args:
+            path_chunks (iterable): numpy arrays of points with 4 columns for X, Y, Z and rotation
+            probe_sessions (list): open probe connections (``Probe_Session``) with their background readers running. The first 
+                                   probe is used to detect when the field has settled, since all probes share the same mount.
+        """
+        for chunk in path_chunks:
+            for x,y,z,rot in chunk.tolist():
+                self.profiler.begin_point()
+                if self.verify_bounds(x,y,z,rot):
+                    # move the mapper to position
+                    self.moveXYZR(x,y,z,rot, Units.LENGTH_MILLIMETRES, Units.ANGLE_DEGREES)
+                    motion_end = monotonic()
+                    self.check_warnings()
+                    if self.settle_mode == 'adaptive':
+                        # Wait until the live readings show the oscillation has damped out
+                        not_before = self.settle_detector.wait_until_settled(probe_sessions[0].buffer, motion_end)
+                        self.profiler.lap('settle')
+                    else:
+                        # Wait for oscillation to damp out: the first reading sent after the stop time is
+                        # taken from the buffer as soon as it arrives
+                        not_before = motion_end + self.probe_stop_time
+                    self.datalogger.log_data(x,y,z,rot, not_before=not_before)
+                else:
+                    self.datalogger.log_data(x,y,z,rot, in_bounds=False)
+                self.profiler.end_point()
+
+
     # Main function to be accessed outside
-    def run(self):
+    def run(self, path_chunks = None, resume = False, append = False):
         """This function runs the mapper through the full mapping path.
 
-        This function will require connection to Zaber stages. It does not home any stages automatically. The acceleration will 
+        This function will require connection to Zaber stages, or simulated stages (see ``self.backend``). It does not home any stages automatically. The acceleration will 
         be limited to that of ``self.max_accelX``, ``self.max_accelY``, ``self.max_accelZ`` respectively. 
 
         This function will also be reading the CSV file whose name is give by ``self.points``, which contains the mapping path. The program 
@@ -252,75 +641,187 @@ class Controller (Mapper):
         simultaneously, followed by separate Z direction motion. Due to the path setup, Z direction motion is maximized, X,Y, and rotation motions 
         are minimized. To change this order, make changes in the ``Points_Generator`` class.
 
+        When collecting data, a single ``Probe_Session`` per probe is opened for the whole run and shared with the datalogger. Its background reader 
+        buffers every probe reading, so the first reading sent ``self.probe_stop_time`` seconds after the motion ends is recorded as soon as 
+        it arrives. The probe read latency statistics are printed at the end of the run. With several probes in ``self.probe_ports``, 
+        all of them are read at every point and each data row holds the value and unit of every probe, so the components of the field 
+        measured by a multi-axis probe are mapped in one pass, with a single angle in 'rotation_points'.
+
+        If ``self.settle_mode`` is 'adaptive', the fixed pause is replaced by ``Settle_Detector.wait_until_settled()``, which records 
+        the point as soon as the readings stop changing. The actual dwell of each point is kept in ``self.settle_detector.dwells``.
+        The edges path and runs without data collection have no probe readings to watch and keep their fixed pause.
+
+        The data file is held open by a ``Data_Sink`` for the whole run and written in batches of ``self.data_flush_rows`` rows, 
+        or every ``self.data_flush_sec`` seconds. The rows still in memory are written when the run ends or is interrupted with Ctrl-C.
+        If ``self.data_format`` is 'columnar', a ``Data_Store`` writes each batch as a compressed chunk of columns instead, see 
+        ``data_sink()``.
+
+        The path is consumed one chunk at a time, so memory use does not grow with the size of the map.
+
+        The time each point spends moving, waiting for the stages, settling, reading the probe and writing the row is recorded in 
+        ``self.profile_filename`` (see ``record_profile()``). ``print_profile()`` prints the percentiles of each phase.
+
+        If ``self.scan_mode`` is 'continuous' and data is collected, each Z column is swept without stopping and the field at each point is 
+        interpolated from the readings taken on the way, see ``Continuous_Scanner``.
+
+        When data is collected along ``self.path_run_filename``, the progress of the run is recorded in a ``Run_Journal`` at every checkpoint 
+        of the data file. With ``resume`` set to True, a run interrupted by Ctrl-C or a crash continues from the first point without data: 
+        the data file is cut back to its last checkpoint and appended to. The run is only resumed if the path file has not changed.
+
+        The warning flags of the stages are polled in the background during the run (see ``watch_warnings()``), instead of after every 
+        move. An actionable flag such as a stall stops the run with a ``Stage_Warning_Error``; the data collected so far is kept and 
+        the run can be resumed.
+
+        Args:
+            path_chunks (iterable, optional): numpy arrays of points with 4 columns for X, Y, Z and rotation, e.g. directly from 
+                                              ``Points_Generator.iter_points()``. Defaults to None, i.e. read ``self.path_run_filename`` 
+                                              in chunks of ``self.path_chunk_size`` points. A binary '.npy' path is memory mapped, 
+                                              so the run starts without parsing the file.
+            resume (bool, optional): True to resume the run recorded in ``self.journal_filename``. Defaults to False.
+            append (bool, optional): True to append the data of ``path_chunks`` to the data file (and the timing profile) instead 
+                                     of starting a new one, e.g. for the points added by ``run_adaptive()``. Defaults to False.
         """
+        # record the progress of runs along the path file, so that they can be resumed
+        journal = None
+        start_index = 0
+        if path_chunks is None and self.collect_data:
+            journal = Run_Journal(self.journal_filename)
+            if resume:
+                try:
+                    start_index = journal.check_resume(self.path_run_filename, self.data_run_filename)
+                except ValueError as error:
+                    print('\nCannot resume the run: %s\n' % error)
+                    return
+                print('Resuming the run at point %d.' % start_index)
+            else:
+                journal.start(self.path_run_filename, self.data_run_filename)
+        elif resume:
+            print('\nOnly runs collecting data along the path file can be resumed.\n')
+            return
+
         # Reading from a CSV file and moving the gantry
         # Initialize all stages
-        Library.enable_device_db_store()
+        with self.stage_session.use() as stages:
+            self.setup_stages(stages)
+            with self.watch_warnings(stages), self.record_profile(start_index, resume or append):
+                deviceZ = stages.devices['z']
 
-        with Connection.open_serial_port(self.comm_port_zaber) as connection:
-            # establish serial connections
-            self.device_list = connection.detect_devices()
-            
-            # initialize structures for devices and axis
-            deviceX = self.device_list[1] # parallel to magnet, horizontal, second stage
-            deviceY = self.device_list[2] # parallel to magnet, vertical, third stage
-            deviceZ = self.device_list[0] # orthogonal to magnet, first stage
-            deviceR = self.device_list[3] # last rotation stage
-
-            self.axisX = deviceX.get_axis(1)
-            self.axisY = deviceY.get_axis(1)
-            self.axisZ = deviceZ.get_axis(1)
-            self.axisR = deviceR.get_axis(1)
-
-            # set max velocity in each direction
-            deviceX.settings.set('accel', self.max_accelX, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
-            deviceY.settings.set('accel', self.max_accelY, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
-            deviceZ.settings.set('accel', self.max_accelZ, Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED)
-
-            # actually run the stages
-            with open(self.path_filename, 'r') as read_obj:
-                csv_reader = reader(read_obj)
-                header = next(csv_reader)
+                # actually run the stages
+                if path_chunks is None:
+                    path_chunks = iter_path_chunks(self.path_run_filename, self.path_chunk_size, start_index)
 
                 if self.collect_data:
-                    # open the data csv and write the header
-                    # newline = '' prevents extra lines between data points
-                    with open(self.data_filename, 'w', newline='') as write_obj:
-                        csv_writer = writer(write_obj)
-                        data = ['X', 'Y', 'Z', 'Rotation', 'Data', 'Unit']
-                        csv_writer.writerow(data)
-
-                    # Check file is not empty
-                    if header != None:
-                        for row in csv_reader:
-                            x,y,z,rot = [float(i) for i in row]
-                            if self.verify_bounds(x,y,z,rot):
-                                # move the mapper to position
-                                self.moveXYZR(x,y,z,rot, Units.LENGTH_MILLIMETRES, Units.ANGLE_DEGREES)
-                                self.check_warnings()
-                                # Wait for oscillation to damp out
-                                sleep(self.probe_stop_time)
-                                # Write data into new csv file
-                                self.datalogger.log_data(x,y,z,rot)
-                            else:
-                                self.datalogger.log_data(x,y,z,rot, in_bounds=False)
+                    # every checkpoint of the data file is recorded in the journal, each point of the path writes one row
+                    if journal is not None:
+                        on_checkpoint = lambda sink: journal.save(start_index + sink.rows_written, sink.size())
+                    else:
+                        on_checkpoint = None
+
+                    # open the data file and write the header (or append to it when resuming), the file is kept open for the whole run
+                    with self.data_sink('a' if resume or append else 'w', on_checkpoint, journal is not None) as data_sink:
+                        self.datalogger.data_sink = data_sink
+                        self.datalogger.profiler = self.profiler
+                        try:
+                            # keep the probe connections open for the whole run
+                            with self.probe_sessions() as probe_sessions:
+                                self.datalogger.probe_sessions = probe_sessions
+                                try:
+                                    if self.scan_mode == 'continuous':
+                                        Continuous_Scanner().run(self, deviceZ, path_chunks, probe_sessions)
+                                    else:
+                                        self.map_points(path_chunks, probe_sessions)
+                                finally:
+                                    self.datalogger.probe_sessions = None
+                                    self.settle_detector.print_stats()
+                                    if self.sample_averager is not None:
+                                        self.sample_averager.print_stats()
+                        finally:
+                            self.datalogger.data_sink = None
+                            self.datalogger.profiler = None
+                    if journal is not None:
+                        journal.save(journal.state['next_index'], journal.state['data_offset'], completed=True)
 
                 # not saving data case
                 else:
-                    # Check file is not empty
-                    if header != None:
-                        for row in csv_reader:
-                            x,y,z,rot = [float(i) for i in row]
+                    for chunk in path_chunks:
+                        for x,y,z,rot in chunk.tolist():
+                            self.profiler.begin_point()
                             # move the mapper to position
                             self.moveXYZR(x,y,z,rot, Units.LENGTH_MILLIMETRES, Units.ANGLE_DEGREES)
                             self.check_warnings()
                             # Wait for oscillation to damp out
-                            sleep(self.probe_stop_time)
+                            self.backend.sleep(self.probe_stop_time)
+                            self.profiler.lap('settle')
+                            self.profiler.end_point()
+                self.print_motion_stats()
 
 
+    def run_adaptive(self, resume = False):
+        """Maps along the path, then adds points where the field changes too quickly for the spacing of the path.
 
-    
+        The path generated by ``Points_Generator`` is run first, as by ``run()``, and is used as a coarse grid. The data file is
+        then read back and an ``Adaptive_Refiner`` chooses the points to add, where the linear interpolation of the field between
+        the points of the grid is estimated to be off by more than ``self.refine_tolerance``. These points are mapped and appended
+        to the data file, and the data is read again to choose the next points, until the map is within the tolerance, the points
+        would be closer than ``self.refine_min_spacing`` or ``self.refine_max_levels`` levels have been added.
 
+        With ``self.refine_time_budget``, each level is cut to the points that fit in the time left, at the average time per point
+        of the run so far, starting with the cells with the largest error. The time of the run is kept in the journal (see
+        ``Run_Journal.elapsed()``), so a resumed run only gets the time left by the sessions before it. The data file is not on a grid anymore, it can be
+        interpolated with ``Field_Map``.
 
+        With ``resume`` set to True, an interrupted path run is resumed first (see ``run()``). Points already in the data file are
+        never mapped again, so an interrupted refinement continues where it stopped.
 
+        Args:
+            resume (bool, optional): True to resume the run recorded in ``self.journal_filename``. Defaults to False.
+        """
+        journal = Run_Journal(self.journal_filename)
+        if not (resume and journal.load() is not None and journal.state['completed']):
+            self.run(resume=resume)
+        # the time of the path run, and of the sessions before, was recorded by run()
+        if not self.collect_data or not os.path.exists(self.data_run_filename) or journal.load() is None:
+            print('\nAdaptive mapping needs the data of the path run.\n')
+            return
+        try:
+            self.refine(journal)
+        finally:
+            # record the time spent refining, for the next session if this one is interrupted
+            journal.save(journal.state['next_index'], journal.state['data_offset'], journal.state['completed'])
+
+
+    def refine(self, journal):
+        """Adds the points of every level of refinement, see ``run_adaptive()``.
 
+        Args:
+            journal (Run_Journal): journal of the path run, loaded, which gives the time spent on the run so far
+        """
+        refiner = Adaptive_Refiner(self.refine_tolerance, self.refine_min_spacing, self.refine_max_levels)
+        refiner.start(iter_path_chunks(self.path_run_filename, self.path_chunk_size))
+        columns = [column for column in self.datalogger.header if column.startswith('Data')]
+        level = 0
+        while True:
+            points_mapped = 0
+            for probe, column in enumerate(columns):
+                points, values, unit = load_data(self.data_run_filename, column)
+                refiner.add_data(points, values, probe)
+                points_mapped = max(points_mapped, len(points))
+
+            max_points = None
+            if self.refine_time_budget is not None:
+                elapsed = journal.elapsed()
+                max_points = int((self.refine_time_budget - elapsed) / (elapsed / max(points_mapped, 1)))
+                if max_points <= 0:
+                    print('Adaptive mapping: time budget of %.0f s used.' % self.refine_time_budget)
+                    break
+            new_points = refiner.next_points(max_points)
+            level += 1
+            if len(new_points) > 0:
+                print('\n*************** Adaptive mapping: adding %d points (level %d) ***************\n' % (len(new_points), level))
+                self.run([new_points], append=True)
+            elif len(refiner.cells) == 0:
+                break
+            elif refiner.deferred == len(refiner.cells):
+                print('Adaptive mapping: the time left is too short for the %d cells still over the tolerance.' % refiner.deferred)
+                break
+        print('Adaptive mapping done: %d points with data in %s.' % (len(refiner.values[0]) if refiner.values else 0, self.data_run_filename))
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+import json
+import os
+import re
+import csv
+import struct
+import sys, getopt
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from mapper_data_store import is_store, load_store, rows_to_columns, decode_text, csv_to_store, store_filename
+from mapper_field_map import convert_units
+
+# name of a run, e.g. 'BL4N-STY1-08x12x80-2x2x2-220331-1455' or 'BL4N-Q2-100x0x1000-5x0x25-340-220404-1645': beamline, magnet,
+# X x Y x Z ranges, X x Y x Z spacing, an optional tag, then the date (yymmdd) and time (hhmm) of the run
+RUN_NAME_PATTERN = re.compile(r'(?P<beamline>[A-Za-z0-9]+)-(?P<magnet>[A-Za-z0-9]+)-(?P<ranges>\d+x\d+x\d+)-(?P<spacing>\d+x\d+x\d+)'
+                              r'(?:-(?P<tag>[^-]+))?-(?P<date>\d{6})-(?P<time>\d{4})')
+
+
+def parse_run_name(filename):
+    """Reads the description of a run from the name of its data file.
+
+    Args:
+        filename (string): data file, e.g. 'data/BL4N-STY1-08x12x80-2x2x2-220331-1455.csv'
+
+    Returns:
+        dict: 'beamline', 'magnet', 'ranges' and 'spacing' (lists of 3 numbers for X, Y and Z, as written in the name), 'tag'
+              and 'timestamp' (ISO format), all None if the name does not follow ``RUN_NAME_PATTERN``
+    """
+    match = RUN_NAME_PATTERN.fullmatch(os.path.splitext(os.path.basename(filename))[0])
+    if match is None:
+        return {'beamline' : None, 'magnet' : None, 'ranges' : None, 'spacing' : None, 'tag' : None, 'timestamp' : None}
+    try:
+        timestamp = datetime.strptime(match.group('date') + match.group('time'), '%y%m%d%H%M').isoformat()
+    except ValueError:
+        timestamp = None
+    return {'beamline' : match.group('beamline'),
+            'magnet' : match.group('magnet'),
+            'ranges' : [int(i) for i in match.group('ranges').split('x')],
+            'spacing' : [int(i) for i in match.group('spacing').split('x')],
+            'tag' : match.group('tag'),
+            'timestamp' : timestamp}
+
+
+def read_columns(filename):
+    """Reads every column of a data CSV file or data store.
+
+    Args:
+        filename (string): data file
+
+    Returns:
+        (dict, list): numpy array of each column (see ``rows_to_columns()``) and the column names of the data CSV layout
+    """
+    if is_store(filename):
+        columns, metadata = load_store(filename)
+        return columns, metadata['header']
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = rows_to_columns([row for row in reader if len(row) > 0], header)
+    for name, values in columns.items():
+        if values.dtype.kind == 'S':
+            columns[name] = decode_text(values)
+    return columns, header
+
+
+def index_file(filename):
+    """Describes one data file for the catalog. Runs in the worker processes of ``Data_Catalog.update()``.
+
+    Args:
+        filename (string): data CSV file or data store
+
+    Returns:
+        dict: description of the run, see ``Data_Catalog``
+    """
+    stat = os.stat(filename)
+    entry = {'filename' : filename,
+             'format' : 'store' if filename.endswith('.mapdata') else 'csv',
+             'size' : stat.st_size,
+             'mtime' : stat.st_mtime}
+    entry.update(parse_run_name(filename))
+    try:
+        columns, header = read_columns(filename)
+    except (OSError, ValueError, KeyError, struct.error, zlib.error) as error:
+        # e.g. a data store damaged on the disk, whose columns do not decompress
+        entry['error'] = str(error)
+        return entry
+
+    data_columns = [name for name in header if name.startswith('Data')]
+    rows = len(columns['X']) if 'X' in columns else 0
+    valid = np.zeros(rows, dtype=bool)
+    probes = []
+    for column in data_columns:
+        # a data store without any row has no columns
+        data = columns.get(column, np.zeros(0))
+        probe_valid = ~np.isnan(data)
+        valid |= probe_valid
+        unit_column = column.replace('Data', 'Unit')
+        values, unit = convert_units(data[probe_valid], columns[unit_column][probe_valid] if unit_column in columns else None)
+        probes.append({'column' : column, 'unit' : unit,
+                       'min' : float(np.min(values)) if len(values) else None,
+                       'max' : float(np.max(values)) if len(values) else None})
+
+    entry.update(rows=rows, points=int(np.sum(valid)), no_value=int(rows - np.sum(valid)), probes=probes)
+    if np.any(valid):
+        points = np.column_stack([columns[name][valid] for name in ('X', 'Y', 'Z')])
+        entry['bounds'] = [np.min(points, axis=0).tolist(), np.max(points, axis=0).tolist()]
+        entry['rotations'] = np.unique(columns['Rotation'][valid]).tolist()
+    else:
+        entry['bounds'] = None
+        entry['rotations'] = []
+    return entry
+
+
+def convert_file(filename):
+    """Converts a data CSV file into a data store, unless the store is newer. Runs in the worker processes of ``Data_Catalog.update()``.
+
+    The store is written atomically: a temporary file is written and renamed over the store, so that a conversion cut short
+    does not leave a truncated store newer than the CSV file, which would never be converted again.
+
+    Args:
+        filename (string): data CSV file
+
+    Returns:
+        string: name of the data store
+    """
+    store = store_filename(filename)
+    if not os.path.exists(store) or os.path.getmtime(store) < os.path.getmtime(filename):
+        temporary = store + '.tmp'
+        # a temporary file may be left by a conversion cut short
+        csv_to_store(filename, temporary, overwrite=True)
+        os.replace(temporary, store)
+    return store
+
+
+def list_data_files(folder):
+    """Lists the data files of a folder: data CSV files and data stores, but not the timing profiles (see ``Run_Profiler``).
+
+    Args:
+        folder (string): data folder, e.g. 'data'
+
+    Returns:
+        list: file names, sorted
+    """
+    names = [name for name in os.listdir(folder)
+             if (name.endswith('.csv') and not name.endswith('.profile.csv')) or name.endswith('.mapdata')]
+    return sorted(os.path.join(folder, name) for name in names)
+
+
+class Data_Catalog():
+    """The ``Data_Catalog`` class indexes the data files of an archive folder in a single JSON file, so that runs can be found
+    without reading every data file again.
+
+    Each data file gets one entry:
+
+    ===============    =============================================================
+    Key                Description
+    ===============    =============================================================
+    'filename'         path of the data file
+    'format'           'csv' or 'store' (see ``Data_Store``)
+    'size', 'mtime'    size and modification time of the file when it was indexed
+    'beamline',        description read from the file name, see ``parse_run_name()``. None if the name does not follow
+    'magnet', ...      ``RUN_NAME_PATTERN``
+    'rows'             number of rows
+    'points'           number of rows with a field value
+    'no_value'         number of rows without one, e.g. 'out of motion bounds'
+    'bounds'           [[X, Y, Z] min, [X, Y, Z] max] of the points with a value, in mm
+    'rotations'        rotation angles of the points, in degrees
+    'probes'           for each probe: data column, unit, and the lowest and highest field
+    'error'            only if the file could not be read
+    ===============    =============================================================
+
+    ``update()`` only reads the files that are new or changed since the last update (by size and modification time), in
+    parallel in a process pool, and drops the entries of deleted files.
+    """
+    def __init__(self, filename):
+        """Initializes the ``Data_Catalog`` class and loads the catalog file if there is one.
+
+        Args:
+            filename (string): catalog JSON file, e.g. 'data/catalog.json'
+        """
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                self.entries = {entry['filename'] : entry for entry in json.load(f)['entries']}
+
+
+    def save(self):
+        """Writes the catalog, atomically: a temporary file is written and renamed over the catalog.
+        """
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'updated' : datetime.now().isoformat(), 'entries' : list(self.entries.values())}, f, indent=1)
+        os.replace(temporary, self.filename)
+
+
+    def update(self, folder, workers = None, convert = False):
+        """Indexes the new and changed data files of a folder, and saves the catalog.
+
+        Args:
+            folder (string): data folder, e.g. 'data'
+            workers (int, optional): number of worker processes. Defaults to None, i.e. one per CPU.
+            convert (bool, optional): True to first convert every data CSV file into a data store, see ``csv_to_store()``.
+                                      The stores are indexed too. Defaults to False.
+
+        Returns:
+            (int, int): number of files indexed and number of files unchanged
+        """
+        folder = os.path.normpath(folder)
+        with ProcessPoolExecutor(workers) as executor:
+            if convert:
+                csv_files = [filename for filename in list_data_files(folder) if filename.endswith('.csv')]
+                list(executor.map(convert_file, csv_files))
+
+            filenames = list_data_files(folder)
+            changed = []
+            for filename in filenames:
+                entry = self.entries.get(filename)
+                stat = os.stat(filename)
+                if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                    changed.append(filename)
+            for entry in executor.map(index_file, changed):
+                self.entries[entry['filename']] = entry
+
+        # entries of files that are not in the folder anymore
+        for filename in list(self.entries):
+            if os.path.dirname(filename) == folder and filename not in filenames:
+                del self.entries[filename]
+        self.save()
+        return len(changed), len(filenames) - len(changed)
+
+
+    def query(self, beamline = None, magnet = None, tag = None, file_format = None, date_from = None, date_to = None,
+              contains = None, min_points = 0):
+        """Finds the runs that match every filter given.
+
+        Args:
+            beamline (string, optional): e.g. 'BL4N'. Defaults to None.
+            magnet (string, optional): e.g. 'STY1'. Defaults to None.
+            tag (string, optional): tag of the file name, e.g. '340'. Defaults to None.
+            file_format (string, optional): 'csv' or 'store'. Defaults to None.
+            date_from (string, optional): first date, 'YYYY-MM-DD'. Defaults to None.
+            date_to (string, optional): last date, 'YYYY-MM-DD', included. Defaults to None.
+            contains (list, optional): [X, Y, Z] point in mm that must be inside the bounds of the run. Defaults to None.
+            min_points (int, optional): least number of points with a value. Defaults to 0.
+
+        Returns:
+            list: matching entries, sorted by date
+        """
+        matches = []
+        for entry in self.entries.values():
+            if ((beamline is not None and entry['beamline'] != beamline) or (magnet is not None and entry['magnet'] != magnet)
+                    or (tag is not None and entry['tag'] != tag) or (file_format is not None and entry['format'] != file_format)):
+                continue
+            date = entry['timestamp'][:10] if entry['timestamp'] is not None else None
+            if (date_from is not None or date_to is not None) and date is None:
+                continue
+            if (date_from is not None and date < date_from) or (date_to is not None and date > date_to):
+                continue
+            if entry.get('points', 0) < min_points:
+                continue
+            if contains is not None:
+                if entry.get('bounds') is None:
+                    continue
+                low, high = np.array(entry['bounds'])
+                if np.any(np.array(contains) < low) or np.any(np.array(contains) > high):
+                    continue
+            matches.append(entry)
+        return sorted(matches, key=lambda entry: (entry['timestamp'] or '', entry['filename']))
+
+
+def print_entries(entries):
+    """Prints one line per run: file, magnet, date, number of points, bounds and field range of the first probe.
+
+    Args:
+        entries (list): catalog entries, e.g. from ``Data_Catalog.query()``
+    """
+    print('%-50s %-6s %-16s %7s  %-40s %s' % ('file', 'magnet', 'date', 'points', 'bounds (mm)', 'field'))
+    for entry in entries:
+        if 'error' in entry:
+            print('%-50s could not be read: %s' % (os.path.basename(entry['filename']), entry['error']))
+            continue
+        bounds = ''
+        if entry['bounds'] is not None:
+            bounds = ' '.join('%s %g:%g' % (axis, low, high) for axis, low, high in zip('XYZ', *entry['bounds']))
+        field = ''
+        if len(entry['probes']) > 0 and entry['probes'][0]['min'] is not None:
+            probe = entry['probes'][0]
+            field = '%g to %g %s' % (probe['min'], probe['max'], probe['unit'] or '')
+        timestamp = entry['timestamp'].replace('T', ' ')[:16] if entry['timestamp'] is not None else ''
+        print('%-50s %-6s %-16s %7d  %-40s %s' % (os.path.basename(entry['filename']), entry['magnet'] or '', timestamp,
+                                                   entry['points'], bounds, field))
+
+
+def parse_date(text):
+    """Converts a date given as 'YYYY-MM-DD' or as in the file names, 'yymmdd', into 'YYYY-MM-DD'.
+    """
+    if re.fullmatch(r'\d{6}', text):
+        return datetime.strptime(text, '%y%m%d').date().isoformat()
+    return datetime.strptime(text, '%Y-%m-%d').date().isoformat()
+
+
+USAGE = ('mapper_data_index.py [-d <data_folder>] [-c <catalog_filename>] [-w <workers>] [--convert] [--beamline <name>] '
+         '[--magnet <name>] [--tag <tag>] [--format <csv|store>] [--from <date>] [--to <date>] [--contains <x,y,z>] [--min-points <n>]')
+
+
+def main(argv):
+    """Updates the catalog of a data folder, then prints the runs that match the filters given.
+
+    Options:
+
+    ========================    =============================================================
+    Option                      Description
+    ========================    =============================================================
+    -d <data_folder>            folder of the data files (defaults to 'data')
+    -c <catalog_filename>       catalog JSON file (defaults to 'catalog.json' in the data folder)
+    -w <workers>                number of worker processes (defaults to one per CPU)
+    --convert                   convert every data CSV file into a data store first
+    --beamline, --magnet,       filters, see ``Data_Catalog.query()``. Dates are 'YYYY-MM-DD' or 'yymmdd', the point of
+    --tag, --format, --from,    --contains is 'X,Y,Z' in mm.
+    --to, --contains,
+    --min-points
+    ========================    =============================================================
+
+    Args:
+        argv: list of arguments when starting the program
+    """
+    folder = 'data'
+    catalog_filename = None
+    workers = None
+    convert = False
+    filters = {}
+    try:
+        opts, args = getopt.getopt(argv, "hd:c:w:", ["convert", "beamline=", "magnet=", "tag=", "format=", "from=", "to=",
+                                                     "contains=", "min-points="])
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE)
+            sys.exit()
+        elif opt == '-d':
+            folder = arg
+        elif opt == '-c':
+            catalog_filename = arg
+        elif opt == '-w':
+            workers = int(arg)
+        elif opt == '--convert':
+            convert = True
+        elif opt in ('--beamline', '--magnet', '--tag'):
+            filters[opt[2:]] = arg
+        elif opt == '--format':
+            filters['file_format'] = arg
+        elif opt == '--from':
+            filters['date_from'] = parse_date(arg)
+        elif opt == '--to':
+            filters['date_to'] = parse_date(arg)
+        elif opt == '--contains':
+            filters['contains'] = [float(i) for i in arg.split(',')]
+        elif opt == '--min-points':
+            filters['min_points'] = int(arg)
+    if catalog_filename is None:
+        catalog_filename = os.path.join(folder, 'catalog.json')
+
+    catalog = Data_Catalog(catalog_filename)
+    indexed, unchanged = catalog.update(folder, workers, convert)
+    print('Catalog %s: %d files indexed, %d unchanged.\n' % (catalog_filename, indexed, unchanged))
+    print_entries(catalog.query(**filters))
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
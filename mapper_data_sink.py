@@ -0,0 +1,101 @@
+import os
+from csv import writer
+from time import monotonic
+
+class Data_Sink():
+    """The ``Data_Sink`` class keeps the mapping data CSV file open for a whole run and writes rows in batches, instead of opening
+    the file and creating a new ``csv.writer`` for every point.
+
+    Rows are held in memory and written once ``self.flush_rows`` rows are waiting or ``self.flush_sec`` seconds have passed since the
+    last write. Every batch is a checkpoint: the file is flushed and synced to disk with ``os.fsync``, so a crash loses at most one batch.
+    Use the class in a ``with`` block so the remaining rows are written and the file is closed on exit, including on Ctrl-C.
+
+    A function given as ``on_checkpoint`` is called after every checkpoint, e.g. to record the progress of the run in a ``Run_Journal``.
+    """
+    def __init__(self, filename, header = None, flush_rows = 50, flush_sec = 30.0, mode = 'w', on_checkpoint = None):
+        """Initializes the ``Data_Sink`` class. The file is not opened until ``open()`` is called or the sink is used in a ``with`` block.
+
+        Args:
+            filename (string): path and name of the CSV file, e.g. 'data/data.csv'
+            header (list, optional): header row written when the file is opened in 'w' mode. Defaults to None, i.e. no header.
+            flush_rows (int, optional): number of rows per batch. Defaults to 50.
+            flush_sec (float, optional): maximum time in seconds a row waits in memory before being written. Defaults to 30.0.
+            mode (string, optional): 'w' to start a new file, 'a' to append to an existing one. Defaults to 'w'.
+            on_checkpoint (function, optional): called with the sink after every checkpoint. Defaults to None.
+        """
+        self.filename = filename
+        self.header = header
+        self.flush_rows = flush_rows
+        self.flush_sec = flush_sec
+        self.mode = mode
+        self.on_checkpoint = on_checkpoint
+
+        self.file = None
+        self.csv_writer = None
+        self.rows = []
+        self.last_flush_time = monotonic()
+        self.rows_written = 0
+
+
+    def open(self):
+        """Opens the CSV file and writes the header if starting a new file.
+        """
+        # newline = '' prevents extra lines between data points
+        self.file = open(self.filename, self.mode, newline='')
+        self.csv_writer = writer(self.file)
+        if self.mode == 'w' and self.header is not None:
+            self.csv_writer.writerow(self.header)
+            self.checkpoint()
+        self.last_flush_time = monotonic()
+
+
+    def close(self):
+        """Writes the rows still held in memory, syncs them to disk and closes the file.
+        """
+        if self.file is not None:
+            self.checkpoint()
+            self.file.close()
+            self.file = None
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def write_row(self, row):
+        """Queues one row, and writes the batch if it is full or old enough.
+
+        Args:
+            row (list): one row of data, e.g. [X, Y, Z, Rotation, Data, Unit]
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_rows or monotonic() - self.last_flush_time >= self.flush_sec:
+            self.checkpoint()
+
+
+    def checkpoint(self):
+        """Writes every queued row, flushes the file and syncs it to disk, then calls ``self.on_checkpoint``.
+        """
+        if len(self.rows) > 0:
+            self.csv_writer.writerows(self.rows)
+            self.rows_written += len(self.rows)
+            self.rows = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush_time = monotonic()
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self)
+
+
+    def size(self):
+        """Returns the size of the file on disk, in bytes. Rows still held in memory are not counted.
+
+        Returns:
+            int: size in bytes
+        """
+        return os.fstat(self.file.fileno()).st_size
@@ -0,0 +1,492 @@
+import csv
+import io
+import json
+import os
+import struct
+import zlib
+from time import monotonic, time
+import numpy as np
+from mapper_data_sink import Data_Sink
+
+# first bytes of every data store
+MAGIC = b'MAPDATA1'
+# every block starts with a 4 byte tag and the length of what follows, in bytes
+BLOCK_HEADER = struct.Struct('<4sQ')
+# columns added to the columns of the data CSV
+EXTRA_COLUMNS = ['Time', 'Note', 'Cells', 'Text']
+
+
+def store_filename(data_filename):
+    """Returns the name of the data store that goes with a data CSV file, e.g. 'data/data.mapdata' for 'data/data.csv'.
+
+    Args:
+        data_filename (string): data CSV file name
+
+    Returns:
+        string: data store file name
+    """
+    return os.path.splitext(data_filename)[0] + '.mapdata'
+
+
+def is_store(filename):
+    """Checks whether a file is a data store rather than a CSV file.
+
+    Args:
+        filename (string): data file name
+
+    Returns:
+        bool: True if the file starts with ``MAGIC``
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def column_kind(name):
+    """Returns how a column of the data CSV is stored: 'text' for the units, 'number' for everything else.
+
+    Args:
+        name (string): column name, e.g. 'X', 'Data2' or 'Unit2'
+
+    Returns:
+        string: 'text' or 'number'
+    """
+    return 'text' if name.startswith('Unit') else 'number'
+
+
+def encode_text(texts):
+    """Stores strings as UTF-8 bytes, as short as the longest string.
+    """
+    return np.array([text.encode('utf-8') for text in texts], dtype=np.bytes_)
+
+
+def decode_text(values):
+    """Converts UTF-8 bytes from ``encode_text()`` back into strings.
+    """
+    try:
+        # much quicker, but only for ASCII, e.g. units and notes written by the Datalogger
+        return values.astype(str)
+    except UnicodeDecodeError:
+        return np.char.decode(values, 'utf-8')
+
+
+def row_text(row):
+    """Writes the cells of a row as one line of CSV text, without the line ending.
+    """
+    f = io.StringIO()
+    csv.writer(f, lineterminator='').writerow(row)
+    return f.getvalue()
+
+
+def rows_to_columns(rows, header, times = None):
+    """Converts rows of the data CSV layout into columns.
+
+    Numbers are stored as float64, NaN where a row has no number. A row may be shorter than the header, e.g.
+    [X, Y, Z, Rotation, 'out of motion bounds']: its number of cells is kept in 'Cells', and the first text found in a number
+    column in 'Note', so that ``columns_to_rows()`` gives the row back.
+
+    Numbers are written back by ``format_number()``, as the ``Datalogger`` writes them. A row that would not be given back
+    exactly, e.g. '6.610' in a file written by an older version, which would come back as '6.61', is also kept as CSV text in 'Text'.
+
+    Args:
+        rows (list): rows of the data CSV, e.g. [X, Y, Z, Rotation, Data, Unit]
+        header (list): column names of the data CSV
+        times (list, optional): ``time.time()`` at which each row was logged. Defaults to None, i.e. NaN.
+
+    Returns:
+        dict: numpy array of each column of ``header`` and ``EXTRA_COLUMNS``
+    """
+    numbers = np.full((len(rows), len(header)), np.nan)
+    texts = {name : [''] * len(rows) for name in header if column_kind(name) == 'text'}
+    notes = [''] * len(rows)
+    cells = np.empty(len(rows), dtype=np.int16)
+    raw = [''] * len(rows)
+    for i, row in enumerate(rows):
+        cells[i] = len(row)
+        # cells past the header are only kept in 'Text'
+        exact = len(row) <= len(header)
+        has_nan = False
+        for j, (name, cell) in enumerate(zip(header, row)):
+            if isinstance(cell, float) and name not in texts:
+                # rows logged by the Datalogger: written back as the CSV writer writes them
+                numbers[i, j] = cell
+                has_nan = has_nan or cell != cell
+                continue
+            text = str(cell)
+            if name in texts:
+                texts[name][i] = text
+                continue
+            try:
+                value = float(cell)
+            except ValueError:
+                if notes[i] == '':
+                    notes[i] = text
+                elif text != notes[i]:
+                    exact = False
+                continue
+            numbers[i, j] = value
+            has_nan = has_nan or value != value
+            if exact and format_number(name, value) != text:
+                exact = False
+        if not exact or (has_nan and notes[i] != ''):
+            raw[i] = row_text(row)
+
+    columns = {}
+    for j, name in enumerate(header):
+        columns[name] = encode_text(texts[name]) if name in texts else numbers[:, j]
+    columns['Time'] = np.array(times, dtype=float) if times is not None else np.full(len(rows), np.nan)
+    columns['Note'] = encode_text(notes)
+    columns['Cells'] = cells
+    columns['Text'] = encode_text(raw)
+    return columns
+
+
+def format_number(name, value):
+    """Formats a number like the ``Datalogger`` writes it, e.g. '0.0' for a position and '25' for a number of samples.
+    """
+    if name.startswith('Samples') and float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def columns_to_rows(columns, header):
+    """Converts columns back into rows of the data CSV layout, see ``rows_to_columns()``.
+
+    Args:
+        columns (dict): numpy array of each column
+        header (list): column names of the data CSV
+
+    Returns:
+        list: rows of strings
+    """
+    lists = [decode_text(columns[name]).tolist() if column_kind(name) == 'text' else columns[name].tolist() for name in header]
+    notes = decode_text(columns['Note']).tolist()
+    # stores written before 'Text' was added do not have it
+    raw = decode_text(columns['Text']).tolist() if 'Text' in columns else [''] * len(notes)
+    rows = []
+    for i, cells in enumerate(columns['Cells'].tolist()):
+        if raw[i] != '':
+            rows.append(next(csv.reader([raw[i]])))
+            continue
+        row = []
+        for name, values in zip(header[:cells], lists):
+            value = values[i]
+            if column_kind(name) == 'text':
+                row.append(value)
+            elif value != value and notes[i] != '':
+                # NaN where the row had a text, e.g. 'out of motion bounds'
+                row.append(notes[i])
+            else:
+                row.append(format_number(name, value))
+        rows.append(row)
+    return rows
+
+
+class Data_Store(Data_Sink):
+    """The ``Data_Store`` class writes the mapping data into a compact binary file, one column after the other, instead of a CSV
+    file. It is used like ``Data_Sink``, which it inherits: rows are queued with ``write_row()`` and written in batches, every
+    batch is a checkpoint synced to disk, and runs can be appended to and resumed with a ``Run_Journal``.
+
+    The file is a sequence of blocks, each a 4 byte tag and a 64 bit length followed by the content of the block:
+
+    ==========    =============================================================
+    Block         Content
+    ==========    =============================================================
+    'META'        JSON metadata of the run, written once when the file is created: column names of the data CSV, profile,
+                  config snapshot, path file and its hash, start time, ...
+    'CHNK'        one batch of rows: the length of a JSON description (4 bytes), the JSON description (number of rows, and
+                  the name, numpy type, codec and size in bytes of each column), then the bytes of each column, one after the other
+    ==========    =============================================================
+
+    Besides the columns of the data CSV (see ``Datalogger.header``), every chunk holds:
+
+    * 'Time': ``time.time()`` at which the row was logged, in seconds
+    * 'Note': the text of a row without a value, e.g. 'out of motion bounds'
+    * 'Cells': the number of cells of the row in the CSV layout
+    * 'Text': the row as CSV text, only for rows whose numbers would not be written back as they were, see ``rows_to_columns()``
+
+    With ``compress`` (the default), the bytes of each column are shuffled (the first byte of every value, then the second, ...)
+    and compressed with zlib: the coordinates of a map repeat and the values change slowly from point to point, so the bytes of
+    the same rank are much alike and the chunks shrink to a fraction of the CSV text. Loading a column is a decompression and a
+    ``numpy.frombuffer`` per chunk instead of parsing text, see ``load_store()``. A chunk cut short by a crash is ignored when
+    loading, and cut off by ``Run_Journal.check_resume()`` when the run is resumed.
+    """
+    def __init__(self, filename, header = None, flush_rows = 50, flush_sec = 30.0, mode = 'w', on_checkpoint = None, metadata = None,
+                 compress = True):
+        """Initializes the ``Data_Store`` class. The file is not opened until ``open()`` is called or the store is used in a ``with`` block.
+
+        Args:
+            filename (string): path and name of the store, e.g. from ``store_filename()``
+            header (list, optional): column names of the data CSV layout. Defaults to None.
+            flush_rows (int, optional): number of rows per chunk. Defaults to 50.
+            flush_sec (float, optional): maximum time in seconds a row waits in memory before being written. Defaults to 30.0.
+            mode (string, optional): 'w' to start a new file, 'a' to append to an existing one. Defaults to 'w'.
+            on_checkpoint (function, optional): called with the store after every checkpoint. Defaults to None.
+            metadata (dict, optional): information about the run, written in the 'META' block of a new file. Defaults to None.
+            compress (bool, optional): True to compress the columns, False to write their raw bytes. Defaults to True.
+        """
+        super().__init__(filename, header, flush_rows, flush_sec, mode, on_checkpoint)
+        self.metadata = metadata if metadata is not None else {}
+        self.compress = compress
+        self.times = []
+
+
+    def open(self):
+        """Opens the file and writes the magic bytes and the metadata if starting a new file.
+        """
+        self.file = open(self.filename, self.mode + 'b')
+        if self.mode == 'w':
+            write_metadata(self.file, self.metadata, self.header)
+            self.checkpoint()
+        self.last_flush_time = monotonic()
+
+
+    def write_row(self, row):
+        """Queues one row, with the time it was logged, and writes the chunk if it is full or old enough.
+
+        Args:
+            row (list): one row of data, e.g. [X, Y, Z, Rotation, Data, Unit]
+        """
+        self.times.append(time())
+        super().write_row(row)
+
+
+    def checkpoint(self):
+        """Writes every queued row as one chunk, flushes the file and syncs it to disk, then calls ``self.on_checkpoint``.
+        """
+        if len(self.rows) > 0:
+            write_chunk(self.file, rows_to_columns(self.rows, self.header, self.times), self.compress)
+            self.rows_written += len(self.rows)
+            self.rows = []
+            self.times = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush_time = monotonic()
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self)
+
+
+def write_metadata(f, metadata, header):
+    """Starts a new data store: writes the magic bytes and the 'META' block.
+
+    Args:
+        f (file): empty file opened in binary mode
+        metadata (dict): information about the run
+        header (list): column names of the data CSV layout
+    """
+    f.write(MAGIC)
+    write_block(f, b'META', json.dumps(dict(metadata, header=header), default=str).encode())
+
+
+def write_block(f, tag, payload):
+    """Writes one block: its tag, its length and its content.
+
+    Args:
+        f (file): file opened in binary mode
+        tag (bytes): 4 byte tag, e.g. b'CHNK'
+        payload (bytes): content of the block
+    """
+    f.write(BLOCK_HEADER.pack(tag, len(payload)))
+    f.write(payload)
+
+
+def encode_column(values, compress = True):
+    """Converts a column into the bytes written in a chunk.
+
+    Args:
+        values (numpy array): column
+        compress (bool, optional): True to shuffle and compress the bytes. Defaults to True.
+
+    Returns:
+        (string, bytes): codec ('zlib' or 'raw') and bytes of the column
+    """
+    values = np.ascontiguousarray(values)
+    if not compress or values.dtype.itemsize == 0:
+        return 'raw', values.tobytes()
+    # byte shuffle: byte 0 of every value, then byte 1, ...
+    shuffled = values.view(np.uint8).reshape(len(values), values.dtype.itemsize).T.tobytes()
+    return 'zlib', zlib.compress(shuffled, 1)
+
+
+def decode_column(data, dtype, codec, rows):
+    """Converts the bytes of a column from ``encode_column()`` back into an array.
+
+    Args:
+        data (bytes): bytes of the column
+        dtype (numpy dtype): type of the column
+        codec (string): 'zlib' or 'raw'
+        rows (int): number of values
+
+    Returns:
+        numpy array: column
+    """
+    if codec == 'raw':
+        return np.frombuffer(data, dtype, rows)
+    shuffled = np.frombuffer(zlib.decompress(data), np.uint8).reshape(dtype.itemsize, rows)
+    return shuffled.T.copy().view(dtype).reshape(rows)
+
+
+def write_chunk(f, columns, compress = True):
+    """Writes one 'CHNK' block holding the given columns.
+
+    Args:
+        f (file): file opened in binary mode
+        columns (dict): numpy array of each column, all of the same length
+        compress (bool, optional): True to shuffle and compress the columns, see ``encode_column()``. Defaults to True.
+    """
+    rows = len(next(iter(columns.values()))) if columns else 0
+    description = []
+    parts = []
+    for name, values in columns.items():
+        codec, data = encode_column(values, compress)
+        description.append([name, values.dtype.str, codec, len(data)])
+        parts.append(data)
+    description = json.dumps({'rows' : rows, 'columns' : description}).encode()
+    write_block(f, b'CHNK', struct.pack('<I', len(description)) + description + b''.join(parts))
+
+
+def iter_store_chunks(filename):
+    """Reads a data store and yields its chunks one at a time. A chunk cut short at the end of the file is skipped.
+
+    Args:
+        filename (string): data store, e.g. 'data/data.mapdata'
+
+    Yields:
+        dict: numpy array of each column of the chunk
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a data store.' % filename)
+        while True:
+            block_header = f.read(BLOCK_HEADER.size)
+            if len(block_header) < BLOCK_HEADER.size:
+                return
+            tag, length = BLOCK_HEADER.unpack(block_header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if tag != b'CHNK':
+                continue
+            description_length = struct.unpack_from('<I', payload)[0]
+            description = json.loads(payload[4:4 + description_length])
+            offset = 4 + description_length
+            view = memoryview(payload)
+            chunk = {}
+            for name, dtype, codec, length in description['columns']:
+                chunk[name] = decode_column(view[offset:offset + length], np.dtype(dtype), codec, description['rows'])
+                offset += length
+            yield chunk
+
+
+def load_metadata(filename):
+    """Reads the metadata of a data store.
+
+    Args:
+        filename (string): data store, e.g. 'data/data.mapdata'
+
+    Returns:
+        dict: metadata of the run, including the 'header' of the data CSV layout
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a data store.' % filename)
+        tag, length = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+        return json.loads(f.read(length)) if tag == b'META' else {}
+
+
+def load_store(filename, columns = None):
+    """Loads the columns of a data store.
+
+    Args:
+        filename (string): data store, e.g. 'data/data.mapdata'
+        columns (list, optional): names of the columns to load, e.g. ['X', 'Y', 'Z', 'Data']. Defaults to None, i.e. every column.
+
+    Returns:
+        (dict, dict): numpy array of each column (strings for the text columns), and the metadata of the run
+    """
+    metadata = load_metadata(filename)
+    parts = {}
+    for chunk in iter_store_chunks(filename):
+        for name, values in chunk.items():
+            if columns is None or name in columns:
+                parts.setdefault(name, []).append(values)
+    names = columns if columns is not None else metadata.get('header', []) + EXTRA_COLUMNS
+    loaded = {}
+    for name in names:
+        if name in parts:
+            loaded[name] = np.concatenate(parts[name])
+            if loaded[name].dtype.kind == 'S':
+                loaded[name] = decode_text(loaded[name])
+    return loaded, metadata
+
+
+def csv_to_store(csv_filename, filename = None, chunk_rows = 10000, metadata = None, compress = True, overwrite = False):
+    """Converts a data CSV file into a data store. Empty lines are dropped.
+
+    Args:
+        csv_filename (string): data CSV file, e.g. 'data/data.csv'
+        filename (string, optional): data store to write. Defaults to None, i.e. ``store_filename(csv_filename)``.
+        chunk_rows (int, optional): number of rows per chunk. Defaults to 10000.
+        metadata (dict, optional): information added to the metadata. Defaults to None.
+        compress (bool, optional): True to compress the columns, see ``Data_Store``. Defaults to True.
+        overwrite (bool, optional): True to replace ``filename`` if it exists, e.g. a store older than its CSV file. Defaults to
+                                    False, so that the store of a run is not replaced by mistake, as in ``store_to_csv()``.
+
+    Returns:
+        string: name of the data store written
+
+    Raises:
+        ValueError: if ``filename`` is the CSV file itself
+        FileExistsError: if ``filename`` exists and ``overwrite`` is False
+    """
+    if filename is None:
+        filename = store_filename(csv_filename)
+    if os.path.abspath(csv_filename) == os.path.abspath(filename):
+        raise ValueError('The data store must differ from the CSV file %s.' % csv_filename)
+    if os.path.exists(filename) and not overwrite:
+        raise FileExistsError('%s already exists, choose another name.' % filename)
+    metadata = dict(metadata if metadata is not None else {}, source=os.path.basename(csv_filename))
+    with open(csv_filename, 'r', newline='') as f, open(filename, 'wb' if overwrite else 'xb') as store:
+        reader = csv.reader(f)
+        header = next(reader)
+        write_metadata(store, metadata, header)
+        rows = []
+        for row in reader:
+            if len(row) > 0:
+                rows.append(row)
+            if len(rows) == chunk_rows:
+                write_chunk(store, rows_to_columns(rows, header), compress)
+                rows = []
+        if len(rows) > 0:
+            write_chunk(store, rows_to_columns(rows, header), compress)
+    return filename
+
+
+def store_to_csv(filename, csv_filename):
+    """Converts a data store back into the data CSV layout written by the ``Datalogger``.
+
+    Every cell comes back with the same text as in the CSV file the store was made from (see ``rows_to_columns()``), but the file
+    is not byte for byte the same: the lines end with '\\r\\n' as written by ``csv.writer``, and empty lines are dropped.
+
+    Args:
+        filename (string): data store, e.g. 'data/data.mapdata'
+        csv_filename (string): data CSV file to write, e.g. 'data/data_copy.csv'. It must not exist yet, so that the CSV file
+                               a store was converted from is not overwritten.
+
+    Returns:
+        string: name of the data CSV file written
+
+    Raises:
+        ValueError: if ``csv_filename`` is the data store itself
+        FileExistsError: if ``csv_filename`` exists
+    """
+    if os.path.abspath(csv_filename) == os.path.abspath(filename):
+        raise ValueError('The CSV file must differ from the data store %s.' % filename)
+    if os.path.exists(csv_filename):
+        raise FileExistsError('%s already exists, choose another name.' % csv_filename)
+    header = load_metadata(filename)['header']
+    with open(csv_filename, 'x', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for chunk in iter_store_chunks(filename):
+            writer.writerows(columns_to_rows(chunk, header))
+    return csv_filename
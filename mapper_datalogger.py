@@ -1,39 +1,76 @@
-import serial
+from contextlib import ExitStack
 from csv import writer
-import re
+from mapper_probe import Probe_Session
 
 class Datalogger():
     """The Datalogger class interfaces with the Arduino and reads serial data from the Teslameter. This class 
     will likely need to be changed if the RS232 interface is used instead. This class is mainly called by functions 
     in mapper_controller.Controller (ie the functions that run the stages) to make measurements at each step.
     """
-    def __init__(self, data_filename, comm_port):
+    def __init__(self, data_filename, comm_port, sample_averager = None):
         """Initializes the Datalogger class with save filename and Arduino comm port.
 
         Args:
             data_filename (string): path and name to save the data to, e.g. 'data/data_date_time.csv'
-            comm_port (string): name of COMM port that the Arduino is connected to, e.g. 'COM3'
+            comm_port (string/list): name of COMM port that the Arduino is connected to, e.g. 'COM3', or a list of ports if several 
+                                     probes are read at each point, e.g. ['COM3', 'COM4', 'COM5'] for the three axes of a Hall probe
+            sample_averager (Sample_Averager, optional): combines several readings into the value of each point, and adds the 'Std' 
+                                                         and 'Samples' columns. Defaults to None, i.e. one reading per point.
         """
         self.data_filename = data_filename
         self.comm_port = comm_port
+        self.comm_ports = comm_port if isinstance(comm_port, list) else [comm_port]
+        self.sample_averager = sample_averager
+
+        # with several probes, the columns of each probe are numbered from 1
+        probe_columns = ['Data', 'Unit']
+        if self.sample_averager is not None:
+            probe_columns += ['Std', 'Samples']
+        self.header = ['X', 'Y', 'Z', 'Rotation']
+        if len(self.comm_ports) == 1:
+            self.header += probe_columns
+        else:
+            for index in range(len(self.comm_ports)):
+                self.header += [column + str(index + 1) for column in probe_columns]
+
+        # long-lived probe connections (one per port), data file and timing profiler, set by the Controller for the duration of a run
+        self.probe_sessions = None
+        self.data_sink = None
+        self.profiler = None
         pass
 
     # Collect data from serial port and write one line into the Excel sheet
-    def log_data(self, x, y, z, rot, in_bounds = True):
+    def log_data(self, x, y, z, rot, in_bounds = True, not_before = None):
         """Log one line of data into the specified CSV file.
 
         Each line of the data will look like:
 
         [X   Y   Z   Rotation   Field   Value   Unit]
 
+        With several probes, the value and unit of every probe follow each other, in the order of ``self.comm_ports``:
+
+        [X   Y   Z   Rotation   Value1   Unit1   Value2   Unit2   ...]
+
         The reading from the COMM port is separated into the signed value ('0.16') and the unit ('G'), stored in two different cells.
 
+        With a ``self.sample_averager``, ``self.sample_averager.samples`` readings are taken and their value is computed by
+        ``Sample_Averager.estimate()``. The standard deviation and the number of readings kept follow the unit of each probe:
+
+        [X   Y   Z   Rotation   Field   Value   Unit   Std   Samples]
+
         To reduce chance of corrupted data:
 
-        * Regular expression ``-*[0-9]{1,5}\.[0-9]{2,4}`` is used to check that the probe data reading contains 1-2 digits followed by a decimal point, followed by 2-4 digits.
+        * Every frame is checked by the ``Frame_Parser`` of the probe session, which rejects frames that do not match the Teslameter
+          output grammar as a whole (e.g. garbled or merged frames) and counts them.
         
-        * The first two readings after opening the COMM port is dropped. The third one (at the same location) is recorded.
+        * Only frames that the probe started sending after ``not_before`` (by default, after this function is called) are recorded 
+          (see ``Probe_Session.get_reading()``).
 
+        The readings are taken from ``self.probe_sessions``, which the Controller keeps open for the whole run. Their background
+        readers run concurrently, so reading several probes takes about as long as reading one. If no session is open, 
+        temporary ones are opened for this reading only. Likewise, the row is written through ``self.data_sink`` if the Controller 
+        has opened one (see ``write_row()``). If the Controller is recording a timing profile, the time spent waiting for 
+        ``not_before``, reading the probe and writing the row are recorded in ``self.profiler``.
 
         Args:
             x (float): position of the linear stage in X direction, in mm
@@ -41,34 +78,71 @@ class Datalogger():
             z (float): position of the linear stage in Z direction, in mm
             rot (float): position of the rotational stage, in degrees, between 0 - 180 degress.
             in_bounds (bool, optional): set to False if motion system decides the point is out of bounds and skips this data point. Defaults to True.
+            not_before (float, optional): ``time.monotonic()`` timestamp before which readings are ignored, may be in the future. Defaults to None.
         """
         if not in_bounds:
             data = [x, y, z, rot, 'out of motion bounds']
             print(data)
-            csv_writer.writerow(data)
+            self.write_row(data)
+            if self.profiler is not None:
+                self.profiler.lap('write')
             return
 
-        # configure the serial connections to the probe/Arduino
-        with serial.Serial(self.comm_port, 9600, timeout=None) as ser:
-            while (True):
-                try:
-                    ser.readline() # do not keep the first or second probe reading
-                    ser.readline()
-                    field = ser.readline().decode('ascii').strip() # probe reading
-                    # use regular expression to check the field satisfies a certain value
-                    field_val = re.findall('-*[0-9]{1,5}\.[0-9]{1,4}', field)[0]
-                    field_unit = field[-1]
-                    data = [x, y, z, rot, field_val, field_unit]
-                    # print data to screen
-                    print(data)
-                    
-                    # if data seems correct, place it in csv file
-                    with open(self.data_filename, 'a', newline='') as write_obj:
-                        csv_writer = writer(write_obj)
-                        csv_writer.writerow(data)
-
-                    ser.flush()
-                    break
-
-                except Exception as e:
-                    pass
\ No newline at end of file
+        if self.probe_sessions is None:
+            with ExitStack() as stack:
+                probe_sessions = [stack.enter_context(Probe_Session(comm_port)) for comm_port in self.comm_ports]
+                self.read_and_write(probe_sessions, x, y, z, rot, not_before)
+        else:
+            self.read_and_write(self.probe_sessions, x, y, z, rot, not_before)
+
+
+    def read_and_write(self, probe_sessions, x, y, z, rot, not_before = None):
+        """Gets a valid reading from every probe and writes them into the CSV file.
+
+        Args:
+            probe_sessions (list): open connections to the probes (``Probe_Session``), in the order of the columns
+            x (float): position of the linear stage in X direction, in mm
+            y (float): position of the linear stage in Y direction, in mm
+            z (float): position of the linear stage in Z direction, in mm
+            rot (float): position of the rotational stage, in degrees
+            not_before (float, optional): ``time.monotonic()`` timestamp before which readings are ignored. Defaults to None.
+        """
+        data = [x, y, z, rot]
+        for probe_session in probe_sessions:
+            if self.sample_averager is None:
+                timestamp, field_val, field_unit = probe_session.get_reading(not_before) # probe reading
+                data += [field_val, field_unit]
+            else:
+                timestamps, values, units = probe_session.get_readings(self.sample_averager.samples, not_before)
+                field_val, field_std, field_count = self.sample_averager.estimate(values)
+                # well below the resolution of the probe, keeps the file readable
+                data += [round(field_val, 6), str(units[-1]), round(field_std, 6), field_count]
+        if self.profiler is not None:
+            if not_before is not None:
+                # the readings were requested right after the move, so the time until not_before is still settling
+                self.profiler.lap('settle', until=not_before)
+            self.profiler.lap('probe_read')
+        # print data to screen
+        print(data)
+
+        # place it in csv file
+        self.write_row(data)
+        if self.profiler is not None:
+            self.profiler.lap('write')
+
+
+    def write_row(self, data):
+        """Writes one row into the data CSV file.
+
+        If the Controller has opened a ``Data_Sink`` for the run, the row is queued there and written in batches. Otherwise 
+        the file is opened in append mode for this row only.
+
+        Args:
+            data (list): one row of data, e.g. [X, Y, Z, Rotation, Data, Unit]
+        """
+        if self.data_sink is not None:
+            self.data_sink.write_row(data)
+        else:
+            with open(self.data_filename, 'a', newline='') as write_obj:
+                csv_writer = writer(write_obj)
+                csv_writer.writerow(data)
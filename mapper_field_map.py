@@ -0,0 +1,332 @@
+import csv
+from itertools import product
+import numpy as np
+from mapper_frame_parser import UNIT_SCALES
+from mapper_data_store import is_store, load_store
+
+# scipy is only needed for maps that are not on a grid, e.g. from custom paths
+try:
+    from scipy.interpolate import LinearNDInterpolator
+    from scipy.spatial import cKDTree
+except ImportError:
+    LinearNDInterpolator = None
+    cKDTree = None
+
+AXIS_NAMES = ('X', 'Y', 'Z')
+
+
+def load_data(filename, column = 'Data'):
+    """Reads the points and field values of a data CSV written by the ``Datalogger``, or of a data store (see ``Data_Store``).
+
+    Rows without a field value (e.g. 'out of motion bounds' or 'no reading in scan') and empty rows are skipped. If the unit changes
+    within the file, the values are converted to the unit of the first row, see ``UNIT_SCALES``.
+
+    Args:
+        filename (string): data CSV file or data store, e.g. 'data/data.csv' or 'data/data.mapdata'
+        column (string, optional): column holding the field, e.g. 'Data2' for the second probe. Defaults to 'Data'.
+
+    Returns:
+        (numpy array, numpy array, string): points with 4 columns for X, Y, Z and rotation, field values and their unit
+    """
+    if is_store(filename):
+        return load_store_data(filename, column)
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        value_index = header.index(column)
+        unit_index = header.index(column.replace('Data', 'Unit')) if column.replace('Data', 'Unit') in header else None
+
+        points = []
+        values = []
+        unit = None
+        for row in reader:
+            if len(row) <= value_index:
+                continue
+            try:
+                value = float(row[value_index])
+            except ValueError:
+                continue
+            row_unit = row[unit_index] if unit_index is not None and len(row) > unit_index else None
+            if unit is None:
+                unit = row_unit
+            elif row_unit != unit and row_unit in UNIT_SCALES and unit in UNIT_SCALES:
+                value = value * UNIT_SCALES[row_unit] / UNIT_SCALES[unit]
+            points.append([float(i) for i in row[:4]])
+            values.append(value)
+    return np.array(points).reshape(-1, 4), np.array(values), unit
+
+
+def load_store_data(filename, column = 'Data'):
+    """Reads the points and field values of a data store, like ``load_data()`` reads a data CSV.
+
+    Args:
+        filename (string): data store, e.g. 'data/data.mapdata'
+        column (string, optional): column holding the field. Defaults to 'Data'.
+
+    Returns:
+        (numpy array, numpy array, string): points with 4 columns for X, Y, Z and rotation, field values and their unit
+    """
+    unit_column = column.replace('Data', 'Unit')
+    columns, metadata = load_store(filename, ['X', 'Y', 'Z', 'Rotation', column, unit_column])
+    if column not in metadata['header']:
+        raise ValueError('%s has no column %s.' % (filename, column))
+    valid = ~np.isnan(columns[column])
+    points = np.column_stack([columns[name][valid] for name in ('X', 'Y', 'Z', 'Rotation')])
+    values = columns[column][valid]
+    values, unit = convert_units(values, columns[unit_column][valid] if unit_column in columns else None)
+    return points.reshape(-1, 4), values, unit
+
+
+def convert_units(values, units):
+    """Converts field values to the unit of the first one, see ``UNIT_SCALES``. Unknown units are left as they are.
+
+    Args:
+        values (numpy array): field values
+        units (numpy array): unit of each value, or None if the values have no unit
+
+    Returns:
+        (numpy array, string): converted values and their unit, None if there is no value or unit
+    """
+    if units is None or len(units) == 0:
+        return values, None
+    unit = str(units[0])
+    for other in np.unique(units):
+        if other != unit and other in UNIT_SCALES and unit in UNIT_SCALES:
+            values = np.where(units == other, values * UNIT_SCALES[other] / UNIT_SCALES[unit], values)
+    return values, unit
+
+
+class Field_Map():
+    """The ``Field_Map`` class interpolates the field measured at a set of points, so that it can be queried anywhere inside the mapped
+    volume, for many points at once.
+
+    Two kinds of maps are supported:
+
+    * 'grid': the points fill a rectilinear grid, which is the case for the rectangular paths of ``Points_Generator``. The field is
+      interpolated trilinearly with numpy only. On evenly spaced axes, the cell of each query is found by arithmetic instead of
+      a search, which answers millions of queries per second.
+    * 'scattered': any other set of points, e.g. cylinders or custom paths. The field is interpolated linearly over a Delaunay
+      triangulation of the points ('linear'), or taken from the nearest point with a KD-tree ('nearest'). This needs scipy.
+
+    Axes along which every point has the same coordinate (e.g. Y for a map of the horizontal plane) are left out, and a query is only
+    answered if it has that same coordinate, within ``tolerance``. Queries outside of the mapped volume return NaN. A point measured
+    several times (e.g. in a map that was run twice) gets the mean of its values.
+    """
+    def __init__(self, points, values, unit = None, method = 'auto', tolerance = 1e-6):
+        """Builds the interpolator.
+
+        Args:
+            points (numpy array): points of shape (n, 3) with X, Y and Z in mm, or (n, 4) including the rotation, which is ignored
+            values (numpy array): field value at each point
+            unit (string, optional): unit of the values, e.g. 'G'. Defaults to None.
+            method (string, optional): 'auto' to use the grid when the points fill one and 'linear' otherwise, 'grid', 'linear' or
+                                       'nearest'. Defaults to 'auto'.
+            tolerance (float, optional): distance in mm under which two coordinates are the same. Defaults to 1e-6.
+
+        Raises:
+            ValueError: if ``method`` is 'grid' and the points do not fill a grid, or there are no points
+            ImportError: if a scattered method is needed and scipy is not installed
+        """
+        points = np.asarray(points, dtype=float)[:, :3]
+        values = np.asarray(values, dtype=float)
+        if len(points) == 0:
+            raise ValueError('The field map has no points.')
+        self.unit = unit
+        self.tolerance = tolerance
+
+        # merge repeated points, coordinates are rounded to the tolerance so that e.g. -0.0 and 0.0 are the same
+        keys = np.round(points / tolerance).astype(np.int64)
+        keys, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        self.points = points[first]
+        self.values = np.bincount(inverse, weights=values) / np.bincount(inverse)
+
+        self.bounds = np.array([self.points.min(axis=0), self.points.max(axis=0)])
+        # axes with more than one coordinate, the field is constant along the others
+        self.active_axes = [axis for axis in range(3) if self.bounds[1, axis] - self.bounds[0, axis] > tolerance]
+
+        self.axes = [np.unique(keys[:, axis]) * tolerance for axis in self.active_axes]
+        grid_size = int(np.prod([len(axis) for axis in self.axes]))
+        is_grid = grid_size == len(self.points)
+        if method == 'auto':
+            method = 'grid' if is_grid else 'linear'
+        if method == 'grid' and not is_grid:
+            raise ValueError('The %d points do not fill a grid of %s points.'
+                             % (len(self.points), ' x '.join(str(len(axis)) for axis in self.axes)))
+        self.method = method
+        self.kind = 'grid' if method == 'grid' else 'scattered'
+
+        if self.kind == 'grid':
+            self.setup_grid(keys)
+        else:
+            self.setup_scattered()
+
+
+    def setup_grid(self, keys):
+        """Arranges the values on the grid and checks which axes are evenly spaced.
+
+        Args:
+            keys (numpy array): rounded coordinates of ``self.points``
+        """
+        indices = [np.searchsorted(np.unique(keys[:, axis]), keys[:, axis]) for axis in self.active_axes]
+        self.grid = np.empty([len(axis) for axis in self.axes])
+        self.grid[tuple(indices)] = self.values
+        self.steps = []
+        for axis in self.axes:
+            steps = np.diff(axis)
+            even = len(steps) > 0 and np.allclose(steps, steps[0], rtol=0, atol=self.tolerance)
+            self.steps.append(steps[0] if even else None)
+
+
+    def setup_scattered(self):
+        """Builds the Delaunay triangulation or the KD-tree of the active coordinates.
+        """
+        if LinearNDInterpolator is None:
+            raise ImportError('scipy is needed to interpolate maps that are not on a grid, install it with: py -3 -m pip install scipy')
+        coordinates = self.points[:, self.active_axes]
+        if self.method == 'nearest':
+            self.tree = cKDTree(coordinates)
+        elif self.method == 'linear':
+            if len(self.active_axes) == 1:
+                # a single line of points, the triangulation needs at least two dimensions
+                order = np.argsort(coordinates[:, 0])
+                self.line = (coordinates[order, 0], self.values[order])
+            elif len(self.active_axes) > 1:
+                self.interpolator = LinearNDInterpolator(coordinates, self.values, fill_value=np.nan)
+        else:
+            raise ValueError('Unknown interpolation method %s' % self.method)
+
+
+    def __call__(self, x, y, z):
+        """Interpolates the field at any number of points. The coordinates are broadcast together, like numpy operations.
+
+        Args:
+            x (float/numpy array): X positions in mm
+            y (float/numpy array): Y positions in mm
+            z (float/numpy array): Z positions in mm
+
+        Returns:
+            numpy array: field at each point in ``self.unit``, NaN outside of the mapped volume
+        """
+        x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(z, dtype=float))
+        shape = x.shape
+        return self.query(np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1)).reshape(shape)
+
+
+    def query(self, points):
+        """Interpolates the field at every point of an array.
+
+        Args:
+            points (numpy array): points of shape (n, 3) with X, Y and Z in mm
+
+        Returns:
+            numpy array: field at each point in ``self.unit``, NaN outside of the mapped volume
+        """
+        points = np.asarray(points, dtype=float)
+        # queries away from the plane or line of a flat map cannot be answered
+        off_map = np.zeros(len(points), dtype=bool)
+        for axis in range(3):
+            if axis not in self.active_axes:
+                off_map |= np.abs(points[:, axis] - self.points[0, axis]) > self.tolerance
+        coordinates = points[:, self.active_axes]
+
+        if len(self.active_axes) == 0:
+            values = np.full(len(points), self.values[0])
+        elif self.kind == 'grid':
+            values = self.query_grid(coordinates)
+        elif self.method == 'nearest':
+            distances, indices = self.tree.query(coordinates)
+            values = self.values[indices]
+            outside = np.any((coordinates < self.bounds[0, self.active_axes] - self.tolerance)
+                             | (coordinates > self.bounds[1, self.active_axes] + self.tolerance), axis=1)
+            values[outside] = np.nan
+        elif len(self.active_axes) == 1:
+            values = np.interp(coordinates[:, 0], self.line[0], self.line[1], left=np.nan, right=np.nan)
+        else:
+            values = self.interpolator(coordinates)
+        values[off_map] = np.nan
+        return values
+
+
+    def query_grid(self, coordinates):
+        """Trilinear (or bilinear, or linear for flat maps) interpolation on the grid.
+
+        Args:
+            coordinates (numpy array): active coordinates of the queries, of shape (n, number of active axes)
+
+        Returns:
+            numpy array: interpolated values, NaN outside of the grid
+        """
+        cells = []
+        weights = []
+        outside = np.zeros(len(coordinates), dtype=bool)
+        for i, (axis, step) in enumerate(zip(self.axes, self.steps)):
+            q = coordinates[:, i]
+            outside |= (q < axis[0] - self.tolerance) | (q > axis[-1] + self.tolerance)
+            if step is not None:
+                position = (q - axis[0]) / step
+                cell = np.clip(np.floor(position).astype(np.intp), 0, len(axis) - 2)
+                weight = position - cell
+            else:
+                cell = np.clip(np.searchsorted(axis, q, side='right') - 1, 0, len(axis) - 2)
+                weight = (q - axis[cell]) / (axis[cell + 1] - axis[cell])
+            cells.append(cell)
+            weights.append(np.clip(weight, 0.0, 1.0))
+
+        # sum over the corners of each cell, 8 corners for a 3D grid. Each corner is at a fixed offset from the first one in the
+        # flattened grid, so the index of the cell is only computed once
+        strides = [stride // self.grid.itemsize for stride in self.grid.strides]
+        first_corner = sum(cell * stride for cell, stride in zip(cells, strides))
+        flat_grid = self.grid.ravel()
+        values = np.zeros(len(coordinates))
+        for corner in product((0, 1), repeat=len(cells)):
+            corner_weight = np.ones(len(coordinates))
+            for offset, weight in zip(corner, weights):
+                corner_weight *= weight if offset else 1.0 - weight
+            offset = sum(offset * stride for offset, stride in zip(corner, strides))
+            values += corner_weight * flat_grid.take(first_corner + offset)
+        values[outside] = np.nan
+        return values
+
+
+    def describe(self):
+        """Summarizes the map.
+
+        Returns:
+            string: kind, number of points, shape of the grid and bounds of the map
+        """
+        text = '%s map of %d points' % (self.kind, len(self.points))
+        if self.kind == 'grid':
+            text += ' on a %s grid' % ' x '.join('%d %s' % (len(axis), AXIS_NAMES[a]) for axis, a in zip(self.axes, self.active_axes))
+        text += ', ' + ', '.join('%s %g to %g mm' % (AXIS_NAMES[a], self.bounds[0, a], self.bounds[1, a]) for a in range(3))
+        return text
+
+
+def load_field_map(filename, column = 'Data', rotation = None, method = 'auto'):
+    """Loads a data CSV into a ``Field_Map``.
+
+    A map taken at several rotation angles holds one field map per angle, so the angle must be chosen.
+
+    Args:
+        filename (string): data CSV file, e.g. 'data/data.csv'
+        column (string, optional): column holding the field, e.g. 'Data2' for the second probe. Defaults to 'Data'.
+        rotation (float, optional): rotation angle in degrees of the points to use. Defaults to None, i.e. the only angle of the file.
+        method (string, optional): interpolation method, see ``Field_Map``. Defaults to 'auto'.
+
+    Returns:
+        Field_Map: interpolated map
+
+    Raises:
+        ValueError: if the file holds several angles and ``rotation`` is None, or no points at ``rotation``
+    """
+    points, values, unit = load_data(filename, column)
+    angles = np.unique(points[:, 3])
+    if rotation is None:
+        if len(angles) > 1:
+            raise ValueError('%s was mapped at several rotation angles %s, choose one.' % (filename, angles.tolist()))
+    else:
+        selected = np.abs(points[:, 3] - rotation) < 1e-6
+        if not np.any(selected):
+            raise ValueError('%s has no points at rotation %g, only at %s.' % (filename, rotation, angles.tolist()))
+        points, values = points[selected], values[selected]
+    return Field_Map(points, values, unit, method)
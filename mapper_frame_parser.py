@@ -0,0 +1,134 @@
+import re
+from collections import Counter
+
+# value of one unit in G
+UNIT_SCALES = {'G' : 1.0, 'kG' : 1e3, 'mG' : 1e-3, 'T' : 1e4, 'mT' : 10.0, 'uT' : 1e-2}
+
+# a reading, e.g. '-6.191G', '+1.2e-3 T' or '12.50kG*'
+FRAME_PATTERN = re.compile(r'(?P<value>[+-]?[0-9]+\.(?P<decimals>[0-9]+)(?:[eE][+-]?[0-9]+)?) ?(?P<unit>kG|mG|G|mT|uT|T)(?P<flag>\*?)')
+
+# an overload, e.g. 'OL', '-OL' or 'OL kG'
+OVERLOAD_PATTERN = re.compile(r'[+-]?OL ?(?:kG|mG|G|mT|uT|T)?')
+
+# a number followed by something that is not a known unit, only tried once a frame is rejected
+UNKNOWN_UNIT_PATTERN = re.compile(r'[+-]?[0-9]+\.[0-9]+(?:[eE][+-]?[0-9]+)? ?[A-Za-z]+\*?')
+
+
+class Frame_Parser():
+    """The ``Frame_Parser`` class converts the frames sent by the Teslameter (e.g. '-6.191G') into a value and a unit, and counts the
+    frames it rejects by reason instead of dropping them silently.
+
+    A frame must match this grammar as a whole, apart from leading and trailing white space:
+
+    * an optional sign, '+' or '-'
+    * a number with digits on both sides of the decimal point, e.g. '6.191' or '0.5', optionally followed by an exponent, e.g. 'e-3'.
+      The meter always sends them, so a frame such as '6191G' or '.191G' has lost bytes.
+    * an optional space, then the unit: 'G', 'kG', 'mG', 'T', 'mT' or 'uT'
+    * an optional range flag '*', sent while the meter is changing range
+
+    Frames are rejected, and counted in ``self.failures``, for these reasons:
+
+    ===================    =============================================================
+    Reason                 Description
+    ===================    =============================================================
+    'empty'                nothing but white space
+    'overload'             the field is beyond the range of the meter, e.g. 'OL' or '-OL G'
+    'range_change'         the reading has the range flag, unless ``accept_range_change`` is True
+    'decimals'             the number of decimals is not ``decimals``, e.g. a digit was lost
+    'unknown_unit'         a number followed by a unit that is not in ``UNIT_SCALES``
+    'malformed'            anything else, e.g. a frame garbled by line noise or merged with the next one
+    ===================    =============================================================
+
+    Unlike a search for a number anywhere in the frame, a partly garbled frame such as '-6.1#1G' is rejected rather than read as -6.1.
+    If ``unit`` is given, every value is converted to that unit, so that a map stays consistent when the meter changes range
+    (e.g. from G to kG).
+    """
+    def __init__(self, unit = None, accept_range_change = False, decimals = None):
+        """Initializes the ``Frame_Parser`` class.
+
+        Args:
+            unit (string, optional): unit every value is converted to, one of ``UNIT_SCALES``. Defaults to None, i.e. the unit sent by the meter.
+            accept_range_change (bool, optional): True to keep the readings sent while the meter changes range. Defaults to False.
+            decimals (int, optional): number of decimals the meter always sends, e.g. 3 for '-6.191G'. Defaults to None, i.e. any number.
+        """
+        if unit is not None and unit not in UNIT_SCALES:
+            raise ValueError('Unknown probe unit %s' % unit)
+        self.unit = unit
+        self.accept_range_change = accept_range_change
+        self.decimals = decimals
+
+        self.frames = 0
+        self.failures = Counter()
+        # number of frames rejected since the last valid one
+        self.consecutive_failures = 0
+
+
+    def parse(self, frame):
+        """Converts one frame into its value and unit.
+
+        Args:
+            frame (string): probe reading, with or without its end of line characters
+
+        Returns:
+            (float, string): value and unit of the reading, or None if the frame is rejected
+        """
+        self.frames += 1
+        frame = frame.strip()
+        match = FRAME_PATTERN.fullmatch(frame)
+        if (match is None or (match.group('flag') and not self.accept_range_change)
+                or (self.decimals is not None and len(match.group('decimals')) != self.decimals)):
+            self.reject(frame, match)
+            return None
+
+        self.consecutive_failures = 0
+        value = float(match.group('value'))
+        unit = match.group('unit')
+        if self.unit is not None and unit != self.unit:
+            value = value * UNIT_SCALES[unit] / UNIT_SCALES[self.unit]
+            unit = self.unit
+        return value, unit
+
+
+    def reject(self, frame, match):
+        """Counts a rejected frame under its reason.
+
+        Args:
+            frame (string): stripped frame
+            match (re.Match): match of ``FRAME_PATTERN``, None if the frame did not match
+        """
+        self.consecutive_failures += 1
+        if match is not None:
+            reason = 'range_change' if match.group('flag') and not self.accept_range_change else 'decimals'
+        elif len(frame) == 0:
+            reason = 'empty'
+        elif OVERLOAD_PATTERN.fullmatch(frame):
+            reason = 'overload'
+        elif UNKNOWN_UNIT_PATTERN.fullmatch(frame):
+            reason = 'unknown_unit'
+        else:
+            reason = 'malformed'
+        self.failures[reason] += 1
+
+
+    def failure_count(self):
+        """Returns the number of rejected frames.
+
+        Returns:
+            int: number of frames rejected for any reason
+        """
+        return sum(self.failures.values())
+
+
+    def print_stats(self, label = 'Probe'):
+        """Prints the number of frames parsed and the number rejected for each reason.
+
+        Args:
+            label (string, optional): name of the probe at the start of the line. Defaults to 'Probe'.
+        """
+        if self.frames == 0:
+            return
+        failures = self.failure_count()
+        line = '{} frames: {} received, {} rejected ({:.2f}%)'.format(label, self.frames, failures, 100 * failures / self.frames)
+        if failures > 0:
+            line += ': ' + ', '.join('{} {}'.format(count, reason) for reason, count in self.failures.most_common())
+        print(line)
@@ -0,0 +1,616 @@
+import random
+import threading
+from abc import ABC, abstractmethod
+from time import sleep, monotonic
+from zaber_motion import Library, CommandFailedException, CommandFailedExceptionData
+from zaber_motion.ascii import Connection, WarningFlags
+
+
+class Motion_Backend(ABC):
+    """The ``Motion_Backend`` class is the interface between ``Controller`` and the stages. ``connect()`` returns a connection
+    used in a ``with`` block, whose ``detect_devices()`` returns the devices in the order of the Zaber daisy chain: Z, X, Y, rotation.
+
+    The controller only uses the parts of the zaber_motion API that every backend provides: ``get_axis()``, ``all_axes.home()``,
+    ``settings.set()``, ``warnings.get_flags()`` and ``streams.get_stream()`` on devices, and ``move_absolute()``,
+    ``wait_until_idle()``, ``get_position()`` and ``stop()`` on axes.
+
+    Subclasses must implement ``connect()``.
+    """
+    @abstractmethod
+    def connect(self):
+        """Opens a connection to the stages.
+
+        Returns:
+            Connection: connection to use in a ``with`` block
+        """
+
+
+    def sleep(self, seconds):
+        """Waits for ``seconds`` on the clock of the stages. Used for the fixed pauses between moves.
+
+        Args:
+            seconds (float): time to wait in seconds
+        """
+        sleep(seconds)
+
+
+    def now(self):
+        """Returns the time on the clock of the stages.
+
+        Returns:
+            float: time in seconds
+        """
+        return monotonic()
+
+
+class Zaber_Backend(Motion_Backend):
+    """The ``Zaber_Backend`` class connects to the real Zaber stages over a serial port.
+    """
+    def __init__(self, comm_port):
+        """Initializes the ``Zaber_Backend`` class.
+
+        Args:
+            comm_port (string): COMM port that connects to the Zaber devices, e.g. 'COM3'
+        """
+        self.comm_port = comm_port
+
+
+    def connect(self):
+        """Opens the serial port, with the device database cached locally.
+
+        Returns:
+            Connection: zaber_motion connection
+        """
+        Library.enable_device_db_store()
+        return Connection.open_serial_port(self.comm_port)
+
+
+class Simulated_Clock():
+    """The ``Simulated_Clock`` class keeps the time of the simulated stages. It runs ``time_scale`` times faster than real time,
+    or, if ``time_scale`` is 0, does not run at all: time only moves forward when something waits, and waits return immediately.
+    """
+    def __init__(self, time_scale = 1.0):
+        """Initializes the ``Simulated_Clock`` class at time 0.
+
+        Args:
+            time_scale (float, optional): simulated seconds per real second, or 0 for no waiting at all. Defaults to 1.0.
+        """
+        self.time_scale = time_scale
+        self.start = monotonic()
+        self.virtual_time = 0.0
+        self.lock = threading.Lock()
+
+
+    def now(self):
+        """Returns the simulated time in seconds.
+
+        Returns:
+            float: time in seconds since the clock was created
+        """
+        if self.time_scale == 0:
+            return self.virtual_time
+        return (monotonic() - self.start) * self.time_scale
+
+
+    def wait_until(self, time):
+        """Waits until the simulated time reaches ``time``.
+
+        Args:
+            time (float): simulated time in seconds
+        """
+        if self.time_scale == 0:
+            with self.lock:
+                self.virtual_time = max(self.virtual_time, time)
+            return
+        remaining = time - self.now()
+        if remaining > 0:
+            sleep(remaining / self.time_scale)
+
+
+class Simulated_Axis():
+    """The ``Simulated_Axis`` class models one stage moving with a trapezoidal velocity profile (see ``Motion_Model``). Moves are
+    queued one after the other; each move is stored as (start time, start position, end position, speed, duration).
+
+    A move outside of the travel range is rejected with a ``CommandFailedException``, like on the real devices. With a stall
+    probability above 0, a move may stop part of the way and raise the 'FS' (stalled and stopped) warning flag,
+    which is cleared by the next move.
+    """
+    def __init__(self, device, clock, max_speed, accel, limits, stall_probability = 0.0):
+        """Initializes the ``Simulated_Axis`` class at position 0.
+
+        Args:
+            device (Simulated_Device): device the axis belongs to
+            clock (Simulated_Clock): clock shared by every simulated device
+            max_speed (float): maximum speed in mm/s or degrees/s
+            accel (float): acceleration in mm/s^2 or degrees/s^2
+            limits (list): travel range [low, high] in mm or degrees
+            stall_probability (float, optional): probability that a move stalls. Defaults to 0.0.
+        """
+        self.device = device
+        self.clock = clock
+        self.max_speed = max_speed
+        self.accel = accel
+        self.limits = limits
+        self.stall_probability = stall_probability
+        self.moves = []
+        self.position = 0.0
+        self.end_time = 0.0
+
+
+    def profile_time(self, distance, speed):
+        """Time taken to travel ``distance`` with a trapezoidal profile with maximum speed ``speed``.
+
+        Args:
+            distance (float): distance in mm or degrees
+            speed (float): maximum speed in mm/s or degrees/s
+
+        Returns:
+            float: time in seconds
+        """
+        distance = abs(distance)
+        if distance < speed ** 2 / self.accel:
+            return 2 * (distance / self.accel) ** 0.5
+        return distance / speed + speed / self.accel
+
+
+    def profile_position(self, move, time):
+        """Position reached ``time`` seconds after the start of ``move``.
+
+        Args:
+            move (tuple): (start time, start position, end position, speed, duration)
+            time (float): time since the start of the move in seconds
+
+        Returns:
+            float: position in mm or degrees
+        """
+        start_time, start, end, speed, duration = move
+        if time >= duration:
+            return end
+        direction = 1 if end >= start else -1
+        # the profile is symmetric, so the peak speed is reached at half of the move for a triangular profile
+        peak = min(speed, self.accel * duration / 2)
+        ramp = peak / self.accel
+        if time < ramp:
+            travelled = self.accel * time ** 2 / 2
+        elif time < duration - ramp:
+            travelled = self.accel * ramp ** 2 / 2 + peak * (time - ramp)
+        else:
+            travelled = abs(end - start) - self.accel * (duration - time) ** 2 / 2
+        return start + direction * travelled
+
+
+    def reject(self, command):
+        """Raises the exception of a command rejected by the device.
+
+        Args:
+            command (string): rejected command
+        """
+        raise CommandFailedException('Command "%s" rejected: BADDATA' % command,
+                                     CommandFailedExceptionData(command=command, response_data='BADDATA', reply_flag='RJ', status='IDLE',
+                                                                warning_flag='--', device_address=self.device.device_address, axis_number=1, id=0))
+
+
+    def queue_move(self, target, speed = None):
+        """Queues a move to ``target``, starting once the current moves are done.
+
+        Args:
+            target (float): position in mm or degrees
+            speed (float, optional): maximum speed. Defaults to None, i.e. ``self.max_speed``.
+        """
+        if target < self.limits[0] or target > self.limits[1]:
+            self.reject('move abs %g' % target)
+        if speed is None:
+            speed = self.max_speed
+
+        start_time = max(self.clock.now(), self.end_time)
+        start = self.position
+        self.device.flags.discard(WarningFlags.STALLED_AND_STOPPED)
+        if self.stall_probability > 0 and random.random() < self.stall_probability:
+            target = start + (target - start) * random.random()
+            self.device.flags.add(WarningFlags.STALLED_AND_STOPPED)
+
+        duration = self.profile_time(target - start, speed)
+        self.moves.append((start_time, start, target, speed, duration))
+        self.position = target
+        self.end_time = start_time + duration
+
+
+    def move_absolute(self, position, unit = None, wait_until_idle = True):
+        """Moves to an absolute position. Positions are in mm for linear stages and degrees for the rotation stage, ``unit`` is ignored.
+
+        Args:
+            position (float): position to move to
+            unit (Units, optional): unit of ``position``. Defaults to None.
+            wait_until_idle (bool, optional): True to block until the move is done. Defaults to True.
+        """
+        self.queue_move(position)
+        if wait_until_idle:
+            self.wait_until_idle()
+
+
+    def wait_until_idle(self):
+        """Blocks until every queued move is done.
+        """
+        self.clock.wait_until(self.end_time)
+        self.moves = []
+
+
+    def home(self):
+        """Moves to position 0 and blocks until the move is done.
+        """
+        self.move_absolute(0.0)
+
+
+    def stop(self, wait_until_idle = True):
+        """Stops the axis where it is and drops the queued moves. The axis stops at once, without decelerating.
+
+        Args:
+            wait_until_idle (bool, optional): ignored, the axis is idle once this returns. Defaults to True.
+        """
+        self.position = self.get_position()
+        self.moves = []
+        self.end_time = self.clock.now()
+
+
+    def get_position(self, unit = None):
+        """Returns the current position, including during a move.
+
+        Args:
+            unit (Units, optional): unit of the position, ignored. Defaults to None.
+
+        Returns:
+            float: position in mm or degrees
+        """
+        now = self.clock.now()
+        for move in self.moves:
+            if now < move[0] + move[4]:
+                return self.profile_position(move, max(now - move[0], 0.0))
+        return self.position
+
+
+class Simulated_Stream():
+    """The ``Simulated_Stream`` class provides the parts of the zaber_motion stream API used by ``Continuous_Scanner``, for a stream
+    on a single axis. Lines are queued on the axis as separate moves at the stream speed; consecutive lines in the same direction
+    are merged into one move, since a real stream does not stop between them.
+    """
+    def __init__(self, axis):
+        """Initializes the ``Simulated_Stream`` class.
+
+        Args:
+            axis (Simulated_Axis): axis driven by the stream
+        """
+        self.axis = axis
+        self.speed = axis.max_speed
+        self.corked = False
+        self.lines = []
+
+
+    def setup_live(self, *axes):
+        """Sets the stream up to move the axes directly. Nothing to do, the stream always drives ``self.axis``.
+
+        Args:
+            axes (int): numbers of the axes of the device driven by the stream, ignored
+        """
+        pass
+
+
+    def set_max_speed(self, max_speed, unit = None):
+        """Sets the speed of the next lines.
+
+        Args:
+            max_speed (float): speed in mm/s or degrees/s
+            unit (Units, optional): unit of ``max_speed``, ignored. Defaults to None.
+        """
+        self.speed = max_speed
+
+
+    def cork(self):
+        """Holds the next lines until ``uncork()``, so that they start together.
+        """
+        self.corked = True
+
+
+    def uncork(self):
+        """Sends the lines held since ``cork()`` to the axis.
+        """
+        self.corked = False
+        self.send_lines()
+
+
+    def line_absolute(self, *endpoint):
+        """Adds a line to an absolute position, sent to the axis at once unless the stream is corked.
+
+        Args:
+            endpoint (Measurement): position of each axis of the stream; only the first one is used, in mm or degrees
+        """
+        self.lines.append(float(endpoint[0].value))
+        if not self.corked:
+            self.send_lines()
+
+
+    def send_lines(self):
+        """Queues the lines received so far on the axis, merging consecutive lines in the same direction.
+        """
+        position = self.axis.position
+        direction = 0
+        target = position
+        for line in self.lines:
+            line_direction = (line > target) - (line < target)
+            if direction != 0 and line_direction != direction:
+                self.axis.queue_move(target, self.speed)
+            direction = line_direction
+            target = line
+        if target != self.axis.position:
+            self.axis.queue_move(target, self.speed)
+        self.lines = []
+
+
+    def wait_until_idle(self):
+        """Blocks until every line sent is done.
+        """
+        self.axis.wait_until_idle()
+
+
+    def disable(self):
+        """Disables the stream. Nothing to do, the axis takes single moves again at once.
+        """
+        pass
+
+
+class Simulated_Device():
+    """The ``Simulated_Device`` class is a Zaber device with a single ``Simulated_Axis``.
+    """
+    def __init__(self, device_address, clock, max_speed, accel, limits, stall_probability = 0.0):
+        """Initializes the ``Simulated_Device`` class, see ``Simulated_Axis`` for the arguments.
+
+        Args:
+            device_address (int): address of the device in the daisy chain, starting at 1
+        """
+        self.device_address = device_address
+        self.flags = set()
+        self.axis = Simulated_Axis(self, clock, max_speed, accel, limits, stall_probability)
+        self.all_axes = self.axis
+        self.settings = Simulated_Settings(self.axis)
+        self.warnings = Simulated_Warnings(self)
+        self.streams = Simulated_Streams(self.axis)
+
+
+    def get_axis(self, axis_number):
+        """Returns an axis of the device.
+
+        Args:
+            axis_number (int): number of the axis, ignored since the device has a single axis
+
+        Returns:
+            Simulated_Axis: the axis of the device
+        """
+        return self.axis
+
+
+class Simulated_Settings():
+    """Settings of a ``Simulated_Device``. Only 'accel' and 'maxspeed' change the motion, in mm or degrees based units.
+    """
+    def __init__(self, axis):
+        """Initializes the ``Simulated_Settings`` class.
+
+        Args:
+            axis (Simulated_Axis): axis of the device
+        """
+        self.axis = axis
+        self.values = {}
+
+
+    def set(self, setting, value, unit = None):
+        """Sets a setting of the device.
+
+        Args:
+            setting (string): name of the setting, e.g. 'accel'
+            value (float): value of the setting
+            unit (Units, optional): unit of ``value``, ignored. Defaults to None.
+        """
+        self.values[setting] = value
+        if setting == 'accel':
+            self.axis.accel = value
+        elif setting == 'maxspeed':
+            self.axis.max_speed = value
+
+
+    def get(self, setting, unit = None):
+        """Returns a setting of the device.
+
+        Args:
+            setting (string): name of the setting, e.g. 'accel'
+            unit (Units, optional): unit of the value, ignored. Defaults to None.
+
+        Returns:
+            float: value of the setting, or 0.0 if it was never set
+        """
+        if setting == 'accel':
+            return self.axis.accel
+        if setting == 'maxspeed':
+            return self.axis.max_speed
+        return self.values.get(setting, 0.0)
+
+
+class Simulated_Warnings():
+    """Warning flags of a ``Simulated_Device``.
+    """
+    def __init__(self, device):
+        """Initializes the ``Simulated_Warnings`` class.
+
+        Args:
+            device (Simulated_Device): device whose flags are reported
+        """
+        self.device = device
+
+
+    def get_flags(self):
+        """Returns the warning flags currently raised on the device.
+
+        Returns:
+            set: warning flags, e.g. {WarningFlags.STALLED_AND_STOPPED}
+        """
+        return set(self.device.flags)
+
+
+    def clear_flags(self):
+        """Clears the warning flags of the device.
+
+        Returns:
+            set: warning flags raised before they were cleared
+        """
+        flags = set(self.device.flags)
+        self.device.flags.clear()
+        return flags
+
+
+class Simulated_Streams():
+    """Streams of a ``Simulated_Device``.
+    """
+    def __init__(self, axis):
+        """Initializes the ``Simulated_Streams`` class.
+
+        Args:
+            axis (Simulated_Axis): axis of the device
+        """
+        self.axis = axis
+
+
+    def get_stream(self, stream_id):
+        """Returns a stream of the device.
+
+        Args:
+            stream_id (int): number of the stream, ignored
+
+        Returns:
+            Simulated_Stream: new stream driving the axis of the device
+        """
+        return Simulated_Stream(self.axis)
+
+
+class Simulated_Connection():
+    """The ``Simulated_Connection`` class stands for the serial connection to the daisy chain of simulated devices.
+    """
+    def __init__(self, devices):
+        """Initializes the ``Simulated_Connection`` class.
+
+        Args:
+            devices (list): simulated devices in the order of the daisy chain
+        """
+        self.devices = devices
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        """Closes the connection. Nothing to do, the devices are kept by ``Simulated_Backend`` for the next connection.
+        """
+        pass
+
+
+    def detect_devices(self):
+        """Returns the devices on the daisy chain.
+
+        Returns:
+            list: simulated devices in the order of the daisy chain: Z, X, Y, rotation
+        """
+        return list(self.devices)
+
+
+class Simulated_Backend(Motion_Backend):
+    """The ``Simulated_Backend`` class replaces the stages with simulated ones, so that runs can be made and timed without hardware.
+
+    The four devices are created once and kept between connections, so the simulated stages stay where the last run left them.
+    Their clock can run in real time, faster, or not at all (see ``Simulated_Clock``), in which case a full map runs in seconds
+    and ``now()`` gives the time it would have taken. The probe is not simulated by this class.
+    """
+    def __init__(self, max_speeds, accels, limits, time_scale = 1.0, stall_probability = 0.0):
+        """Initializes the ``Simulated_Backend`` class. Every argument lists the X, Y, Z and rotation stages in this order.
+
+        Args:
+            max_speeds (list): maximum speeds in mm/s and degrees/s
+            accels (list): accelerations in mm/s^2 and degrees/s^2
+            limits (list): travel ranges [low, high] in mm and degrees
+            time_scale (float, optional): simulated seconds per real second, or 0 for no waiting at all. Defaults to 1.0.
+            stall_probability (float, optional): probability that a move stalls. Defaults to 0.0.
+        """
+        self.clock = Simulated_Clock(time_scale)
+        devices = [Simulated_Device(address, self.clock, max_speeds[index], accels[index], limits[index], stall_probability)
+                   for address, index in ((1, 2), (2, 0), (3, 1), (4, 3))]
+        self.connection = Simulated_Connection(devices)
+
+
+    def connect(self):
+        """Returns the connection to the simulated devices, the same one every time.
+
+        Returns:
+            Simulated_Connection: connection to use in a ``with`` block
+        """
+        return self.connection
+
+
+    def sleep(self, seconds):
+        """Waits for ``seconds`` on the simulated clock.
+
+        Args:
+            seconds (float): time to wait in seconds
+        """
+        self.clock.wait_until(self.clock.now() + seconds)
+
+
+    def now(self):
+        """Returns the time on the simulated clock.
+
+        Returns:
+            float: time in seconds
+        """
+        return self.clock.now()
+
+
+def create_backend(config_dict):
+    """Creates the motion backend selected in the configuration.
+
+    ==============================    =============================================================
+    Setting in config.json            Description
+    ==============================    =============================================================
+    'motion_backend'                  'zaber' for the real stages on 'comm_port_zaber', 'simulated' for simulated stages
+                                      (optional, defaults to 'zaber')
+    'x_speed', 'y_speed',             Maximum speed of the simulated stages, see ``Motion_Model`` (optional, default to 20 each)
+    'z_speed', 'r_speed'
+    'x_accel', 'y_accel',             Acceleration of the simulated stages ('r_accel' is optional, defaults to 50)
+    'z_accel', 'r_accel'
+    'sim_limits'                      Travel range of the simulated stages, e.g. {"x" : [0, 500], "y" : [0, 500], "z" : [0, 1000],
+                                      "r" : [0, 360]}, in stage coordinates (optional, defaults to these values)
+    'sim_time_scale'                  Simulated seconds per real second, or 0 to run without waiting (optional, defaults to 1.0).
+                                      0 cannot be used with 'probe_backend' 'simulated': ``Probe_Simulator`` and
+                                      ``Settle_Detector`` run in real time, while the stages would only move in simulated time.
+    'sim_stall_probability'           Probability that a simulated move stalls (optional, defaults to 0.0)
+    ==============================    =============================================================
+
+    Args:
+        config_dict (dict): configurations of the current profile
+
+    Returns:
+        Motion_Backend: ``Zaber_Backend`` or ``Simulated_Backend``
+
+    Raises:
+        ValueError: if 'sim_time_scale' is 0 and the probe is simulated too
+    """
+    if config_dict.get('motion_backend', 'zaber') != 'simulated':
+        return Zaber_Backend(config_dict['comm_port_zaber'])
+    if config_dict.get('sim_time_scale', 1.0) == 0 and config_dict.get('probe_backend', 'serial') == 'simulated':
+        raise ValueError('A sim_time_scale of 0 cannot be used with the simulated probe, which runs in real time.')
+
+    limits = dict({'x' : [0, 500], 'y' : [0, 500], 'z' : [0, 1000], 'r' : [0, 360]}, **config_dict.get('sim_limits', {}))
+    return Simulated_Backend([config_dict.get('x_speed', 20.0), config_dict.get('y_speed', 20.0),
+                              config_dict.get('z_speed', 20.0), config_dict.get('r_speed', 20.0)],
+                             [config_dict['x_accel'], config_dict['y_accel'], config_dict['z_accel'], config_dict.get('r_accel', 50.0)],
+                             [limits['x'], limits['y'], limits['z'], limits['r']],
+                             config_dict.get('sim_time_scale', 1.0),
+                             config_dict.get('sim_stall_probability', 0.0))
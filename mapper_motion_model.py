@@ -0,0 +1,145 @@
+import numpy as np
+from mapper_base import Mapper
+
+class Motion_Model(Mapper):
+    """The ``Motion_Model`` class inherits ``Mapper``. It estimates how long the Zaber stages take to move between points,
+    assuming every axis follows a trapezoidal velocity profile: constant acceleration up to its maximum speed, cruise,
+    then constant deceleration. Short moves never reach the maximum speed and follow a triangular profile instead.
+
+    The estimate follows the order of motion in ``Controller.moveXYZR``: X, Y and rotation move together, and Z only starts
+    once all three have stopped. The time of one move is therefore ``max(tX, tY, tR) + tZ``. With 'motion_mode' 'concurrent',
+    the moves that stay inside the safe envelope (see ``Controller.is_move_safe``) start all four axes together and take
+    ``max(tX, tY, tZ, tR)``.
+
+    All functions work on numpy arrays, so a whole path can be estimated at once.
+
+    Args:
+        Mapper: Mapper class that contains variables with key configurations.
+    """
+    def __init__(self):
+        """Creates an instance of the ``Motion_Model`` class.
+
+        ========================   ==============================    =============================================================
+        Variable name              Related setting in config.json    Description
+        ========================   ==============================    =============================================================
+        ``self.max_speeds``        'x_speed', 'y_speed',             Maximum speed of the X, Y, Z stages in mm/s and of the rotation
+                                   'z_speed', 'r_speed'              stage in degrees/s (optional, default to 20 each). These should
+                                                                     match the 'maxspeed' setting of the stages.
+        ``self.accels``            'x_accel', 'y_accel',             Acceleration of the X, Y, Z stages in mm/s^2 and of the rotation
+                                   'z_accel', 'r_accel'              stage in degrees/s^2 ('r_accel' is optional, defaults to 50)
+        ``self.move_overhead``     'move_overhead_sec'               Fixed time per move for commands and replies on the serial chain,
+                                                                     in seconds (optional, defaults to 0.05)
+        ``self.motion_mode``       'motion_mode'                     'sequential' or 'concurrent', see ``Controller`` (optional,
+                                                                     defaults to 'sequential')
+        ``self.safe_envelope``     'safe_envelope'                   Box in magnet coordinates where all axes may move together, see
+                                                                     ``Controller`` (optional, defaults to None)
+        ========================   ==============================    =============================================================
+        """
+        self.config_dict = Mapper.config_dict
+
+        # axis order is X, Y, Z, rotation, the same as the columns of a path
+        self.max_speeds = np.array([self.config_dict.get('x_speed', 20.0),
+                                    self.config_dict.get('y_speed', 20.0),
+                                    self.config_dict.get('z_speed', 20.0),
+                                    self.config_dict.get('r_speed', 20.0)], dtype=float)
+        self.accels = np.array([self.config_dict['x_accel'],
+                                self.config_dict['y_accel'],
+                                self.config_dict['z_accel'],
+                                self.config_dict.get('r_accel', 50.0)], dtype=float)
+        self.move_overhead = self.config_dict.get('move_overhead_sec', 0.05)
+        self.motion_mode = self.config_dict.get('motion_mode', 'sequential')
+        self.safe_envelope = self.config_dict.get('safe_envelope', None)
+
+
+    def axis_times(self, distances):
+        """Time taken by each axis to travel the given distances with a trapezoidal profile.
+
+        An axis that needs to travel ``d`` with maximum speed ``v`` and acceleration ``a`` reaches full speed only if ``d >= v^2/a``,
+        in which case it takes ``d/v + v/a``. Otherwise the profile is triangular and it takes ``2*sqrt(d/a)``.
+
+        Args:
+            distances (numpy array): distances of shape (..., 4), columns X, Y, Z and rotation. Signs are ignored.
+
+        Returns:
+            numpy array: time in seconds for each axis, same shape as ``distances``
+        """
+        distances = np.abs(distances)
+        ramp_distance = self.max_speeds ** 2 / self.accels
+        triangular = 2 * np.sqrt(distances / self.accels)
+        trapezoidal = distances / self.max_speeds + self.max_speeds / self.accels
+        return np.where(distances < ramp_distance, triangular, trapezoidal)
+
+
+    def safe_moves(self, start, end):
+        """Finds the moves that ``Controller.moveXYZR`` makes with all axes together, i.e. in 'concurrent' motion mode, the moves
+        whose start and end are inside ``self.safe_envelope``, as in ``Controller.is_move_safe``.
+
+        Args:
+            start (numpy array): points of shape (n, 4) or (4,), columns X, Y, Z and rotation
+            end (numpy array): points with the same shape as ``start``
+
+        Returns:
+            numpy array: True for each move made with all axes together
+        """
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        safe = np.full(np.broadcast(start, end).shape[:-1], self.motion_mode == 'concurrent' and self.safe_envelope is not None)
+        if not np.any(safe):
+            return safe
+        for axis, index in (('x', 0), ('y', 1), ('z', 2), ('r', 3)):
+            if axis not in self.safe_envelope:
+                if axis == 'r':
+                    continue
+                return np.zeros_like(safe)
+            low, high = self.safe_envelope[axis]
+            safe &= np.minimum(start[..., index], end[..., index]) >= low
+            safe &= np.maximum(start[..., index], end[..., index]) <= high
+        return safe
+
+
+    def phase_times(self, start, end):
+        """Time taken by the two phases of ``Controller.moveXYZR`` to move from ``start`` to ``end``.
+
+        The moves made with all axes together (see ``safe_moves()``) only have the first phase, which lasts as long as the
+        slowest of the four axes.
+
+        Args:
+            start (numpy array): points of shape (n, 4) or (4,), columns X, Y, Z and rotation
+            end (numpy array): points with the same shape as ``start``
+
+        Returns:
+            (numpy array, numpy array): time of the simultaneous X, Y, rotation move and time of the following Z move, in seconds
+        """
+        times = self.axis_times(np.asarray(end, dtype=float) - np.asarray(start, dtype=float))
+        xyr_time = np.max(times[..., [0, 1, 3]], axis=-1)
+        z_time = times[..., 2]
+        safe = self.safe_moves(start, end)
+        return np.where(safe, np.maximum(xyr_time, z_time), xyr_time), np.where(safe, 0.0, z_time)
+
+
+    def move_time(self, start, end):
+        """Total time to move from ``start`` to ``end``, i.e. both phases of ``Controller.moveXYZR``. Does not include the move overhead.
+
+        Args:
+            start (numpy array): points of shape (n, 4) or (4,), columns X, Y, Z and rotation
+            end (numpy array): points with the same shape as ``start``, or a single point
+
+        Returns:
+            numpy array: time in seconds for each move
+        """
+        xyr_time, z_time = self.phase_times(start, end)
+        return xyr_time + z_time
+
+
+    def path_time(self, points):
+        """Total motion time along a path, including the move overhead for each move.
+
+        Args:
+            points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+
+        Returns:
+            float: time in seconds
+        """
+        if len(points) < 2:
+            return 0.0
+        return float(np.sum(self.move_time(points[:-1], points[1:])) + self.move_overhead * (len(points) - 1))
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+from time import time
+from mapper_run_journal import file_hash
+
+# configurations that change the points of the path, or their order, for each shape
+SHAPE_KEYS = {'cylinder' : ['radius', 'xy_spacing', 'rotation_points'],
+              'rectangular' : ['x_range', 'x_spacing', 'y_range', 'y_spacing', 'rotation_points'],
+              'custom' : []}
+COMMON_KEYS = ['shape', 'z_range', 'z_spacing', 'path_format', 'optimize_path']
+# only used when the path is reordered by Path_Optimizer, which estimates move times with Motion_Model
+OPTIMIZER_KEYS = ['two_opt_window', 'optimize_time_limit_sec', 'optimize_chunk_size', 'x_speed', 'y_speed', 'z_speed', 'r_speed',
+                  'x_accel', 'y_accel', 'z_accel', 'r_accel', 'move_overhead_sec', 'motion_mode', 'safe_envelope']
+
+
+def normalize(value):
+    """Writes the numbers of a configuration as floats, so that e.g. a spacing of 5 and of 5.0 give the same key.
+    """
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key : normalize(item) for key, item in value.items()}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def path_key(config_dict):
+    """Computes the key of the path that a profile generates: the SHA-256 hash of the configurations that change the path
+    (see ``SHAPE_KEYS``, ``COMMON_KEYS`` and ``OPTIMIZER_KEYS``) and, for a custom path, of the content of the custom XYR file.
+    The offsets, the file names and the other configurations are left out, so that profiles that only differ by those share a path.
+
+    Args:
+        config_dict (dict): configurations of the profile
+
+    Returns:
+        string: hexadecimal digest
+    """
+    shape = config_dict.get('shape')
+    keys = COMMON_KEYS + SHAPE_KEYS.get(shape, [])
+    optimize_path = str(config_dict.get('optimize_path', 'False'))
+    if optimize_path[:1] in ('T', 't'):
+        keys = keys + OPTIMIZER_KEYS
+    description = {key : normalize(config_dict.get(key)) for key in keys}
+    if shape == 'custom':
+        description['custom_xyr_hash'] = file_hash(config_dict['custom_xyr_path_filename'])
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def file_state(filename):
+    """Size and modification time of a file, to tell whether it changed since it was written.
+
+    Args:
+        filename (string): file name
+
+    Returns:
+        list: size in bytes and modification time in ns, or None if the file does not exist
+    """
+    if not os.path.exists(filename):
+        return None
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Path_Cache():
+    """The ``Path_Cache`` class keeps copies of the paths generated by ``Points_Generator``, keyed by ``path_key()``, so that a path
+    is only generated and written once for a given set of configurations.
+
+    Each cached path is a folder named after its key, holding a copy of every file of the path (path CSV, edges CSV, and the
+    binary '.npy' copy and its JSON header if 'path_format' is 'npy'). An index file in the cache folder records when each path
+    was last used, and the key and the size and modification time of the files currently in place, e.g. 'path/path.csv'. With that:
+
+    * if the files in place were written from the same key and have not changed since, nothing is done
+    * else if the key is cached, its files are copied in place, without generating the path again
+    * else the path is generated as usual and then added to the cache
+
+    Once the cache holds more than ``max_entries`` paths, the least recently used ones are deleted.
+    """
+    def __init__(self, folder, max_entries = 8):
+        """Initializes the ``Path_Cache`` class and loads its index.
+
+        Args:
+            folder (string): cache folder, e.g. 'path/cache'
+            max_entries (int, optional): number of paths kept. Defaults to 8.
+        """
+        self.folder = folder
+        self.max_entries = max_entries
+        self.index_filename = os.path.join(folder, 'index.json')
+        self.index = {'entries' : {}, 'current' : {}}
+        if os.path.exists(self.index_filename):
+            with open(self.index_filename, 'r') as f:
+                self.index = json.load(f)
+
+
+    def save(self):
+        """Writes the index, atomically: a temporary file is written and renamed over the index.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        temporary = self.index_filename + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(temporary, self.index_filename)
+
+
+    def is_current(self, key, filenames):
+        """Checks whether files in place were written from a key and have not changed since.
+
+        Args:
+            key (string): key of the path, from ``path_key()``
+            filenames (list): files of the path, e.g. ['path/path.csv', 'path/path_edges.csv']
+
+        Returns:
+            bool: True if every file is current
+        """
+        for filename in filenames:
+            current = self.index['current'].get(filename)
+            if current is None or current['key'] != key or current['state'] != file_state(filename):
+                return False
+        return True
+
+
+    def restore(self, key, filenames):
+        """Puts the files of a path in place, copying them from the cache unless they are current already.
+
+        Args:
+            key (string): key of the path, from ``path_key()``
+            filenames (list): files of the path
+
+        Returns:
+            string: 'current' if the files were current, 'restored' if they were copied from the cache, or None if the path is
+                    not cached and has to be generated
+        """
+        if self.is_current(key, filenames):
+            status = 'current'
+        else:
+            entry = self.index['entries'].get(key)
+            folder = os.path.join(self.folder, key)
+            if entry is None or any(not os.path.exists(os.path.join(folder, os.path.basename(filename))) for filename in filenames):
+                return None
+            for filename in filenames:
+                shutil.copyfile(os.path.join(folder, os.path.basename(filename)), filename)
+                self.index['current'][filename] = {'key' : key, 'state' : file_state(filename)}
+            status = 'restored'
+        if key in self.index['entries']:
+            # the files in place may be current after their copy was evicted
+            self.index['entries'][key]['last_used'] = time()
+        self.save()
+        return status
+
+
+    def store(self, key, filenames):
+        """Adds the files of a newly generated path to the cache, and deletes the least recently used paths over ``max_entries``.
+
+        Args:
+            key (string): key of the path, from ``path_key()``
+            filenames (list): files of the path
+        """
+        folder = os.path.join(self.folder, key)
+        os.makedirs(folder, exist_ok=True)
+        for filename in filenames:
+            shutil.copyfile(filename, os.path.join(folder, os.path.basename(filename)))
+            self.index['current'][filename] = {'key' : key, 'state' : file_state(filename)}
+        self.index['entries'][key] = {'last_used' : time()}
+
+        entries = sorted(self.index['entries'], key=lambda key: self.index['entries'][key]['last_used'], reverse=True)
+        for old_key in entries[self.max_entries:]:
+            shutil.rmtree(os.path.join(self.folder, old_key), ignore_errors=True)
+            del self.index['entries'][old_key]
+        self.save()
@@ -0,0 +1,162 @@
+import csv
+import json
+import os
+from itertools import islice
+import numpy as np
+
+# Header of every path CSV file
+PATH_HEADER = ['X', 'Y', 'Z', 'Rotation']
+
+
+def write_csv_chunks(filename, chunks, header = PATH_HEADER):
+    """Writes a path into a CSV file one chunk at a time, so the whole path never has to be held in memory.
+
+    **The CSV file must be closed and available for writing during execution.**
+
+    Args:
+        filename (string): CSV file to save the points to, e.g. 'path/path.csv'
+        chunks (iterable): numpy arrays (or lists) with 4 columns for X, Y, Z and rotation, e.g. from ``Points_Generator.iter_points()``
+        header (list, optional): header row. Defaults to ``PATH_HEADER``.
+
+    Returns:
+        int: number of points written
+    """
+    num_points = 0
+    with open(filename, 'w', encoding='UTF8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            num_points += len(chunk)
+    return num_points
+
+
+def iter_csv_chunks(filename, chunk_size = 10000, start = 0):
+    """Reads a path CSV file and yields its points in chunks of at most ``chunk_size`` rows. The header row is skipped.
+
+    Only one chunk is held in memory at a time, so paths of any length can be run.
+
+    Args:
+        filename (string): path CSV file, e.g. 'path/path.csv'
+        chunk_size (int, optional): maximum number of points per chunk. Defaults to 10000.
+        start (int, optional): index of the first point to read, the rows before it are skipped without being parsed. Defaults to 0.
+
+    Yields:
+        numpy array: points with 4 columns for X, Y, Z and rotation
+    """
+    with open(filename, 'r', encoding='UTF8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = []
+        for row in islice(reader, start, None):
+            rows.append([float(i) for i in row])
+            if len(rows) == chunk_size:
+                yield np.array(rows)
+                rows = []
+        if len(rows) > 0:
+            yield np.array(rows)
+
+
+def npy_filename(filename):
+    """Returns the name of the binary path file that goes with a path CSV file, e.g. 'path/path.npy' for 'path/path.csv'.
+
+    Args:
+        filename (string): path CSV file name
+
+    Returns:
+        string: binary path file name
+    """
+    return os.path.splitext(filename)[0] + '.npy'
+
+
+def header_filename(filename):
+    """Returns the name of the JSON header that describes a binary path file, e.g. 'path/path.json' for 'path/path.npy'.
+
+    Args:
+        filename (string): binary path file name
+
+    Returns:
+        string: JSON header file name
+    """
+    return os.path.splitext(filename)[0] + '.json'
+
+
+def write_npy_chunks(filename, chunks, num_points, header = None):
+    """Writes a path into a binary ``.npy`` file one chunk at a time, through a memory map, so the whole path never has to be held in memory.
+
+    The ``.npy`` file holds a (num_points, 4) float64 array with columns X, Y, Z and rotation. Information about the path 
+    (profile, shape, spacing, ordering, ...) is written to a small JSON header next to it, see ``header_filename()``.
+
+    Args:
+        filename (string): binary path file, e.g. 'path/path.npy'
+        chunks (iterable): numpy arrays with 4 columns for X, Y, Z and rotation, e.g. from ``Points_Generator.iter_points()``
+        num_points (int): total number of points in ``chunks``
+        header (dict, optional): information about the path. Defaults to None.
+    """
+    if num_points == 0:
+        # an empty file cannot be memory mapped
+        np.save(filename, np.zeros([0, 4]))
+    else:
+        points = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64, shape=(num_points, 4))
+        index = 0
+        for chunk in chunks:
+            points[index:index + len(chunk)] = chunk
+            index += len(chunk)
+        points.flush()
+        del points
+
+    if header is None:
+        header = {}
+    header = dict(header, num_points=num_points, columns=PATH_HEADER)
+    with open(header_filename(filename), 'w') as f:
+        json.dump(header, f, indent=1)
+
+
+def open_npy_path(filename):
+    """Opens a binary path file as a read-only memory map. Nothing is parsed and no points are read until they are accessed, 
+    so any point can be reached directly by its index.
+
+    Args:
+        filename (string): binary path file, e.g. 'path/path.npy'
+
+    Returns:
+        (numpy memmap, dict): points with 4 columns for X, Y, Z and rotation, and the JSON header (empty if there is none)
+    """
+    points = np.load(filename, mmap_mode='r')
+    header = {}
+    if os.path.exists(header_filename(filename)):
+        with open(header_filename(filename), 'r') as f:
+            header = json.load(f)
+    return points, header
+
+
+def iter_npy_chunks(filename, chunk_size = 10000, start = 0):
+    """Yields the points of a binary path file in chunks of at most ``chunk_size`` rows, starting at index ``start``.
+
+    Args:
+        filename (string): binary path file, e.g. 'path/path.npy'
+        chunk_size (int, optional): maximum number of points per chunk. Defaults to 10000.
+        start (int, optional): index of the first point to read. Defaults to 0.
+
+    Yields:
+        numpy array: points with 4 columns for X, Y, Z and rotation
+    """
+    points, header = open_npy_path(filename)
+    for index in range(start, len(points), chunk_size):
+        yield np.array(points[index:index + chunk_size])
+
+
+def iter_path_chunks(filename, chunk_size = 10000, start = 0):
+    """Yields the points of a path file in chunks, using ``iter_npy_chunks()`` for '.npy' files and ``iter_csv_chunks()`` otherwise.
+
+    Args:
+        filename (string): path file, e.g. 'path/path.csv' or 'path/path.npy'
+        chunk_size (int, optional): maximum number of points per chunk. Defaults to 10000.
+        start (int, optional): index of the first point to read. Defaults to 0.
+
+    Returns:
+        generator: chunks of points with 4 columns for X, Y, Z and rotation
+    """
+    if os.path.splitext(filename)[1] == '.npy':
+        return iter_npy_chunks(filename, chunk_size, start)
+    return iter_csv_chunks(filename, chunk_size, start)
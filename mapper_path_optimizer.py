@@ -0,0 +1,246 @@
+import os
+from time import monotonic
+import numpy as np
+from mapper_base import Mapper
+from mapper_motion_model import Motion_Model
+from mapper_path_io import iter_path_chunks, iter_csv_chunks, write_csv_chunks, write_npy_chunks, open_npy_path, npy_filename
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# number of nearest points (in the space of cKDTree) whose move times are compared at each step of the nearest neighbour
+NEIGHBOURS = 16
+
+class Path_Optimizer(Mapper):
+    """The ``Path_Optimizer`` class inherits ``Mapper``. It reorders any point cloud to reduce the time spent moving between points,
+    using the travel times estimated by ``Motion_Model``.
+
+    The cost of going from one point to the next is the time ``Controller.moveXYZR`` takes for that move: X, Y and rotation move
+    together, then Z, or all axes together inside the safe envelope in 'concurrent' motion mode. Every move of the reordered path
+    is still made by ``moveXYZR``, so the "X/Y/R first, then Z" rule that keeps the probe clear of the magnet is kept.
+
+    The optimization has two steps:
+
+    * Nearest neighbour: starting from the first point, always go to the unvisited point that is quickest to reach.
+    * 2-opt: reverse sections of the path whenever this makes it quicker, only looking ``self.window`` points ahead so
+      that large paths can be improved in reasonable time.
+
+    The path is read, optimized and written one section of ``self.chunk_size`` points at a time, so that large paths are never
+    held in memory: points are only reordered within their section, and the sections stay in path order. The result of a
+    section is only kept if it is quicker than its original order. Both steps stop once ``self.time_limit`` has passed since
+    the start of ``run()``; the points left are kept in their order, and the sections left are copied unchanged.
+
+    Args:
+        Mapper: Mapper class that contains variables with key configurations.
+    """
+    def __init__(self):
+        """Creates an instance of the ``Path_Optimizer`` class.
+
+        ========================   ==============================    =============================================================
+        Variable name              Related setting in config.json    Description
+        ========================   ==============================    =============================================================
+        ``self.path_filename``     'path_filename'                   Path to the CSV that stores the full mapping path
+        ``self.path_format``       'path_format'                     'npy' if the path also has a binary copy (optional, defaults to 'csv')
+        ``self.window``            'two_opt_window'                  Number of points ahead considered by 2-opt (optional, defaults to 50)
+        ``self.time_limit``        'optimize_time_limit_sec'         Maximum time spent optimizing the path in seconds (optional,
+                                                                     defaults to 60)
+        ``self.chunk_size``        'optimize_chunk_size'             Number of points of each section of the path optimized on its own
+                                                                     (optional, defaults to 5000)
+        ========================   ==============================    =============================================================
+        """
+        self.config_dict = Mapper.config_dict
+        self.path_filename = self.config_dict['path_filename']
+        self.path_format = self.config_dict.get('path_format', 'csv')
+        self.window = self.config_dict.get('two_opt_window', 50)
+        self.time_limit = self.config_dict.get('optimize_time_limit_sec', 60.0)
+        self.chunk_size = self.config_dict.get('optimize_chunk_size', 5000)
+        self.motion_model = Motion_Model()
+        # time at which the optimization stops, set by optimize() and run()
+        self.deadline = None
+
+
+    def nearest_neighbour(self, points):
+        """Orders the points by always moving to the unvisited point with the shortest estimated move time. The first point is kept.
+
+        With scipy, the candidates are the ``NEIGHBOURS`` unvisited points nearest to the current one in a ``cKDTree`` of the
+        coordinates divided by the maximum speed of each axis, i.e. in seconds at full speed, and the exact move times are only
+        computed for them. More points are queried when they have all been visited. Without scipy, the move times to every
+        unvisited point are computed.
+
+        If ``self.deadline`` passes, the points not visited yet are added in their original order.
+
+        Args:
+            points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+
+        Returns:
+            numpy array: indices into ``points`` in the new order
+        """
+        num_points = len(points)
+        unvisited = np.ones(num_points, dtype=bool)
+        order = np.empty(num_points, dtype=int)
+        tree = cKDTree(points / self.motion_model.max_speeds) if cKDTree is not None else None
+        current = 0
+        for i in range(num_points):
+            order[i] = current
+            unvisited[current] = False
+            if i == num_points - 1:
+                break
+            if self.deadline is not None and monotonic() > self.deadline:
+                order[i + 1:] = np.flatnonzero(unvisited)
+                break
+            candidates = self.candidates(tree, points, current, unvisited, num_points - 1 - i)
+            times = self.motion_model.move_time(points[candidates], points[current])
+            current = candidates[np.argmin(times)]
+        return order
+
+
+    def candidates(self, tree, points, current, unvisited, num_unvisited):
+        """Finds the unvisited points to compare at one step of ``nearest_neighbour()``.
+
+        Args:
+            tree (cKDTree): tree of the scaled points, or None to return every unvisited point
+            points (numpy array): points of shape (n, 4)
+            current (int): index of the current point
+            unvisited (numpy array): True for the points not visited yet
+            num_unvisited (int): number of points not visited yet
+
+        Returns:
+            numpy array: indices of unvisited points
+        """
+        if tree is None or num_unvisited <= NEIGHBOURS:
+            return np.flatnonzero(unvisited)
+        # the current point is the nearest, so it takes one of the neighbours
+        count = NEIGHBOURS + 1
+        while True:
+            count = min(count, len(points))
+            distances, indices = tree.query(points[current] / self.motion_model.max_speeds, count)
+            # in path order, so that ties are broken as without the tree, in favour of the original order
+            indices = np.sort(indices[unvisited[indices]])
+            if len(indices) > 0 or count == len(points):
+                return indices
+            count *= 4
+
+
+    def two_opt(self, points, order):
+        """Improves an order by reversing sections of it, as long as this reduces the total move time. The first point is kept.
+
+        Reversing the section from ``i`` to ``j`` replaces the moves (i-1 -> i) and (j -> j+1) with (i-1 -> j) and (i -> j+1).
+        The moves inside the section keep the same time, since a move takes as long in both directions.
+
+        Args:
+            points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+            order (numpy array): indices into ``points``
+
+        Returns:
+            numpy array: improved indices into ``points``
+        """
+        order = order.copy()
+        num_points = len(order)
+        improved = True
+        while improved and (self.deadline is None or monotonic() < self.deadline):
+            improved = False
+            for i in range(1, num_points - 1):
+                if self.deadline is not None and monotonic() > self.deadline:
+                    break
+                j = np.arange(i + 1, min(i + self.window, num_points))
+                before = points[order[i - 1]]
+                first = points[order[i]]
+                last = points[order[j]]
+
+                # time of the moves replaced and of the new moves, the move after j does not exist at the end of the path
+                has_next = j + 1 < num_points
+                after = points[order[np.minimum(j + 1, num_points - 1)]]
+                old_time = self.motion_model.move_time(before, first) + np.where(has_next, self.motion_model.move_time(last, after), 0)
+                new_time = self.motion_model.move_time(before, last) + np.where(has_next, self.motion_model.move_time(first, after), 0)
+
+                gain = old_time - new_time
+                best = np.argmax(gain)
+                if gain[best] > 1e-9:
+                    order[i:j[best] + 1] = order[i:j[best] + 1][::-1]
+                    improved = True
+        return order
+
+
+    def optimize_section(self, points):
+        """Reorders one section of a path to reduce its estimated move time. The first point is kept.
+
+        Args:
+            points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+
+        Returns:
+            numpy array: reordered points, or ``points`` if the original order is quicker or the time limit has passed
+        """
+        if len(points) < 3 or (self.deadline is not None and monotonic() > self.deadline):
+            return points
+        optimized = points[self.two_opt(points, self.nearest_neighbour(points))]
+        if self.motion_model.path_time(optimized) >= self.motion_model.path_time(points):
+            # the original order was already better
+            return points
+        return optimized
+
+
+    def optimize(self, points):
+        """Reorders a point cloud held in memory to reduce the estimated move time, section by section as in ``run()``, and prints
+        the estimated motion time before and after.
+
+        Args:
+            points (numpy array): points of shape (n, 4), columns X, Y, Z and rotation
+
+        Returns:
+            (numpy array, float, float): reordered points, estimated motion time before and after in seconds
+        """
+        points = np.asarray(points, dtype=float)
+        self.deadline = monotonic() + self.time_limit
+        sections = [points[index:index + self.chunk_size] for index in range(0, len(points), self.chunk_size)]
+        optimized = np.concatenate([self.optimize_section(section) for section in sections]) if len(points) else points
+        time_before = self.motion_model.path_time(points)
+        time_after = self.motion_model.path_time(optimized)
+        self.print_times(time_before, time_after)
+        return optimized, time_before, time_after
+
+
+    def print_times(self, time_before, time_after):
+        """Prints the estimated motion time before and after the optimization.
+
+        Args:
+            time_before (float): motion time of the original order in seconds
+            time_after (float): motion time of the new order in seconds
+        """
+        print('Estimated motion time: %.1f s before optimization, %.1f s after (%.1f%% less).'
+              % (time_before, time_after, 100 * (time_before - time_after) / time_before if time_before > 0 else 0))
+
+
+    def run(self):
+        """This is the main function accessed from the outside. Reads the path from ``self.path_filename`` one section of
+        ``self.chunk_size`` points at a time, optimizes each section, and writes the path back (also to the binary '.npy' copy if
+        'path_format' is 'npy'). The new path is written to a temporary file that replaces the path once complete. The edges path
+        is not changed.
+        """
+        self.deadline = monotonic() + self.time_limit
+        # the path being read cannot be written at the same time
+        temporary = self.path_filename + '.tmp'
+        times = {'before' : 0.0, 'after' : 0.0}
+
+        def optimized_sections():
+            last = {'before' : None, 'after' : None}
+            for section in iter_path_chunks(self.path_filename, self.chunk_size):
+                optimized = self.optimize_section(section)
+                # the move from the end of the previous section counts too
+                for key, points in (('before', section), ('after', optimized)):
+                    if last[key] is not None:
+                        points = np.vstack((last[key], points))
+                    times[key] += self.motion_model.path_time(points)
+                    last[key] = points[-1]
+                yield optimized
+
+        num_points = write_csv_chunks(temporary, optimized_sections())
+        os.replace(temporary, self.path_filename)
+        if self.path_format == 'npy':
+            points_npy, header = open_npy_path(npy_filename(self.path_filename))
+            del points_npy
+            header['ordering'] = 'optimized for estimated move time, in sections of %d points' % self.chunk_size
+            write_npy_chunks(npy_filename(self.path_filename), iter_csv_chunks(self.path_filename, self.chunk_size), num_points, header)
+        self.print_times(times['before'], times['after'])
+        print('\n*************** Path order optimized ************\n')
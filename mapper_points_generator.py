@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
+import os
 import numpy as np
 import csv
 #from csv import reader, writer
 from mapper_base import Mapper
+from mapper_path_io import write_csv_chunks, write_npy_chunks, npy_filename, header_filename, iter_path_chunks
+from mapper_motion_model import Motion_Model
+from mapper_path_optimizer import Path_Optimizer
+from mapper_path_cache import Path_Cache, path_key
 
 class Points_Generator(Mapper):
     """The ``Points_Generator`` class inherits Mapper. It instantiates an object for generated a point cloud in X,Y,Z, and rotation axis.
@@ -88,6 +93,16 @@ class Points_Generator(Mapper):
         ``self.x_accel``           'x_accel'                       Maximum acceleration in X direction in mm/s^2
         ``self.y_accel``           'y_accel'                       Maximum acceleration in Y direction in mm/s^2
         ``self.z_accel``           'z_accel'                       Maximum acceleration in Z direction in mm/s^2
+        ``self.path_chunk_size``   'path_chunk_size'               Number of points generated at a time when writing the path (optional, 
+                                                                   defaults to 10000)
+        ``self.path_format``       'path_format'                   'csv' to write the path as CSV only, 'npy' to also write it as a binary 
+                                                                   '.npy' file next to the CSV, which the Controller then reads instead 
+                                                                   (optional, defaults to 'csv')
+        ``self.optimize_path``     'optimize_path'                 'True' to reorder the path to reduce the estimated move time with 
+                                                                   ``Path_Optimizer`` (optional, defaults to 'False')
+        ``self.path_cache_size``   'path_cache_size'               Number of generated paths kept in the 'cache' folder next to the path 
+                                                                   CSV, see ``Path_Cache``. 0 to always generate the path (optional, 
+                                                                   defaults to 8)
         ======================   ==============================    =============================================================
 
         """
@@ -124,6 +139,26 @@ class Points_Generator(Mapper):
         self.z_range = self.config_dict['z_range']
         self.z_spacing = self.config_dict['z_spacing']
         self.probe_stop_time_sec = self.config_dict['probe_stop_time_sec']
+
+        # number of points generated at a time when streaming the path to file
+        self.path_chunk_size = self.config_dict.get('path_chunk_size', 10000)
+
+        # 'csv' to write the path as CSV only, 'npy' to also write a binary copy for the Controller
+        self.path_format = self.config_dict.get('path_format', 'csv')
+
+        # reorder the path to reduce the move time, see Path_Optimizer
+        optimize_path = self.config_dict.get('optimize_path', 'False')
+        self.optimize_path = optimize_path[0] == 'T' or optimize_path[0] == 't'
+
+        # paths already generated, see Path_Cache
+        self.path_cache_size = self.config_dict.get('path_cache_size', 8)
+        self.path_cache = None
+        if self.path_cache_size > 0:
+            self.path_cache = Path_Cache(os.path.join(os.path.dirname(self.path_filename), 'cache'), self.path_cache_size)
+
+        # full point cloud, only built by generate() and generate_custom(), run() streams the path instead
+        self.points = None
+        self.num_points_xyr = None
         
 
     def generate(self):
@@ -146,12 +181,23 @@ class Points_Generator(Mapper):
         * This is repeated until all the points in XY plane have been passed. 
         * Then the mapper rotates to the next point specified in `self.rotation_points` and repeats the sequence in XYZ space again.
 
+        The grid is built with NumPy array operations rather than Python loops: the XY plane is a grid whose odd rows are reversed, 
+        points outside the circle are removed with a boolean mask (cylinder only), and the Z sweeps are added by ``add_z_points()``.
+
         The code prints 'Path generated for {self.shape} region' after execution.
         """
-        # Constants for order
-        order_inc = True
-        order_dec = False
+        self.generate_plane()
+        self.points = self.add_z_points(self.xyr_block(0, self.num_points_xyr))
+
+        print(f'\n*************** Path generated for {self.shape} region ************\n')
 
+
+    def generate_plane(self):
+        """This function generates the points of the XY plane for the cylinder and rectangular shapes, in path order.
+
+        **Modifies** ``self.points_xy``, ``self.num_angles`` and ``self.num_points_xyr``. This is all ``xyr_block()`` and ``iter_points()`` 
+        need, so the full point cloud does not have to be built.
+        """
         # Generate xy points in cylindrical coordinates
         if self.shape == "cylinder":
             # number of columns (= num of rows) under the given radius and spacing
@@ -159,35 +205,14 @@ class Points_Generator(Mapper):
             self.num_cols = int(2 * self.radius / self.xy_spacing + 1)
 
             # possible positions of each column
-            pos_xy = np.arange(-self.xy_spacing * num_cols_half, self.xy_spacing * (num_cols_half + 1), self.xy_spacing)
-
-            # Fill all possible y, z values
-            points_xy = np.zeros([self.num_cols * self.num_cols, 2])
-
-            # Initialize variables for pathing
-            index = 0
-            order = order_inc
-            for i in range(self.num_cols):
-                if order == order_inc:
-                    for j in range(0, self.num_cols, 1):
-                        x = pos_xy[i]
-                        y = pos_xy[j]
-                        # make sure points are within circle
-                        if (x *  x+ y * y <= self.radius * self.radius):
-                            points_xy[index][0] = x
-                            points_xy[index][1] = y
-                            index += 1
-                if order == order_dec:
-                    for j in range(self.num_cols-1, -1, -1):
-                        x = pos_xy[i]
-                        y = pos_xy[j]
-                        if (x * x + y * y <= self.radius * self.radius):
-                            points_xy[index][0]= x
-                            points_xy[index][1] = y
-                            index += 1
-
-                # switch increasing/decreasing order for every pass
-                order = not(order)
+            pos_xy = np.arange(-self.xy_spacing * num_cols_half, self.xy_spacing * (num_cols_half + 1), self.xy_spacing)[:self.num_cols]
+
+            # grid with one row per X column, Y going up in even columns and down in odd columns
+            grid_x, grid_y = self.serpentine_grid(pos_xy, pos_xy)
+
+            # make sure points are within circle, boolean indexing keeps the row-major (path) order
+            inside = grid_x * grid_x + grid_y * grid_y <= self.radius * self.radius
+            points_xy = np.column_stack((grid_x[inside], grid_y[inside]))
 
         # Generate xy points in rectangular coordinates
         elif self.shape == "rectangular":
@@ -198,66 +223,137 @@ class Points_Generator(Mapper):
             self.num_y = int(self.y_range/self.y_spacing) + 1
 
             # possible positions of each column
-            pos_x = np.arange(-self.x_spacing * num_x_half, self.x_spacing * (num_x_half + 1), self.x_spacing)
-            pos_y = np.arange(-self.y_spacing * num_y_half, self.y_spacing * (num_y_half + 1), self.y_spacing)
-
-            # Fill all possible y, z values
-            points_xy = np.zeros([self.num_x * self.num_y, 2])
-
-            # Initialize variables for pathing
-            index = 0
-            order = order_inc
-            for i in range(self.num_x):
-                if order == order_inc:
-                    for j in range(0, self.num_y, 1):
-                        points_xy[index][0] = pos_x[i]
-                        points_xy[index][1] = pos_y[j]
-                        index += 1
-                if order == order_dec:
-                    for j in range(self.num_y-1, -1, -1):
-                        points_xy[index][0] = pos_x[i]
-                        points_xy[index][1] = pos_y[j]
-                        index += 1
-                # switch increasing/decreasing order for every pass
-                order = not(order)
-
-        # trim all zeros and get valid point length
-        points_xy_1D_trim = np.trim_zeros(points_xy.flatten(), trim = 'b')
-        # case when y coordinate happen to be zero
-        if (len(points_xy_1D_trim) % 2 != 0):
-            points_xy_1D_trim = np.append(points_xy_1D_trim, 0)
-        points_xy = np.reshape(points_xy_1D_trim, (-1, 2))
-        num_points_xy = len(points_xy)
-
-        # possible positions in z direction (going into magnet)
+            pos_x = np.arange(-self.x_spacing * num_x_half, self.x_spacing * (num_x_half + 1), self.x_spacing)[:self.num_x]
+            pos_y = np.arange(-self.y_spacing * num_y_half, self.y_spacing * (num_y_half + 1), self.y_spacing)[:self.num_y]
+
+            # grid with one row per X column, Y going up in even columns and down in odd columns
+            grid_x, grid_y = self.serpentine_grid(pos_x, pos_y)
+            points_xy = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+
+        self.points_xy = points_xy
+
+        # the XY plane is repeated for every angle, rotation changing last
+        self.num_angles = len(self.rotation_angles)
+        self.num_points_xyr = len(points_xy) * self.num_angles
+
+
+    def xyr_block(self, start, stop):
+        """Returns the X, Y, rotation points with index ``start`` (included) to ``stop`` (excluded), in path order. Requires 
+        ``generate_plane()`` or ``load_custom()`` to have been called first.
+
+        For the cylinder and rectangular shapes, the points are computed from ``self.points_xy`` and ``self.rotation_angles``, 
+        the XY plane being repeated for every angle.
+
+        Args:
+            start (int): index of the first point
+            stop (int): index after the last point
+
+        Returns:
+            numpy array: points with 3 columns for X, Y and rotation
+        """
+        if self.shape == 'custom':
+            return self.points_xyr[start:stop]
+
+        indices = np.arange(start, stop)
+        num_points_xy = len(self.points_xy)
+        points_xyr = np.empty([len(indices), 3])
+        points_xyr[:, 0:2] = self.points_xy[indices % num_points_xy]
+        points_xyr[:, 2] = np.asarray(self.rotation_angles, dtype=float)[indices // num_points_xy]
+        return points_xyr
+
+
+    def iter_points(self, chunk_size = 10000):
+        """Generator that yields the full point cloud in chunks, in the same order as ``generate()`` and ``generate_custom()``. 
+        Requires ``generate_plane()`` or ``load_custom()`` to have been called first.
+
+        Only one chunk is built at a time, so memory use depends on the chunk size and the XY plane, not on the number of Z points or angles.
+
+        Args:
+            chunk_size (int, optional): approximate number of points per chunk, rounded to whole Z sweeps. Defaults to 10000.
+
+        Yields:
+            numpy array: points with 4 columns for X, Y, Z and rotation
+        """
+        num_xyr_per_chunk = max(1, chunk_size // len(self.z_positions()))
+        for start in range(0, self.num_points_xyr, num_xyr_per_chunk):
+            stop = min(start + num_xyr_per_chunk, self.num_points_xyr)
+            yield self.add_z_points(self.xyr_block(start, stop), start)
+
+
+    def head_points(self, num_points):
+        """Returns the first ``num_points`` points of the path (or fewer if the path is shorter), using ``iter_points()``.
+
+        Args:
+            num_points (int): number of points
+
+        Returns:
+            numpy array: points with 4 columns for X, Y, Z and rotation
+        """
+        chunks = []
+        num_collected = 0
+        for chunk in self.iter_points(self.path_chunk_size):
+            chunks.append(chunk)
+            num_collected += len(chunk)
+            if num_collected >= num_points:
+                break
+        return np.concatenate(chunks)[:num_points]
+
+
+    def serpentine_grid(self, pos_x, pos_y):
+        """Helper function that builds the XY grid in path order: one row per X position, with Y increasing in even rows 
+        and decreasing in odd rows.
+
+        Args:
+            pos_x (numpy array): possible positions in X direction
+            pos_y (numpy array): possible positions in Y direction
+
+        Returns:
+            (numpy array, numpy array): X and Y values of the grid, both of shape (len(pos_x), len(pos_y))
+        """
+        grid_x = np.repeat(pos_x[:, np.newaxis], len(pos_y), axis=1)
+        grid_y = np.tile(pos_y, (len(pos_x), 1))
+        grid_y[1::2] = grid_y[1::2, ::-1]
+        return grid_x, grid_y
+
+
+    def z_positions(self):
+        """Helper function that returns the possible positions in Z direction (going into magnet), from ``self.z_range`` and ``self.z_spacing``.
+
+        Returns:
+            numpy array: positions in Z direction in increasing order
+        """
         num_z = int(self.z_range/self.z_spacing) + 1
         num_z_half = int(self.z_range/self.z_spacing/2) + 1
-        pos_z = np.arange(- self.z_spacing * (num_z_half - 1), self.z_spacing * (num_z_half + 1), self.z_spacing)
+        return np.arange(- self.z_spacing * (num_z_half - 1), self.z_spacing * (num_z_half + 1), self.z_spacing)[:num_z]
 
-        # z direction and angular points
-        self.num_angles = len(self.rotation_angles)
-        self.points = np.zeros([num_points_xy * num_z * self.num_angles, 4])
-        index = 0
-        order = order_inc
-        for angle in self.rotation_angles:
-            for i in range(num_points_xy):
-                if order == order_inc:
-                    for j in range(0, num_z, 1):
-                        self.points[index][0] = points_xy[i][0]
-                        self.points[index][1] = points_xy[i][1]
-                        self.points[index][2] = pos_z[j]
-                        self.points[index][3] = angle
-                        index += 1
-                if order == order_dec:
-                    for j in range(num_z-1, -1, -1):
-                        self.points[index][0] = points_xy[i][0]
-                        self.points[index][1] = points_xy[i][1]
-                        self.points[index][2] = pos_z[j]
-                        self.points[index][3] = angle
-                        index += 1
-                order = not(order)
 
-        print(f'\n*************** Path generated for {self.shape} region ************\n')
+    def add_z_points(self, points_xyr, first_index = 0):
+        """Helper function that converts a list of X, Y, rotation points into a full point cloud by sweeping Z at every point.
+
+        The mapper moves in +Z direction at the first point, in -Z direction at the second point, and so on.
+
+        Args:
+            points_xyr (numpy array): points in path order, with 3 columns for X, Y and rotation
+            first_index (int, optional): index of ``points_xyr[0]`` in the whole path, which sets the direction of the first sweep. Defaults to 0.
+
+        Returns:
+            numpy array: point cloud with 4 columns for X, Y, Z and rotation
+        """
+        pos_z = self.z_positions()
+        num_z = len(pos_z)
+        num_points_xyr = len(points_xyr)
+
+        # one row of Z positions per XYR point, reversed for every other point
+        grid_z = np.tile(pos_z, (num_points_xyr, 1))
+        first_reversed = 1 - first_index % 2
+        grid_z[first_reversed::2] = grid_z[first_reversed::2, ::-1]
+
+        points = np.empty([num_points_xyr * num_z, 4])
+        points[:, 0] = np.repeat(points_xyr[:, 0], num_z)
+        points[:, 1] = np.repeat(points_xyr[:, 1], num_z)
+        points[:, 2] = grid_z.ravel()
+        points[:, 3] = np.repeat(points_xyr[:, 2], num_z)
+        return points
 
 
     def generate_custom(self): 
@@ -281,54 +377,26 @@ class Points_Generator(Mapper):
         The code prints 'Path generated according to custom XYR path' after execution.
 
         """
-        with open(self.custom_path_filename, 'r') as input:
-            csv_reader = csv.reader(input)
-            next(csv_reader)
+        self.load_custom()
+        self.points = self.add_z_points(self.points_xyr)
 
-            points_xyr = np.array([])
+        print('\n*************** Path generated according to custom XYR path ************\n')
 
-            # read the csv and dump position vlaues in points_xyr
-            for row in csv_reader:
-                x, y, r = [float(i) for i in row]
-                points_xyr = np.append(points_xyr, [x, y, r])
-            points_xyr = np.reshape(points_xyr, (-1, 3))
-            num_points_xyr = len(points_xyr)
+        
 
-        # Constants for order
-        order_inc = True
-        order_dec = False
 
-        # possible positions in z direction (going into magnet)
-        num_z = int(self.z_range/self.z_spacing) + 1
-        num_z_half = int(self.z_range/self.z_spacing/2) + 1
-        pos_z = np.arange(- self.z_spacing * (num_z_half - 1), self.z_spacing * (num_z_half + 1), self.z_spacing)
-
-        # z direction and angular points
-        self.points = np.zeros([num_points_xyr * num_z, 4])
-        index = 0
-        order = order_inc
-        for i in range(num_points_xyr):
-            # go forward in z direction
-            if order == order_inc:
-                for j in range(0, num_z, 1):
-                    self.points[index][0] = points_xyr[i][0]
-                    self.points[index][1] = points_xyr[i][1]
-                    self.points[index][2] = pos_z[j]
-                    self.points[index][3] = points_xyr[i][2]
-                    index += 1
-            # reverse in z direction
-            if order == order_dec:
-                for j in range(num_z-1, -1, -1):
-                    self.points[index][0] = points_xyr[i][0]
-                    self.points[index][1] = points_xyr[i][1]
-                    self.points[index][2] = pos_z[j]
-                    self.points[index][3] = points_xyr[i][2]
-                    index += 1
-            order = not(order)
+    def load_custom(self):
+        """Reads the custom XYR path file given in ``self.custom_path_filename``.
 
-        print('\n*************** Path generated according to custom XYR path ************\n')
+        **Modifies** ``self.points_xyr`` and ``self.num_points_xyr``.
+        """
+        with open(self.custom_path_filename, 'r') as input:
+            csv_reader = csv.reader(input)
+            next(csv_reader)
 
-        
+            # read the csv and dump position vlaues in points_xyr
+            self.points_xyr = np.array([[float(i) for i in row] for row in csv_reader]).reshape(-1, 3)
+        self.num_points_xyr = len(self.points_xyr)
 
 
     def generate_edges(self): 
@@ -342,7 +410,18 @@ class Points_Generator(Mapper):
         * Recall they change in the order of Z --> Y --> X --> rotation.
         * The implementation may need to be updated if a different order is adopted in the future.
 
+        Only the points of the first angle (and the first point of the next angle) are used. If ``run()`` streamed the path to file 
+        instead of building ``self.points``, these points are generated again with ``head_points()``.
+
         """
+        if self.num_points_xyr is None:
+            # nothing generated yet
+            if self.shape == 'custom':
+                self.load_custom()
+            else:
+                self.generate_plane()
+        num_points = self.num_points_xyr * len(self.z_positions())
+
         if self.shape == "cylinder":
             # generate the points for edges
             self.points_edges = np.zeros([int(self.num_cols * 4), 4])
@@ -353,29 +432,34 @@ class Points_Generator(Mapper):
             
         elif self.shape == 'custom':
             # For custom path, path may be different for different angles, so run through all angles
-            self.points_edges = np.zeros([len(self.points) , 4])
+            self.points_edges = np.zeros([num_points , 4])
             self.num_angles = 1
 
+        if self.points is None:
+            points = self.head_points(int(num_points / self.num_angles) + 1)
+        else:
+            points = self.points
+
         if self.shape == 'custom':
             # start path generation
             j = 0  # index number of edges array  
 
             # 2D edges path at minimum z position (out of magnet)
-            for i in range(int(len(self.points) / self.num_angles)):
-                if (i==0) or (self.points[i][0] != self.points[i-1][0]):
-                    self.points_edges[j][0] = self.points[i][0]
-                    self.points_edges[j][1] = self.points[i][1]
+            for i in range(int(num_points / self.num_angles)):
+                if (i==0) or (points[i][0] != points[i-1][0]):
+                    self.points_edges[j][0] = points[i][0]
+                    self.points_edges[j][1] = points[i][1]
                     self.points_edges[j][2] = -self.z_range/2
-                    self.points_edges[j][3] = self.points[i][3]
+                    self.points_edges[j][3] = points[i][3]
                     j += 1
 
             # 2D edges path at minimum z position (out of magnet)
-            for i in range(int(len(self.points) / self.num_angles)-1, 0, -1):
-                if (i==len(self.points)-1) or (self.points[i][0] != self.points[i+1][0]):
-                    self.points_edges[j][0] = self.points[i][0]
-                    self.points_edges[j][1] = self.points[i][1]
+            for i in range(int(num_points / self.num_angles)-1, 0, -1):
+                if (i==num_points-1) or (points[i][0] != points[i+1][0]):
+                    self.points_edges[j][0] = points[i][0]
+                    self.points_edges[j][1] = points[i][1]
                     self.points_edges[j][2] = self.z_range/2
-                    self.points_edges[j][3] = self.points[i][3]
+                    self.points_edges[j][3] = points[i][3]
                     j += 1
 
         else:
@@ -384,47 +468,47 @@ class Points_Generator(Mapper):
             k = 0  # helps change order of path      
 
             # 2D edges path at minimum z position (out of magnet)
-            for i in range(int(len(self.points) / self.num_angles)):
-                if (i==0) or (self.points[i][0] != self.points[i-1][0]) or (i==len(self.points)-1) or (self.points[i][0] != self.points[i+1][0]):
+            for i in range(int(num_points / self.num_angles)):
+                if (i==0) or (points[i][0] != points[i-1][0]) or (i==num_points-1) or (points[i][0] != points[i+1][0]):
                     if (k%4 == 0) or (k%4 == 3):
-                        self.points_edges[j][0] = self.points[i][0]
-                        self.points_edges[j][1] = self.points[i][1]
+                        self.points_edges[j][0] = points[i][0]
+                        self.points_edges[j][1] = points[i][1]
                         self.points_edges[j][2] = -self.z_range/2
-                        self.points_edges[j][3] = self.points[i][3]
+                        self.points_edges[j][3] = points[i][3]
                         j += 1
                     k += 1
 
             k = 0  # helps change order of path
-            for i in range(int(len(self.points) / self.num_angles)-1, 0, -1):
-                if (i==0) or (self.points[i][0] != self.points[i-1][0]) or (i==len(self.points)-1) or (self.points[i][0] != self.points[i+1][0]):
+            for i in range(int(num_points / self.num_angles)-1, 0, -1):
+                if (i==0) or (points[i][0] != points[i-1][0]) or (i==num_points-1) or (points[i][0] != points[i+1][0]):
                     if (k%4 == 0) or (k%4 == 3):
-                        self.points_edges[j][0] = self.points[i][0]
-                        self.points_edges[j][1] = self.points[i][1]
+                        self.points_edges[j][0] = points[i][0]
+                        self.points_edges[j][1] = points[i][1]
                         self.points_edges[j][2] = -self.z_range/2
-                        self.points_edges[j][3] = self.points[i][3]
+                        self.points_edges[j][3] = points[i][3]
                         j += 1
                     k += 1
 
             k = 0  # helps change order of path
             # 2D edges path at minimum z position (out of magnet)
-            for i in range(int(len(self.points) / self.num_angles)):
-                if (i==0) or (self.points[i][0] != self.points[i-1][0]) or (i==len(self.points)-1) or (self.points[i][0] != self.points[i+1][0]):
+            for i in range(int(num_points / self.num_angles)):
+                if (i==0) or (points[i][0] != points[i-1][0]) or (i==num_points-1) or (points[i][0] != points[i+1][0]):
                     if (k%4 == 0) or (k%4 == 3):
-                        self.points_edges[j][0] = self.points[i][0]
-                        self.points_edges[j][1] = self.points[i][1]
+                        self.points_edges[j][0] = points[i][0]
+                        self.points_edges[j][1] = points[i][1]
                         self.points_edges[j][2] = self.z_range/2
-                        self.points_edges[j][3] = self.points[i][3]
+                        self.points_edges[j][3] = points[i][3]
                         j += 1
                     k += 1
 
             k = 0  # helps change order of path
-            for i in range(int(len(self.points) / self.num_angles)-1, 0, -1):
-                if (i==0) or (self.points[i][0] != self.points[i-1][0]) or (i==len(self.points)-1) or (self.points[i][0] != self.points[i+1][0]):
+            for i in range(int(num_points / self.num_angles)-1, 0, -1):
+                if (i==0) or (points[i][0] != points[i-1][0]) or (i==num_points-1) or (points[i][0] != points[i+1][0]):
                     if (k%4 == 0) or (k%4 == 3):
-                        self.points_edges[j][0] = self.points[i][0]
-                        self.points_edges[j][1] = self.points[i][1]
+                        self.points_edges[j][0] = points[i][0]
+                        self.points_edges[j][1] = points[i][1]
                         self.points_edges[j][2] = self.z_range/2
-                        self.points_edges[j][3] = self.points[i][3]
+                        self.points_edges[j][3] = points[i][3]
                         j += 1
                     k += 1
 
@@ -432,9 +516,13 @@ class Points_Generator(Mapper):
 
 
     def estimate_time(self, path_filename, wait_time):
-        """This function estimates the amount of time until motion completion. 
-        It does not account for time for linear stages to travel. This is because typically we stop for 5 seconds at each point for probe and oscillations
-        to settle, which is much longer than the time of travelling between points.
+        """This function estimates the amount of time until motion completion, walking the path once, one chunk at a time.
+
+        The travel time of every move is computed by ``Motion_Model`` from the acceleration configurations ('x_accel', 'y_accel', 'z_accel') 
+        and the stage maximum speeds, assuming trapezoidal velocity profiles. As in ``Controller.moveXYZR``, the Z move only starts 
+        once the X, Y and rotation moves have finished, unless 'motion_mode' is 'concurrent' and the move stays inside the 'safe_envelope': 
+        all axes then move together, and the move is counted with the X/Y/rotation moves. A fixed overhead per move accounts for the 
+        commands on the serial chain.
 
         The function takes in the time to stop at each point.
 
@@ -442,26 +530,63 @@ class Points_Generator(Mapper):
         * For edges path, ``wait_time = 1`` to get a fast verification
 
         The unit for time estimate will auto adjust to the largest unit, rounded to 1 decimal place. (e.g. 1.2 hours instead of 72 minutes).
+        The time spent in each phase (X/Y/rotation moves, Z moves, move overhead, waiting at each point) is printed as well.
 
         Args:
-            path_filename (string): path to file that contains the mapping path/point cloud
+            path_filename (string): path to file that contains the mapping path/point cloud, CSV or binary '.npy'
             wait_time (int/float): time to stop at each point in seconds
+
+        Returns:
+            dict: time in seconds of each phase ('xyr_move', 'z_move', 'overhead', 'wait') and in total ('total'), and the number of points ('points')
+        """
+        motion_model = Motion_Model()
+        phases = {'xyr_move' : 0.0, 'z_move' : 0.0, 'overhead' : 0.0, 'wait' : 0.0}
+        num_points = 0
+        previous = None
+
+        for chunk in iter_path_chunks(path_filename, self.path_chunk_size):
+            # moves between points of this chunk, and from the last point of the previous chunk
+            if previous is not None:
+                chunk_with_previous = np.vstack((previous, chunk))
+            else:
+                chunk_with_previous = chunk
+            xyr_time, z_time = motion_model.phase_times(chunk_with_previous[:-1], chunk_with_previous[1:])
+            phases['xyr_move'] += float(np.sum(xyr_time))
+            phases['z_move'] += float(np.sum(z_time))
+            phases['overhead'] += motion_model.move_overhead * len(xyr_time)
+            num_points += len(chunk)
+            previous = chunk[-1]
+
+        phases['wait'] = num_points * wait_time
+        phases['total'] = sum(phases.values())
+        phases['points'] = num_points
+
+        print('The current mapping sequence will take approximately %s. \n' % self.format_duration(phases['total']))
+        print('    X/Y/rotation moves: %s, Z moves: %s, move overhead: %s, waiting at %d points: %s \n'
+              % (self.format_duration(phases['xyr_move']), self.format_duration(phases['z_move']),
+                 self.format_duration(phases['overhead']), num_points, self.format_duration(phases['wait'])))
+        return phases
+
+
+    def format_duration(self, total_time):
+        """Helper function that formats a time in the largest unit, rounded to 1 decimal place (e.g. '1.2 hours' instead of '72.0 minutes').
+
+        Args:
+            total_time (float): time in seconds
+
+        Returns:
+            string: formatted time with its unit
         """
-        # Prints the estimated time 
-        with open(path_filename, 'r', encoding='UTF8', newline='') as f:
-            reader = csv.reader(f)
-            unit = 'seconds'
-            total_time = len(list(reader)) * (wait_time + 1)
+        unit = 'seconds'
+        if total_time >= 60:
+            total_time = total_time/60
+            unit = 'minutes'
+
             if total_time >= 60:
                 total_time = total_time/60
-                unit = 'minutes'
+                unit = 'hours'
 
-                if total_time >= 60:
-                    total_time = total_time/60
-                    unit = 'hours'
-
-            total_time = "{:.1f}".format(total_time)
-            print('The current mapping sequence will take approximately %s %s. \n' % (total_time, unit))
+        return "{:.1f} {}".format(total_time, unit)
 
 
     # store them into a CSV file
@@ -473,15 +598,60 @@ class Points_Generator(Mapper):
         Args:
             filename (string): CSV file to save the points to, e.g. 'path/path.csv'
             points (list): A list with 4 columns, each containing x, y, z, rotation data. This list is typically either `self.points` or `self.points_edges`.
+                           A generator of such lists, e.g. ``self.iter_points()``, is also accepted and written one chunk at a time.
         """
-        header = ['X', 'Y', 'Z', 'Rotation']
-        with open(filename, 'w', encoding='UTF8', newline='') as f:
-            f.truncate()
-            writer = csv.writer(f)
-            writer.writerow(header)
-            writer.writerows(points)
+        if isinstance(points, (np.ndarray, list)):
+            points = [points]
+        write_csv_chunks(filename, points)
+
 
 
+    def path_header(self):
+        """Describes the current path for the JSON header of the binary path file: profile, shape, spacing and ordering.
+
+        Returns:
+            dict: information about the path
+        """
+        header = {'profile' : Mapper.profile, 'shape' : self.shape, 'z_range' : self.z_range, 'z_spacing' : self.z_spacing,
+                  'num_z' : len(self.z_positions())}
+        if self.shape == 'cylinder':
+            header.update({'radius' : self.radius, 'xy_spacing' : self.xy_spacing, 'rotation_points' : self.rotation_angles})
+        elif self.shape == 'rectangular':
+            header.update({'x_range' : self.x_range, 'x_spacing' : self.x_spacing, 'y_range' : self.y_range, 'y_spacing' : self.y_spacing,
+                           'rotation_points' : self.rotation_angles})
+        elif self.shape == 'custom':
+            header.update({'custom_xyr_path_filename' : self.custom_path_filename})
+
+        if self.shape == 'custom':
+            header['ordering'] = 'Z serpentine at every X, Y, rotation point, in custom file order'
+        else:
+            header['ordering'] = 'Z --> Y --> X --> rotation, serpentine in Z and Y'
+        return header
+
+
+    def path_files(self):
+        """Lists the files written by ``run()``: the path CSV, the edges CSV, and the binary copy of the path and its header if
+        ``self.path_format`` is 'npy'.
+
+        Returns:
+            list: file names
+        """
+        filenames = [self.path_filename, self.path_edges_filename]
+        if self.path_format == 'npy':
+            filenames += [npy_filename(self.path_filename), header_filename(npy_filename(self.path_filename))]
+        return filenames
+
+
+    def path_is_current(self):
+        """Checks whether the path files in place were written by ``run()`` from the current configurations, see ``Path_Cache``.
+
+        Returns:
+            bool: True if they are current, always False if the cache is disabled
+        """
+        if self.path_cache is None or self.shape not in ('cylinder', 'rectangular', 'custom'):
+            return False
+        return self.path_cache.is_current(path_key(self.config_dict), self.path_files())
+
 
     def run(self):
         """This is the main function accessed from the outside.
@@ -489,23 +659,64 @@ class Points_Generator(Mapper):
         This function checks the shape from configurations and generates the associated path and edges path. 
         It also writes the CSV files as specified by ``self.path_filename`` and ``self.path_edges_filename``.
         At the end of execution, it provides the estimated time for both the full path and the edges path.
+
+        The full path is not held in memory: it is generated by ``iter_points()`` in chunks of ``self.path_chunk_size`` points, 
+        and each chunk is written to the CSV file before the next one is generated.
+
+        If ``self.path_format`` is 'npy', the path is also written to a binary '.npy' file with the same name as the CSV 
+        (e.g. 'path/path.npy'), with a JSON header from ``path_header()`` (e.g. 'path/path.json'). The CSV is kept for humans.
+
+        If ``self.optimize_path`` is True, the written path is then reordered by ``Path_Optimizer``, which prints the estimated 
+        motion time before and after. The edges path is always generated from the original order.
+
+        Unless ``self.path_cache_size`` is 0, the path is looked up in ``self.path_cache`` first, by the hash of the configurations 
+        that change it (see ``path_key()``). If the files in place already hold it, nothing is written, and if it is cached, the 
+        files are copied from the cache: in both cases the path is not generated again, and only the time estimates are printed. 
+        A newly generated path is added to the cache.
         """
+        if self.shape not in ('cylinder', 'rectangular', 'custom'):
+            print('\nShape not recognized. Please change your configurations and try again.\n')
+            return
+
+        key = None
+        if self.path_cache is not None:
+            key = path_key(self.config_dict)
+            status = self.path_cache.restore(key, self.path_files())
+            if status is not None:
+                if status == 'current':
+                    print('\n*************** Path unchanged, files are up to date ************\n')
+                else:
+                    print('\n*************** Path restored from cache ************\n')
+                self.estimate_time(npy_filename(self.path_filename) if self.path_format == 'npy' else self.path_filename, self.probe_stop_time_sec)
+                self.estimate_time(self.path_edges_filename, 1)
+                return
+
         if self.shape == 'custom':
-            self.generate_custom()
-        elif self.shape == 'rectangular' or self.shape == 'cylinder':
-            self.generate()
+            self.load_custom()
         else:
-            print('\nShape not recognized. Please change your configurations and try again.\n')
+            self.generate_plane()
         
         # Generate full path
-        self.write_CSV(self.path_filename, self.points)
-        self.estimate_time(self.path_filename,self.probe_stop_time_sec)
+        self.points = None
+        self.write_CSV(self.path_filename, self.iter_points(self.path_chunk_size))
+        if self.path_format == 'npy':
+            num_points = self.num_points_xyr * len(self.z_positions())
+            write_npy_chunks(npy_filename(self.path_filename), self.iter_points(self.path_chunk_size), num_points, self.path_header())
+        if self.optimize_path:
+            Path_Optimizer().run()
+        if self.shape == 'custom':
+            print('\n*************** Path generated according to custom XYR path ************\n')
+        else:
+            print(f'\n*************** Path generated for {self.shape} region ************\n')
+        if self.path_format == 'npy':
+            # no parsing needed to walk the binary copy
+            self.estimate_time(npy_filename(self.path_filename), self.probe_stop_time_sec)
+        else:
+            self.estimate_time(self.path_filename,self.probe_stop_time_sec)
 
         # Generate edges path
         self.generate_edges()
         self.write_CSV(self.path_edges_filename, self.points_edges)
         self.estimate_time(self.path_edges_filename, 1)
-            
-
-
-
+        if key is not None:
+            self.path_cache.store(key, self.path_files())
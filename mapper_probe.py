@@ -0,0 +1,424 @@
+import serial
+import threading
+from time import monotonic
+import numpy as np
+from mapper_frame_parser import Frame_Parser
+
+
+class Frame_Buffer():
+    """The ``Frame_Buffer`` class is a bounded ring buffer of timestamped probe readings. The arrays are allocated once, 
+    when the buffer is created, and the oldest readings are overwritten once the buffer is full.
+
+    It is filled by the background reader of ``Probe_Session`` and read by the main thread, so every access holds ``self.condition``.
+    """
+    def __init__(self, capacity = 4096):
+        """Allocates the buffer.
+
+        Args:
+            capacity (int, optional): maximum number of readings kept. Defaults to 4096.
+        """
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.units = np.empty(capacity, dtype='<U4')
+
+        # number of readings ever appended, the next reading goes to index total % capacity
+        self.total = 0
+        self.condition = threading.Condition()
+
+
+    def append(self, timestamp, value, unit):
+        """Adds one reading, overwriting the oldest one if the buffer is full, and wakes up any thread waiting for readings.
+
+        Args:
+            timestamp (float): ``time.monotonic()`` time at which the probe started sending the frame
+            value (float): field value
+            unit (string): field unit, e.g. 'G'
+        """
+        with self.condition:
+            index = self.total % self.capacity
+            self.timestamps[index] = timestamp
+            self.values[index] = value
+            self.units[index] = unit
+            self.total += 1
+            self.condition.notify_all()
+
+
+    def ordered_indices(self):
+        """Returns the indices of the stored readings from oldest to newest. Must be called while holding ``self.condition``.
+
+        Returns:
+            numpy array: indices into ``self.timestamps``, ``self.values`` and ``self.units``
+        """
+        if self.total <= self.capacity:
+            return np.arange(self.total)
+        start = self.total % self.capacity
+        return np.concatenate((np.arange(start, self.capacity), np.arange(start)))
+
+
+    def since(self, not_before):
+        """Returns a copy of all stored readings with a timestamp at or after ``not_before``, from oldest to newest.
+
+        Args:
+            not_before (float): ``time.monotonic()`` timestamp
+
+        Returns:
+            (numpy array, numpy array, numpy array): timestamps, values and units of the readings
+        """
+        with self.condition:
+            indices = self.ordered_indices()
+            first = np.searchsorted(self.timestamps[indices], not_before)
+            indices = indices[first:]
+            return self.timestamps[indices], self.values[indices], self.units[indices]
+
+
+    def wait_for_reading(self, not_before, timeout = None):
+        """Blocks until a reading with a timestamp at or after ``not_before`` is available and returns the first such reading.
+
+        Args:
+            not_before (float): ``time.monotonic()`` timestamp
+            timeout (float, optional): maximum time to wait in seconds. Defaults to None, i.e. wait forever.
+
+        Returns:
+            (float, float, string): timestamp, value and unit of the reading, or None if the timeout expired
+        """
+        with self.condition:
+            ready = self.condition.wait_for(lambda: self.total > 0 and self.timestamps[(self.total - 1) % self.capacity] >= not_before, timeout)
+            if not ready:
+                return None
+            indices = self.ordered_indices()
+            index = indices[np.searchsorted(self.timestamps[indices], not_before)]
+            return float(self.timestamps[index]), float(self.values[index]), str(self.units[index])
+
+
+    def wait_for_readings(self, not_before, count, timeout = None):
+        """Blocks until ``count`` readings with a timestamp at or after ``not_before`` are available and returns the first ``count``
+        such readings.
+
+        Args:
+            not_before (float): ``time.monotonic()`` timestamp
+            count (int): number of readings, at most ``self.capacity``
+            timeout (float, optional): maximum time to wait in seconds. Defaults to None, i.e. wait forever.
+
+        Returns:
+            (numpy array, numpy array, numpy array): timestamps, values and units of the readings, or None if the timeout expired
+        """
+        def first_indices():
+            indices = self.ordered_indices()
+            return indices[np.searchsorted(self.timestamps[indices], not_before):][:count]
+
+        with self.condition:
+            ready = self.condition.wait_for(lambda: len(first_indices()) >= count, timeout)
+            if not ready:
+                return None
+            indices = first_indices()
+            return self.timestamps[indices], self.values[indices], self.units[indices]
+
+
+class Probe_Session():
+    """The ``Probe_Session`` class owns a long-lived serial connection to the Arduino that forwards the Teslameter readings
+    (see ``arduino_probe/arduino_probe.ino``). It is opened once per mapping run by ``mapper_controller.Controller`` instead
+    of opening the COMM port again for every point.
+
+    Stale frames (frames that were sent by the probe while the stages were still moving) are dropped based on when they arrived
+    rather than by discarding a fixed number of readings. The time taken by each read is recorded so the latency can be reported
+    at the end of a run.
+
+    Readings can either be read on demand with ``read_frame()``, or continuously by a background thread started with ``start_reader()``, 
+    in which case every valid reading is stored in a ``Frame_Buffer``. ``get_reading()`` works in both cases.
+
+    Frames are converted by a ``Frame_Parser``, which counts the rejected frames. If ``max_consecutive_failures`` frames in a row are
+    rejected, e.g. because the baud rate or the unit is wrong, ``get_reading()`` raises an error instead of waiting forever. Likewise,
+    if no frame at all is received for ``max_silent_timeouts`` times ``timeout`` seconds, e.g. because the probe is unplugged,
+    ``get_reading()`` and ``get_readings()`` raise an error instead of leaving the stages parked.
+    """
+    def __init__(self, comm_port, baudrate = 9600, timeout = 2.0, parser = None, max_consecutive_failures = 100, max_silent_timeouts = 5):
+        """Initializes the ``Probe_Session`` class. The port is not opened until ``open()`` is called or the session is used in a ``with`` block.
+
+        Args:
+            comm_port (string): name of COMM port that the Arduino is connected to, e.g. 'COM4'. A pty such as '/dev/pts/3' also works.
+            baudrate (int, optional): baud rate of the Arduino serial port. Defaults to 9600, as set in ``arduino_probe.ino``.
+            timeout (float, optional): time in seconds to wait for a line before checking again. Defaults to 2.0.
+            parser (Frame_Parser, optional): converts the frames into readings. Defaults to None, i.e. a ``Frame_Parser`` keeping the unit sent.
+            max_consecutive_failures (int, optional): number of rejected frames in a row after which ``get_reading()`` gives up. Defaults to 100.
+            max_silent_timeouts (int, optional): number of ``timeout`` periods without any frame after which reads give up. Defaults to 5.
+        """
+        self.comm_port = comm_port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.ser = None
+        self.parser = parser if parser is not None else Frame_Parser()
+        self.max_consecutive_failures = max_consecutive_failures
+        self.max_silent_timeouts = max_silent_timeouts
+
+        # time at which the last end of line was received, None if we may be in the middle of a frame
+        self.last_eol_time = None
+
+        # time at which the last frame, valid or not, was received, to tell a silent probe from a slow one
+        self.last_frame_time = None
+
+        # time in seconds taken by every call to read_frame() or get_reading()
+        self.latencies = []
+
+        # background reader, see start_reader()
+        self.buffer = None
+        self.reader_thread = None
+        self.stop_event = threading.Event()
+
+
+    def open(self):
+        """Opens the COMM port. Any partial frame received right after opening the port is dropped by ``read_frame()``.
+        """
+        self.ser = serial.Serial(self.comm_port, self.baudrate, timeout=self.timeout)
+        self.last_eol_time = None
+        self.last_frame_time = monotonic()
+
+
+    def close(self):
+        """Stops the background reader if it is running and closes the COMM port if it is open.
+        """
+        self.stop_reader()
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def drain(self):
+        """Drops every byte that is already waiting in the input buffer, since these bytes were received before the request.
+
+        If the dropped bytes end with an end of line, the next frame has not started yet and will be fresh. Otherwise
+        the next line is the rest of a stale frame, which ``read_frame()`` will drop.
+        """
+        waiting = self.ser.in_waiting
+        if waiting > 0:
+            data = self.ser.read(waiting)
+            if data.endswith(b'\n'):
+                self.last_eol_time = monotonic()
+            else:
+                self.last_eol_time = None
+        elif self.last_eol_time is not None:
+            # nothing waiting and the last line we read was complete, so we are between frames
+            self.last_eol_time = monotonic()
+
+
+    def read_frame(self, not_before = None):
+        """Returns the first complete frame that the probe started sending after ``not_before``.
+
+        A frame is considered to start when the end of line of the previous frame is received. Frames that started earlier
+        are dropped, which avoids recording a reading taken while the probe was still moving.
+
+        Args:
+            not_before (float, optional): ``time.monotonic()`` timestamp, frames started before this are dropped. Defaults to the time of the call.
+
+        Returns:
+            (float, string): ``time.monotonic()`` timestamp at which the frame was received, and the frame without its end of line characters
+        """
+        start_time = monotonic()
+        if not_before is None:
+            not_before = start_time
+
+        self.drain()
+        while True:
+            line = self.ser.readline()
+            now = monotonic()
+            if not line.endswith(b'\n'):
+                # timed out in the middle of a frame, whatever comes next cannot be trusted
+                self.last_eol_time = None
+                self.check_silence()
+                continue
+
+            frame_start = self.last_eol_time
+            self.last_eol_time = now
+            self.last_frame_time = now
+            if frame_start is not None and frame_start >= not_before:
+                self.latencies.append(now - start_time)
+                return now, line.decode('ascii', errors='replace').strip()
+
+
+    def start_reader(self, capacity = 4096):
+        """Starts a background thread that reads every frame sent by the probe into ``self.buffer``, including the frames sent 
+        while the stages are moving. Each reading is timestamped with the time at which the probe started sending it.
+
+        Args:
+            capacity (int, optional): number of readings kept in the ring buffer. Defaults to 4096.
+        """
+        self.buffer = Frame_Buffer(capacity)
+        self.stop_event.clear()
+        self.reader_thread = threading.Thread(target=self.reader_loop, name='probe-reader', daemon=True)
+        self.reader_thread.start()
+
+
+    def stop_reader(self):
+        """Stops the background reader, if it is running, and waits for it to exit. The buffer is kept so it can still be read.
+        """
+        if self.reader_thread is not None:
+            self.stop_event.set()
+            self.reader_thread.join()
+            self.reader_thread = None
+
+
+    def reader_loop(self):
+        """Body of the background reader thread. Reads lines until ``self.stop_event`` is set; the serial timeout makes sure 
+        the stop event is checked at least every ``self.timeout`` seconds.
+        """
+        while not self.stop_event.is_set():
+            line = self.ser.readline()
+            now = monotonic()
+            if not line.endswith(b'\n'):
+                self.last_eol_time = None
+                continue
+
+            frame_start = self.last_eol_time
+            self.last_eol_time = now
+            self.last_frame_time = now
+            if frame_start is None:
+                # first frame after opening the port or after a timeout may be partial
+                continue
+
+            reading = self.parser.parse(line.decode('ascii', errors='replace'))
+            if reading is not None:
+                self.buffer.append(frame_start, reading[0], reading[1])
+
+
+    def get_reading(self, not_before = None):
+        """Returns the first valid reading that the probe started sending at or after ``not_before``.
+
+        If the background reader is running, the reading is taken from ``self.buffer`` and returned as soon as it is available, 
+        without touching the COMM port. Otherwise frames are read with ``read_frame()`` until one can be parsed.
+
+        Args:
+            not_before (float, optional): ``time.monotonic()`` timestamp, may be in the future. Defaults to the time of the call.
+
+        Returns:
+            (float, float, string): timestamp, value and unit of the reading
+
+        Raises:
+            RuntimeError: if too many frames in a row are rejected, see ``check_failures()``, or if the probe stops sending, 
+                          see ``check_silence()``
+        """
+        start_time = monotonic()
+        if not_before is None:
+            not_before = start_time
+
+        if self.reader_thread is not None:
+            while True:
+                reading = self.buffer.wait_for_reading(not_before, self.timeout)
+                if reading is not None:
+                    self.latencies.append(max(monotonic() - max(start_time, not_before), 0.0))
+                    return reading
+                if not self.reader_thread.is_alive():
+                    raise RuntimeError('Probe reader thread stopped unexpectedly.')
+                self.check_failures()
+                self.check_silence()
+
+        while True:
+            timestamp, frame = self.read_frame(not_before)
+            reading = self.parser.parse(frame)
+            if reading is not None:
+                return timestamp, reading[0], reading[1]
+            self.check_failures()
+            not_before = timestamp
+
+
+    def check_failures(self):
+        """Gives up if too many frames in a row could not be parsed.
+
+        Raises:
+            RuntimeError: if the last ``self.max_consecutive_failures`` frames were all rejected
+        """
+        if self.parser.consecutive_failures >= self.max_consecutive_failures:
+            raise RuntimeError('The last {} probe frames could not be parsed ({}), check the probe connection and settings.'
+                               .format(self.parser.consecutive_failures, dict(self.parser.failures)))
+
+
+    def check_silence(self):
+        """Gives up if the probe has not sent anything for too long, e.g. because it is unplugged or switched off.
+
+        Raises:
+            RuntimeError: if no frame was received for ``self.max_silent_timeouts`` times ``self.timeout`` seconds
+        """
+        silence = monotonic() - self.last_frame_time
+        if silence >= self.timeout * self.max_silent_timeouts:
+            raise RuntimeError('No frame received from the probe on {} for {:.1f} s, check that the probe is connected and switched on.'
+                               .format(self.comm_port, silence))
+
+
+    def get_readings(self, count, not_before = None):
+        """Returns the first ``count`` valid readings that the probe started sending at or after ``not_before``, e.g. to average 
+        several readings at one point.
+
+        As with ``get_reading()``, the readings are taken from ``self.buffer`` if the background reader is running, otherwise they
+        are read one after the other from the COMM port.
+
+        Args:
+            count (int): number of readings
+            not_before (float, optional): ``time.monotonic()`` timestamp, may be in the future. Defaults to the time of the call.
+
+        Returns:
+            (numpy array, numpy array, numpy array): timestamps, values and units of the readings
+
+        Raises:
+            RuntimeError: as ``get_reading()``
+        """
+        start_time = monotonic()
+        if not_before is None:
+            not_before = start_time
+
+        if self.reader_thread is not None:
+            while True:
+                readings = self.buffer.wait_for_readings(not_before, count, self.timeout * count)
+                if readings is not None:
+                    self.latencies.append(max(monotonic() - max(start_time, not_before), 0.0))
+                    return readings
+                if not self.reader_thread.is_alive():
+                    raise RuntimeError('Probe reader thread stopped unexpectedly.')
+                self.check_failures()
+                self.check_silence()
+
+        readings = []
+        for i in range(count):
+            reading = self.get_reading(not_before)
+            readings.append(reading)
+            # the next frame starts when this one is received
+            not_before = reading[0]
+        timestamps, values, units = zip(*readings)
+        return np.array(timestamps), np.array(values), np.array(units)
+
+
+    def latency_stats(self):
+        """Summarizes the time taken by ``read_frame()`` over the session.
+
+        Returns:
+            dict: number of reads, and the mean, median, 95th percentile and maximum latency in seconds. Empty if no reads were made.
+        """
+        if len(self.latencies) == 0:
+            return {}
+        latencies = np.array(self.latencies)
+        return {'reads' : len(latencies),
+                'mean' : float(np.mean(latencies)),
+                'median' : float(np.median(latencies)),
+                'p95' : float(np.percentile(latencies, 95)),
+                'max' : float(np.max(latencies))}
+
+
+    def print_latency_stats(self, label = 'Probe'):
+        """Prints the output of ``latency_stats()`` to the console in milliseconds.
+
+        Args:
+            label (string, optional): name of the probe at the start of the line. Defaults to 'Probe'.
+        """
+        stats = self.latency_stats()
+        if len(stats) == 0:
+            print('No readings were taken from %s.' % label)
+            return
+        print('%s read latency over %d readings: mean %.1f ms, median %.1f ms, 95th percentile %.1f ms, max %.1f ms'
+              % (label, stats['reads'], stats['mean'] * 1000, stats['median'] * 1000, stats['p95'] * 1000, stats['max'] * 1000))
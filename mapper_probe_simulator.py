@@ -0,0 +1,229 @@
+import os
+import random
+import threading
+import tty
+from math import exp, sin, cos, radians, pi
+from time import monotonic
+
+
+def quadrupole_field(x, y, z, rot, gradient = 0.2, length = 300.0, fringe = 40.0):
+    """Field of an ideal quadrupole seen by a Hall probe, in G.
+
+    Inside the magnet the transverse field is ``(Bx, By) = gradient * (y, x)``. Along the beamline (Z) it falls off at both ends of the
+    magnet with an Enge-like profile ``1 / (1 + exp((|z| - length / 2) / fringe))``. The probe measures the component along the
+    direction given by the rotation stage, ``Bx * cos(rot) + By * sin(rot)``.
+
+    Args:
+        x (float): X position in magnet coordinates, in mm
+        y (float): Y position in magnet coordinates, in mm
+        z (float): Z position in magnet coordinates, in mm
+        rot (float): angle of the rotation stage in degrees
+        gradient (float, optional): field gradient in G/mm. Defaults to 0.2.
+        length (float, optional): effective length of the magnet in mm. Defaults to 300.0.
+        fringe (float, optional): length of the fringe field fall off in mm. Defaults to 40.0.
+
+    Returns:
+        float: field in G
+    """
+    profile = 1 / (1 + exp(min((abs(z) - length / 2) / fringe, 700)))
+    return gradient * profile * (y * cos(radians(rot)) + x * sin(radians(rot)))
+
+
+class Probe_Simulator():
+    """The ``Probe_Simulator`` class pretends to be the Teslameter and Arduino: it sends frames such as '-6.191G' on a pseudo terminal,
+    which ``Probe_Session`` opens like the real COMM port (``self.port``, e.g. '/dev/pts/3'). Pseudo terminals need Linux or macOS.
+
+    The field is computed by ``field`` at the position returned by ``position``, for example the position of the simulated stages.
+    When the position changes, the probe is assumed to swing: a damped oscillation of amplitude ``oscillation`` is added to the field,
+    and decays with a time constant of ``damping_time`` once the stages stop.
+
+    To test the parser and the recovery from bad frames, Gaussian noise can be added to every value, bytes can be dropped (including
+    end of lines, which merges two frames), and whole lines can be garbled. The number of frames sent, garbled lines and dropped
+    bytes are counted in ``self.frames_sent``, ``self.frames_garbled`` and ``self.bytes_dropped``.
+    """
+    def __init__(self, position = None, field = quadrupole_field, frame_rate = 10.0, noise = 0.0, drop_probability = 0.0,
+                 garble_probability = 0.0, oscillation = 0.0, damping_time = 0.5, oscillation_frequency = 2.0, unit = 'G', seed = None):
+        """Initializes the ``Probe_Simulator`` class. Frames are only sent once ``open()`` is called or the simulator is used in a ``with`` block.
+
+        Args:
+            position (function, optional): returns the probe position (X, Y, Z, rotation) in magnet coordinates. Defaults to None, i.e. always at the center.
+            field (function, optional): field in ``unit`` as a function of X, Y, Z and rotation. Defaults to ``quadrupole_field``.
+            frame_rate (float, optional): number of frames sent per second. Defaults to 10.0.
+            noise (float, optional): standard deviation of the noise added to every value, in ``unit``. Defaults to 0.0.
+            drop_probability (float, optional): probability that a byte is dropped. Defaults to 0.0.
+            garble_probability (float, optional): probability that a line is garbled. Defaults to 0.0.
+            oscillation (float, optional): amplitude of the field oscillation when the probe moves, in ``unit``. Defaults to 0.0.
+            damping_time (float, optional): time constant of the oscillation decay in seconds. Defaults to 0.5.
+            oscillation_frequency (float, optional): frequency of the oscillation in Hz. Defaults to 2.0.
+            unit (string, optional): unit sent after every value. Defaults to 'G'.
+            seed (int, optional): seed of the random generator, for repeatable runs. Defaults to None.
+        """
+        self.position = position
+        self.field = field
+        self.frame_rate = frame_rate
+        self.noise = noise
+        self.drop_probability = drop_probability
+        self.garble_probability = garble_probability
+        self.oscillation = oscillation
+        self.damping_time = damping_time
+        self.oscillation_frequency = oscillation_frequency
+        self.unit = unit
+        self.random = random.Random(seed)
+
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        self.last_position = None
+        self.last_motion_time = None
+        self.frames_sent = 0
+        self.frames_garbled = 0
+        self.bytes_dropped = 0
+
+
+    def open(self):
+        """Creates the pseudo terminal and starts sending frames.
+        """
+        self.master, self.slave = os.openpty()
+        # no echo and no end of line translation, like a real serial port
+        tty.setraw(self.slave)
+        # a real probe keeps sending whether or not anybody reads, so frames are lost rather than blocking when the buffer is full
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.writer_loop, name='probe-simulator', daemon=True)
+        self.thread.start()
+
+
+    def close(self):
+        """Stops sending frames and closes the pseudo terminal.
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = None
+            self.slave = None
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def true_value(self, now):
+        """Field the probe would measure without noise at time ``now``, including the oscillation after a move.
+
+        Args:
+            now (float): ``time.monotonic()`` time
+
+        Returns:
+            float: field in ``self.unit``
+        """
+        position = tuple(self.position()) if self.position is not None else (0.0, 0.0, 0.0, 0.0)
+        if position != self.last_position:
+            self.last_position = position
+            self.last_motion_time = now
+        value = self.field(*position)
+        if self.oscillation != 0 and self.last_motion_time is not None:
+            elapsed = now - self.last_motion_time
+            value += self.oscillation * exp(-elapsed / self.damping_time) * sin(2 * pi * self.oscillation_frequency * elapsed)
+        return value
+
+
+    def make_frame(self, now):
+        """Builds the next frame, with its noise and errors.
+
+        Args:
+            now (float): ``time.monotonic()`` time
+
+        Returns:
+            bytes: frame including its end of line characters
+        """
+        value = self.true_value(now)
+        if self.noise > 0:
+            value += self.random.gauss(0, self.noise)
+        line = '%.3f%s' % (value, self.unit)
+
+        if self.garble_probability > 0 and self.random.random() < self.garble_probability:
+            self.frames_garbled += 1
+            if self.random.random() < 0.5:
+                # line noise
+                line = ''.join(self.random.choice('#?*~.-0123456789GT') for i in range(len(line)))
+            else:
+                # a single character replaced
+                index = self.random.randrange(len(line))
+                line = line[:index] + self.random.choice('#?*~') + line[index + 1:]
+
+        frame = (line + '\r\n').encode('ascii')
+        if self.drop_probability > 0:
+            kept = bytes(byte for byte in frame if self.random.random() >= self.drop_probability)
+            self.bytes_dropped += len(frame) - len(kept)
+            frame = kept
+        return frame
+
+
+    def writer_loop(self):
+        """Body of the background thread. Frames are sent every ``1 / self.frame_rate`` seconds, without drifting.
+        """
+        period = 1 / self.frame_rate
+        next_time = monotonic()
+        while not self.stop_event.is_set():
+            try:
+                os.write(self.master, self.make_frame(monotonic()))
+                self.frames_sent += 1
+            except BlockingIOError:
+                pass
+            next_time += period
+            delay = next_time - monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            else:
+                # too slow to keep up, restart the schedule from now
+                next_time = monotonic()
+
+
+def create_probe_simulator(config_dict, position = None, angle_offset = 0.0):
+    """Creates a ``Probe_Simulator`` from the configuration.
+
+    ==============================    =============================================================
+    Setting in config.json            Description
+    ==============================    =============================================================
+    'sim_probe_rate_hz'               Frames per second (optional, defaults to 10)
+    'sim_probe_noise'                 Standard deviation of the noise in G (optional, defaults to 0.01)
+    'sim_probe_drop_probability'      Probability that a byte is dropped (optional, defaults to 0)
+    'sim_probe_garble_probability'    Probability that a line is garbled (optional, defaults to 0)
+    'sim_probe_oscillation'           Amplitude of the oscillation after a move in G (optional, defaults to 0.5)
+    'sim_probe_damping_sec'           Time constant of the oscillation decay in seconds (optional, defaults to 0.5)
+    'sim_field_gradient'              Gradient of the simulated quadrupole in G/mm (optional, defaults to 0.2)
+    'sim_magnet_length'               Effective length of the simulated quadrupole in mm (optional, defaults to 300)
+    'sim_magnet_fringe'               Length of the fringe field fall off in mm (optional, defaults to 40)
+    ==============================    =============================================================
+
+    Args:
+        config_dict (dict): configurations of the current profile
+        position (function, optional): returns the probe position (X, Y, Z, rotation) in magnet coordinates. Defaults to None.
+        angle_offset (float, optional): angle in degrees added to the rotation, e.g. 90 for the second axis of a multi-axis probe. Defaults to 0.0.
+
+    Returns:
+        Probe_Simulator: simulator, not opened yet
+    """
+    gradient = config_dict.get('sim_field_gradient', 0.2)
+    length = config_dict.get('sim_magnet_length', 300.0)
+    fringe = config_dict.get('sim_magnet_fringe', 40.0)
+    return Probe_Simulator(position, lambda x, y, z, rot: quadrupole_field(x, y, z, rot + angle_offset, gradient, length, fringe),
+                           frame_rate=config_dict.get('sim_probe_rate_hz', 10.0),
+                           noise=config_dict.get('sim_probe_noise', 0.01),
+                           drop_probability=config_dict.get('sim_probe_drop_probability', 0.0),
+                           garble_probability=config_dict.get('sim_probe_garble_probability', 0.0),
+                           oscillation=config_dict.get('sim_probe_oscillation', 0.5),
+                           damping_time=config_dict.get('sim_probe_damping_sec', 0.5))
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from time import monotonic
+
+
+def file_hash(filename, block_size = 1 << 20):
+    """Computes the SHA-256 hash of a file, reading it in blocks so that large path files are not loaded in memory.
+
+    Args:
+        filename (string): file to hash
+        block_size (int, optional): number of bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        string: hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def journal_filename(data_filename):
+    """Returns the name of the journal that goes with a data file, e.g. 'data/data.journal.json' for 'data/data.csv'.
+
+    Args:
+        data_filename (string): data CSV file name
+
+    Returns:
+        string: journal file name
+    """
+    return os.path.splitext(data_filename)[0] + '.journal.json'
+
+
+class Run_Journal():
+    """The ``Run_Journal`` class records how far a mapping run has gone, so that an interrupted run can be resumed instead of started over.
+
+    The journal is a small JSON file holding:
+
+    * 'path_filename' and 'path_hash': the path being run, and the SHA-256 hash of its content. A run is only resumed on the same path.
+    * 'data_filename': the data file being written.
+    * 'next_index': index in the path of the first point without a row in the data file. Every point of the path writes exactly
+      one row, so this is also the number of data rows.
+    * 'data_offset': size in bytes of the data file once these rows are written and synced to disk. Anything after this offset
+      (e.g. a row cut in half by a crash) is dropped on resume.
+    * 'completed': True once the whole path has been run.
+    * 'elapsed_sec': time spent on the run so far in seconds, added up over every session that resumed it, see ``elapsed()``.
+
+    The journal is saved at every checkpoint of the ``Data_Sink``, right after the rows are synced to disk, so it never gets
+    ahead of the data file. Every save writes a temporary file and renames it over the journal, so a crash during a save
+    leaves the previous journal intact.
+    """
+    def __init__(self, filename):
+        """Initializes the ``Run_Journal`` class.
+
+        Args:
+            filename (string): journal file, e.g. from ``journal_filename()``
+        """
+        self.filename = filename
+        self.state = None
+
+        # time spent on the run before this session, and start of this session
+        self.previous_elapsed = 0.0
+        self.session_start = monotonic()
+
+
+    def load(self):
+        """Reads the journal.
+
+        Returns:
+            dict: contents of the journal, or None if there is no journal
+        """
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename, 'r') as f:
+            self.state = json.load(f)
+        # the time of this session is counted from now, on top of the time recorded
+        self.previous_elapsed = self.state.get('elapsed_sec', 0.0)
+        self.session_start = monotonic()
+        return self.state
+
+
+    def start(self, path_filename, data_filename, next_index = 0):
+        """Starts recording a run. Nothing is written until the first ``save()``.
+
+        Args:
+            path_filename (string): path file being run
+            data_filename (string): data file being written
+            next_index (int, optional): index of the first point to run. Defaults to 0.
+        """
+        self.state = {'path_filename' : path_filename,
+                      'path_hash' : file_hash(path_filename),
+                      'data_filename' : data_filename,
+                      'next_index' : next_index,
+                      'data_offset' : 0,
+                      'completed' : False,
+                      'elapsed_sec' : 0.0}
+        self.previous_elapsed = 0.0
+        self.session_start = monotonic()
+
+
+    def elapsed(self):
+        """Returns the time spent on the run so far: the time recorded by the sessions before the last ``load()``, plus the time
+        since then (or since ``start()`` for a new run).
+
+        Returns:
+            float: time in seconds
+        """
+        return self.previous_elapsed + monotonic() - self.session_start
+
+
+    def save(self, next_index, data_offset, completed = False):
+        """Records the progress of the run, atomically.
+
+        Args:
+            next_index (int): index of the first point without a row in the data file
+            data_offset (int): size in bytes of the data file, synced to disk
+            completed (bool, optional): True if the whole path has been run. Defaults to False.
+        """
+        self.state.update(next_index=next_index, data_offset=data_offset, completed=completed, elapsed_sec=self.elapsed(),
+                          updated=datetime.now().isoformat())
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.state, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.filename)
+
+
+    def check_resume(self, path_filename, data_filename):
+        """Checks that the journal describes an unfinished run of this path into this data file, and prepares the data file to
+        be appended to, by dropping anything written after the last checkpoint.
+
+        Args:
+            path_filename (string): path file to run
+            data_filename (string): data file to append to
+
+        Returns:
+            int: index of the first point to run
+
+        Raises:
+            ValueError: if the run cannot be resumed, with the reason
+        """
+        if self.load() is None:
+            raise ValueError('No journal found at %s.' % self.filename)
+        if self.state['completed']:
+            raise ValueError('The run recorded in %s is already complete.' % self.filename)
+        if self.state['data_filename'] != data_filename or not os.path.exists(data_filename):
+            raise ValueError('The journal was recorded for data file %s.' % self.state['data_filename'])
+        if self.state['path_hash'] != file_hash(path_filename):
+            raise ValueError('The path in %s has changed since the run was interrupted.' % path_filename)
+        if os.path.getsize(data_filename) < self.state['data_offset']:
+            raise ValueError('The data file %s is shorter than recorded in the journal.' % data_filename)
+
+        with open(data_filename, 'r+b') as f:
+            f.truncate(self.state['data_offset'])
+        return self.state['next_index']
@@ -0,0 +1,180 @@
+import os
+import warnings
+from time import monotonic
+import numpy as np
+from mapper_data_sink import Data_Sink
+
+# phases of a point, in the order they happen
+PHASES = ('move', 'wait_idle', 'settle', 'probe_read', 'write')
+
+
+def profile_filename(data_filename):
+    """Returns the name of the timing profile that goes with a data file, e.g. 'data/data.profile.csv' for 'data/data.csv'.
+
+    Args:
+        data_filename (string): data CSV file name
+
+    Returns:
+        string: profile file name
+    """
+    return os.path.splitext(data_filename)[0] + '.profile.csv'
+
+
+class Run_Profiler():
+    """The ``Run_Profiler`` class records where the time of every point of a run goes, so that the effect of an optimization can be measured.
+
+    The time of a point is split into phases:
+
+    ==============    =============================================================
+    Phase             Description
+    ==============    =============================================================
+    'move'            sending the move commands to the stages
+    'wait_idle'       waiting for the stages to stop (``wait_until_idle()``)
+    'settle'          waiting for the probe oscillation to damp out
+    'probe_read'      waiting for a probe reading taken after the settle time
+    'write'           printing the row and writing it to the data file
+    ==============    =============================================================
+
+    A point starts with ``begin_point()`` and ends with ``end_point()``. In between, every call to ``lap(phase)`` adds the time since
+    the previous lap to ``phase``. Laps outside of a point, or while the profiler is not recording, do nothing, so the instrumented
+    functions can also be used without a profile.
+
+    The profile is a CSV file with one row per point: the index of the point in the path, its ``time.monotonic()`` start time, the
+    time spent in each phase and the total time of the point, all in seconds. Phases a point did not go through are left empty.
+    The time not spent in any phase (e.g. checking the bounds) is the total minus the phases. Rows are written in batches by a
+    ``Data_Sink``. Use ``print_profile_report()`` to print the percentiles of each phase.
+    """
+    def __init__(self, flush_rows = 500, flush_sec = 30.0):
+        """Initializes the ``Run_Profiler`` class. Nothing is recorded until ``open()`` is called.
+
+        Args:
+            flush_rows (int, optional): number of rows written to the profile at once. Defaults to 500.
+            flush_sec (float, optional): maximum time in seconds a row is held before being written. Defaults to 30.0.
+        """
+        self.flush_rows = flush_rows
+        self.flush_sec = flush_sec
+        self.header = ['point', 'start'] + list(PHASES) + ['total']
+
+        self.sink = None
+        self.point_index = 0
+        self.point_start = None
+        self.last_lap = None
+        self.durations = {}
+
+
+    def open(self, filename, mode = 'w', first_index = 0):
+        """Starts recording into a profile file.
+
+        Args:
+            filename (string): profile CSV file, e.g. from ``profile_filename()``
+            mode (string, optional): 'w' to start a new profile, 'a' to append to the profile of a resumed run. Defaults to 'w'.
+            first_index (int, optional): index in the path of the first point. Defaults to 0.
+        """
+        self.sink = Data_Sink(filename, self.header, self.flush_rows, self.flush_sec, mode)
+        self.sink.open()
+        self.point_index = first_index
+        self.point_start = None
+
+
+    def close(self):
+        """Writes the rows still held in memory and stops recording.
+        """
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        self.point_start = None
+
+
+    def begin_point(self):
+        """Starts timing a point.
+        """
+        if self.sink is None:
+            return
+        self.point_start = self.last_lap = monotonic()
+        self.durations = {}
+
+
+    def lap(self, phase, until = None):
+        """Adds the time since the previous lap to ``phase``.
+
+        Args:
+            phase (string): one of ``PHASES``
+            until (float, optional): ``time.monotonic()`` time at which the phase ended, if it ended before now, e.g. the end of the
+                                     settle time when the reading arrived later. Defaults to None, i.e. now.
+        """
+        if self.point_start is None:
+            return
+        end = monotonic()
+        if until is not None:
+            end = max(min(end, until), self.last_lap)
+        self.durations[phase] = self.durations.get(phase, 0.0) + end - self.last_lap
+        self.last_lap = end
+
+
+    def end_point(self):
+        """Ends the point and queues its row.
+        """
+        if self.point_start is None:
+            return
+        total = monotonic() - self.point_start
+        row = [self.point_index, '%.6f' % self.point_start]
+        for phase in PHASES:
+            duration = self.durations.get(phase)
+            row.append('' if duration is None else '%.6f' % duration)
+        row.append('%.6f' % total)
+        self.sink.write_row(row)
+        self.point_index += 1
+        self.point_start = None
+
+
+def load_profile(filename):
+    """Reads a profile written by ``Run_Profiler``.
+
+    Args:
+        filename (string): profile CSV file
+
+    Returns:
+        numpy structured array: one record per point with the fields of ``Run_Profiler.header``, missing phases are NaN
+    """
+    with warnings.catch_warnings():
+        # an empty profile only has its header
+        warnings.simplefilter('ignore', UserWarning)
+        profile = np.genfromtxt(filename, delimiter=',', names=True, dtype=float, ndmin=1)
+    return profile
+
+
+def print_profile_report(filename):
+    """Prints the number of points, the total time and the percentiles of the time spent in each phase of a profile.
+
+    For each phase, 'Share' is the fraction of the total time of all points spent in that phase. 'other' is the time not spent
+    in any phase.
+
+    Args:
+        filename (string): profile CSV file
+    """
+    if not os.path.exists(filename):
+        print('\nNo timing profile found at %s. Run the mapper along the full path first.\n' % filename)
+        return
+    profile = load_profile(filename)
+    if len(profile) == 0:
+        print('\nThe timing profile %s has no points.\n' % filename)
+        return
+
+    total = profile['total']
+    phases = {phase : profile[phase] for phase in PHASES}
+    phases['other'] = total - np.nansum([profile[phase] for phase in PHASES], axis=0)
+    phases['total'] = total
+
+    print('\nTiming profile of %d points in %s' % (len(profile), filename))
+    print('Time per point %.1f ms, %.0f points per hour, %.1f s in total\n' % (1000 * np.mean(total), 3600 / np.mean(total), np.sum(total)))
+    print('{:<12}{:>8}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('Phase', 'Points', 'Total s', 'Share', 'Mean ms',
+                                                                      'p50 ms', 'p90 ms', 'p99 ms', 'Max ms'))
+    for phase, durations in phases.items():
+        durations = durations[~np.isnan(durations)]
+        if len(durations) == 0:
+            continue
+        p50, p90, p99 = 1000 * np.percentile(durations, [50, 90, 99])
+        print('{:<12}{:>8}{:>10.1f}{:>7.1f}%{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+            phase, len(durations), np.sum(durations), 100 * np.sum(durations) / np.sum(total), 1000 * np.mean(durations),
+            p50, p90, p99, 1000 * np.max(durations)))
+    print()
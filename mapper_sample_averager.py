@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class Sample_Averager():
+    """The ``Sample_Averager`` class combines several probe readings taken at the same point into one value, so that a single pass
+    over the map gives the noise level of several passes averaged together.
+
+    The statistic is chosen with ``method``:
+
+    ================    =============================================================
+    Method              Description
+    ================    =============================================================
+    'mean'              mean of all readings
+    'median'            median of all readings
+    'trimmed_mean'      mean of the readings left once the ``trim_fraction`` lowest and highest are removed
+    'mad'               mean of the readings within ``mad_threshold`` scaled median absolute deviations (MAD) of the median.
+                        The MAD is scaled by 1.4826, so that it matches the standard deviation for Gaussian noise.
+    ================    =============================================================
+
+    Along with the value, ``estimate()`` returns the standard deviation of the readings that were kept and their number, so that
+    garbled or spiky readings show up in the data file rather than silently skewing the map.
+    """
+    def __init__(self, samples = 1, method = 'mad', trim_fraction = 0.1, mad_threshold = 3.5):
+        """Initializes the ``Sample_Averager`` class.
+
+        Args:
+            samples (int, optional): number of readings per point. Defaults to 1.
+            method (string, optional): 'mean', 'median', 'trimmed_mean' or 'mad'. Defaults to 'mad'.
+            trim_fraction (float, optional): fraction of the readings removed at each end by 'trimmed_mean'. Defaults to 0.1.
+            mad_threshold (float, optional): readings further than this many scaled MADs from the median are rejected by 'mad'. Defaults to 3.5.
+        """
+        if method not in ('mean', 'median', 'trimmed_mean', 'mad'):
+            raise ValueError('Unknown sample statistic %s' % method)
+        self.samples = samples
+        self.method = method
+        self.trim_fraction = trim_fraction
+        self.mad_threshold = mad_threshold
+
+        # number of readings rejected over the run
+        self.rejected = 0
+
+
+    def kept_values(self, values):
+        """Removes the outliers, according to ``self.method``.
+
+        Args:
+            values (numpy array): readings taken at one point
+
+        Returns:
+            numpy array: readings used to compute the value
+        """
+        if self.method == 'trimmed_mean':
+            trimmed = int(self.trim_fraction * len(values))
+            return np.sort(values)[trimmed:len(values) - trimmed]
+        if self.method == 'mad':
+            deviations = np.abs(values - np.median(values))
+            mad = 1.4826 * np.median(deviations)
+            return values[deviations <= self.mad_threshold * mad]
+        return values
+
+
+    def estimate(self, values):
+        """Computes the value of a point from its readings.
+
+        Args:
+            values (numpy array): readings taken at one point
+
+        Returns:
+            (float, float, int): value, standard deviation of the readings kept (0 if only one is kept) and number of readings kept
+        """
+        values = np.asarray(values, dtype=float)
+        kept = self.kept_values(values)
+        self.rejected += len(values) - len(kept)
+        if self.method == 'median':
+            value = np.median(kept)
+        else:
+            value = np.mean(kept)
+        std = np.std(kept, ddof=1) if len(kept) > 1 else 0.0
+        return float(value), float(std), len(kept)
+
+
+    def print_stats(self):
+        """Prints the number of readings rejected over the run.
+        """
+        if self.method in ('trimmed_mean', 'mad'):
+            print('Sample averaging: {} readings per point, {} readings rejected by {}.'.format(self.samples, self.rejected, self.method))
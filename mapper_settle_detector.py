@@ -0,0 +1,111 @@
+from time import monotonic
+import numpy as np
+
+class Settle_Detector():
+    """The ``Settle_Detector`` class decides when the probe has stopped oscillating after a move, by watching the live field readings
+    stored in the ``Frame_Buffer`` of a ``Probe_Session``. It replaces the fixed ``probe_stop_time_sec`` pause when the 'settle_mode'
+    configuration is set to 'adaptive'.
+
+    A point is considered settled once the variance of the readings of the last ``self.window`` seconds (all taken after the
+    motion ended) drops below ``self.variance_threshold``. The window is a time rather than a number of readings, so that the test
+    does not depend on the frame rate of the probe: it should last at least one period of the slowest oscillation of the probe
+    mount, otherwise a slow oscillation looks flat over the window. At least ``self.min_readings`` readings are needed in the window.
+
+    The threshold is set relative to the noise of the probe at rest: ``NOISE_FACTOR`` squared times its variance by default, i.e.
+    a standard deviation of twice the noise. A threshold equal to the noise variance would be crossed about half of the time by
+    the noise alone.
+
+    The dwell is never shorter than ``self.min_dwell`` and never longer than ``self.max_dwell``. The actual dwell of every point is
+    kept in ``self.dwells``.
+    """
+    # standard deviation of a settled window, in multiples of the probe noise
+    NOISE_FACTOR = 2.0
+
+    def __init__(self, window = 0.5, min_readings = 5, noise = 0.01, variance_threshold = None, min_dwell = 0.5, max_dwell = 5.0):
+        """Initializes the ``Settle_Detector`` class.
+
+        Args:
+            window (float, optional): length in seconds of the last readings used to compute the variance. Defaults to 0.5.
+            min_readings (int, optional): least number of readings in the window. Defaults to 5.
+            noise (float, optional): standard deviation of the readings of the probe at rest, in the probe unit (e.g. G). Defaults to 0.01.
+            variance_threshold (float, optional): variance below which the field is settled, in the probe unit squared (e.g. G^2).
+                                                  Defaults to None, i.e. ``(NOISE_FACTOR * noise) ** 2``.
+            min_dwell (float, optional): minimum time to wait after the motion ends, in seconds. Defaults to 0.5.
+            max_dwell (float, optional): maximum time to wait after the motion ends, in seconds. Defaults to 5.0.
+        """
+        self.window = window
+        self.min_readings = min_readings
+        if variance_threshold is None:
+            variance_threshold = (self.NOISE_FACTOR * noise) ** 2
+        self.variance_threshold = variance_threshold
+        self.min_dwell = min_dwell
+        self.max_dwell = max_dwell
+
+        # actual dwell in seconds and whether the point settled before max_dwell, one entry per point
+        self.dwells = []
+        self.settled = []
+
+
+    def is_settled(self, timestamps, values, motion_end):
+        """Checks whether the latest readings are settled.
+
+        Args:
+            timestamps (numpy array): ``time.monotonic()`` timestamps of the readings since the motion ended, from oldest to newest
+            values (numpy array): field values of these readings
+            motion_end (float): ``time.monotonic()`` time at which the stages stopped moving
+
+        Returns:
+            boolean: True if ``self.window`` seconds have passed since ``motion_end``, the readings of the last ``self.window``
+            seconds are at least ``self.min_readings`` and their variance is below the threshold
+        """
+        if len(values) == 0 or timestamps[-1] - motion_end < self.window:
+            return False
+        in_window = values[timestamps >= timestamps[-1] - self.window]
+        if len(in_window) < self.min_readings:
+            return False
+        return np.var(in_window) <= self.variance_threshold
+
+
+    def wait_until_settled(self, buffer, motion_end):
+        """Blocks until the field readings are settled or ``self.max_dwell`` seconds have passed since ``motion_end``.
+
+        Args:
+            buffer (Frame_Buffer): buffer filled by the background reader of the probe session
+            motion_end (float): ``time.monotonic()`` time at which the stages stopped moving
+
+        Returns:
+            float: ``time.monotonic()`` timestamp of the reading to record, i.e. the last reading of the settled window, or the time
+            at which ``self.max_dwell`` expired if the field did not settle
+        """
+        min_time = motion_end + self.min_dwell
+        max_time = motion_end + self.max_dwell
+        total_seen = -1
+
+        while True:
+            now = monotonic()
+            if now >= min_time:
+                timestamps, values, units = buffer.since(motion_end)
+                if self.is_settled(timestamps, values, motion_end):
+                    self.dwells.append(now - motion_end)
+                    self.settled.append(True)
+                    return timestamps[-1]
+            if now >= max_time:
+                self.dwells.append(now - motion_end)
+                self.settled.append(False)
+                return now
+
+            # sleep until a new reading arrives or the next time limit is reached
+            wake_time = min_time if now < min_time else max_time
+            with buffer.condition:
+                buffer.condition.wait_for(lambda: buffer.total != total_seen, max(wake_time - monotonic(), 0))
+                total_seen = buffer.total
+
+
+    def print_stats(self):
+        """Prints the number of points that settled, and the mean and maximum dwell over the run.
+        """
+        if len(self.dwells) == 0:
+            return
+        dwells = np.array(self.dwells)
+        print('Settled %d of %d points before the maximum dwell. Dwell: mean %.2f s, max %.2f s, total %.1f s'
+              % (sum(self.settled), len(dwells), np.mean(dwells), np.max(dwells), np.sum(dwells)))
@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+from zaber_motion import ConnectionClosedException, ConnectionFailedException
+
+
+class Stage_Session():
+    """The ``Stage_Session`` class keeps the connection to the Zaber daisy chain open between operations, so that homing, running the
+    edges and running the full path do not each open the serial port, load the device database and detect the devices again.
+
+    The devices and axes are looked up once per connection and kept in ``self.devices`` and ``self.axes``, keyed by 'x', 'y', 'z' and
+    'r'. Settings applied with ``set_setting()`` are remembered as well, and only sent again if their value changes.
+
+    If the connection is lost, it is closed and opened again by the next operation. With ``keep_open`` set to False, the connection
+    is closed at the end of every operation, which is how the ``Controller`` works when it is not given a session.
+    """
+    def __init__(self, backend, keep_open = True):
+        """Initializes the ``Stage_Session`` class. The connection is opened by the first operation.
+
+        Args:
+            backend (Motion_Backend): backend that opens the connection, see ``create_backend()``
+            keep_open (bool, optional): True to keep the connection open between operations. Defaults to True.
+        """
+        self.backend = backend
+        self.keep_open = keep_open
+        self.connection = None
+        self.device_list = None
+        self.devices = None
+        self.axes = None
+        self.applied_settings = {}
+
+
+    def open(self):
+        """Opens the connection and detects the devices.
+
+        The devices are expected in this order on the daisy chain: Z (parallel to beamline), X (transverse horizontal),
+        Y (transverse vertical) and rotation.
+
+        Raises:
+            RuntimeError: if fewer than 4 devices are detected. The connection is closed.
+        """
+        self.connection = self.backend.connect()
+        self.device_list = self.connection.detect_devices()
+        print("Found {} devices".format(len(self.device_list)))
+        if len(self.device_list) < 4:
+            num_devices = len(self.device_list)
+            self.close()
+            raise RuntimeError('Found {} devices on the daisy chain, 4 are needed (Z, X, Y and rotation). '
+                               'Check that every device is powered and connected.'.format(num_devices))
+        self.devices = {'z' : self.device_list[0], 'x' : self.device_list[1], 'y' : self.device_list[2], 'r' : self.device_list[3]}
+        self.axes = {name : device.get_axis(1) for name, device in self.devices.items()}
+        self.applied_settings = {}
+
+
+    def close(self):
+        """Closes the connection, if it is open, and forgets the devices and the applied settings.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.device_list = None
+        self.devices = None
+        self.axes = None
+        self.applied_settings = {}
+
+
+    @contextmanager
+    def use(self):
+        """Provides the open session for the duration of a ``with`` block, opening the connection if needed.
+
+        Yields:
+            Stage_Session: this session
+        """
+        if self.connection is None:
+            self.open()
+        try:
+            yield self
+        except (ConnectionClosedException, ConnectionFailedException):
+            # the next operation will open a new connection
+            self.close()
+            raise
+        finally:
+            if not self.keep_open:
+                self.close()
+
+
+    def set_setting(self, axis_name, setting, value, unit):
+        """Applies a setting to a device, unless the same value has already been applied during this connection.
+
+        Args:
+            axis_name (string): 'x', 'y', 'z' or 'r'
+            setting (string): name of the setting, e.g. 'accel'
+            value (float): value of the setting
+            unit (Units): unit of the value, e.g. Units.ACCELERATION_MILLIMETRES_PER_SECOND_SQUARED
+        """
+        key = (axis_name, setting, unit)
+        if self.applied_settings.get(key) == value:
+            return
+        self.devices[axis_name].settings.set(setting, value, unit)
+        self.applied_settings[key] = value
@@ -0,0 +1,148 @@
+import threading
+from collections import Counter
+
+
+class Stage_Warning_Error(Exception):
+    """Raised by ``Warning_Monitor.start()`` and ``Warning_Monitor.check()`` when a Zaber device reports an actionable warning flag,
+    e.g. a stall.
+    """
+    pass
+
+
+class Warning_Monitor():
+    """The ``Warning_Monitor`` class polls the warning flags of every Zaber device from a background thread, instead of the main loop
+    calling ``warnings.get_flags()`` on each device after every move.
+
+    Every time a flag appears on a device it is counted in ``self.counts``, keyed by (device address, flag). Actionable flags stop the
+    run: the next call to ``check()`` from the main loop raises a ``Stage_Warning_Error``. Since the flags are polled every
+    ``self.interval`` seconds, a few more points may be mapped between the fault and the error.
+
+    By default the actionable flags are the faults, i.e. every flag starting with 'F' such as 'FS' (stalled and stopped), 'FE'
+    (limit error) or 'FH' (emergency stop). Warnings ('W...') and notices ('N...') are only counted and reported at the end.
+    """
+    def __init__(self, interval = 1.0, actionable_flags = None):
+        """Initializes the ``Warning_Monitor`` class. Polling starts with ``start()``.
+
+        Args:
+            interval (float, optional): time between two polls in seconds. Defaults to 1.0.
+            actionable_flags (list, optional): flags that stop the run, e.g. ['FS']. Defaults to None, i.e. every fault flag.
+        """
+        self.interval = interval
+        self.actionable_flags = actionable_flags
+        self.device_list = []
+        self.previous_flags = {}
+        self.counts = Counter()
+        self.error = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+
+    def is_actionable(self, flag):
+        """Checks whether a flag should stop the run.
+
+        Args:
+            flag (string): warning flag, e.g. 'FS'
+
+        Returns:
+            boolean: True if the flag is actionable
+        """
+        if self.actionable_flags is None:
+            return flag.startswith('F')
+        return flag in self.actionable_flags
+
+
+    def start(self, device_list):
+        """Checks the flags left over from before the run, clears them so that only new flags are reported, and starts the
+        background thread.
+
+        An actionable flag latched before the run, e.g. a stall, is not cleared: the run is refused so that its cause can be looked
+        at first. The devices only clear all their flags at once, so no flag is cleared then. Otherwise, only warnings and notices
+        are left over, and they are cleared.
+
+        Args:
+            device_list (list): Zaber devices to watch
+
+        Raises:
+            Stage_Warning_Error: if a device already reports an actionable flag
+        """
+        self.device_list = device_list
+        self.previous_flags = {}
+        self.error = None
+        for device in self.device_list:
+            actionable_flags = sorted(flag for flag in device.warnings.get_flags() if self.is_actionable(flag))
+            if len(actionable_flags) > 0:
+                raise Stage_Warning_Error('Device {} reported warning flags {} before the run, check the stage and clear them '
+                                          '(e.g. in Zaber Launcher) first.'.format(device.device_address, actionable_flags))
+        for device in self.device_list:
+            old_flags = device.warnings.clear_flags()
+            if len(old_flags) > 0:
+                print('Cleared warning flags {} of device {} from before the run.'.format(sorted(old_flags), device.device_address))
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.poll_loop, name='warning-monitor', daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        """Stops the background thread and waits for it to exit.
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+
+    def is_running(self):
+        """Checks whether the background thread is running.
+
+        Returns:
+            boolean: True if the flags are being polled
+        """
+        return self.thread is not None
+
+
+    def poll(self):
+        """Reads the flags of every device once, counts the new ones and records the first actionable one.
+        """
+        for device in self.device_list:
+            flags = set(device.warnings.get_flags())
+            new_flags = flags - self.previous_flags.get(device.device_address, set())
+            self.previous_flags[device.device_address] = flags
+            for flag in sorted(new_flags):
+                self.counts[(device.device_address, flag)] += 1
+                if self.error is None and self.is_actionable(flag):
+                    self.error = Stage_Warning_Error('Device {} reported warning flag {}'.format(device.device_address, flag))
+
+
+    def poll_loop(self):
+        """Body of the background thread. An exception while polling (e.g. a lost connection) is passed on to the main loop
+        by ``check()``.
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as error:
+                if self.error is None:
+                    self.error = error
+                return
+            self.stop_event.wait(self.interval)
+
+
+    def check(self):
+        """Raises the error recorded by the background thread, if any. Does not communicate with the devices, so it is cheap
+        enough to call after every move.
+
+        Raises:
+            Stage_Warning_Error: if an actionable flag was reported
+        """
+        if self.error is not None:
+            raise self.error
+
+
+    def print_summary(self):
+        """Prints how many times each flag appeared on each device.
+        """
+        if len(self.counts) == 0:
+            return
+        print('Warning flags during the run: ' + ', '.join('device {} {} x{}'.format(address, flag, count)
+                                                           for (address, flag), count in sorted(self.counts.items())))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules of the mapper live at the root of the repository, as for the benchmarks
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
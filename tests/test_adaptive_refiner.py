@@ -0,0 +1,104 @@
+"""Choice of the points added to a coarse map by adaptive refinement.
+"""
+from itertools import product
+import numpy as np
+from mapper_adaptive_refiner import Adaptive_Refiner, order_points, point_keys
+
+
+def grid(xs, ys, zs, rotations = (90.0,)):
+    return np.array(list(product(xs, ys, zs, rotations)), dtype=float)
+
+
+def measure(refiner, points, field):
+    refiner.add_data(points, [field(*point) for point in points.tolist()])
+
+
+def test_order_points():
+    points = grid([0, 10], [0], [0, 10, 20])
+    shuffled = points[np.random.default_rng(0).permutation(len(points))]
+    ordered = order_points(shuffled)
+    # Z goes up along the first column and down along the next
+    assert ordered[:, [0, 2]].tolist() == [[0, 0], [0, 10], [0, 20], [10, 20], [10, 10], [10, 0]]
+    assert len(order_points(np.empty((0, 4)))) == 0
+
+
+def test_coarse_cells_from_chunks():
+    points = grid([0, 10, 30], [0], [0, 10, 20, 40], rotations=(0.0, 90.0))
+    refiner = Adaptive_Refiner(0.1)
+    refiner.start(np.array_split(points, 5))
+    # 2 x 3 cells per angle, Y is flat
+    assert len(refiner.cells) == 12
+    sizes = sorted({tuple(cell[2].tolist()) for cell in refiner.cells})
+    assert sizes == [(10, 0, 10), (10, 0, 20), (20, 0, 10), (20, 0, 20)]
+
+    whole = Adaptive_Refiner(0.1)
+    whole.start([points])
+    assert [(cell[0], cell[1].tolist(), cell[2].tolist()) for cell in whole.cells] == \
+           [(cell[0], cell[1].tolist(), cell[2].tolist()) for cell in refiner.cells]
+
+
+def test_linear_field_stops_after_one_level():
+    """A field that changes quickly but evenly is split once, then the middle points show the interpolation was right.
+    """
+    field = lambda x, y, z, rot: 0.5 * x + 2.0 * z
+    points = grid([0, 20], [0], [0, 20, 40])
+    refiner = Adaptive_Refiner(0.1, min_spacing=1.0, max_levels=5)
+    refiner.start([points])
+    measure(refiner, points, field)
+
+    new_points = refiner.next_points()
+    # the 3 x 5 grid of the halves, without the 6 coarse points
+    assert len(new_points) == 3 * 5 - 6
+    measure(refiner, new_points, field)
+    assert len(refiner.next_points()) == 0
+    assert refiner.cells == []
+
+
+def test_curved_field_is_refined_down_to_min_spacing():
+    field = lambda x, y, z, rot: 0.01 * z ** 2
+    points = grid([0], [0], [0, 40])
+    refiner = Adaptive_Refiner(0.01, min_spacing=5.0, max_levels=10)
+    refiner.start([points])
+    measure(refiner, points, field)
+    while True:
+        new_points = refiner.next_points()
+        if len(new_points) == 0 and len(refiner.cells) == 0:
+            break
+        measure(refiner, new_points, field)
+    z = sorted(key[2] for key in refiner.values[0])
+    # keys are in units of TOLERANCE, i.e. 1e-6 mm
+    assert np.diff(z).tolist() == [5e6] * 8
+
+
+def test_cells_without_reading_are_not_refined():
+    points = grid([0], [0], [0, 10, 20])
+    refiner = Adaptive_Refiner(0.1)
+    refiner.start([points])
+    # the last point is out of bounds
+    refiner.add_data(points[:2], [0.0, 5.0])
+    assert order_points(refiner.next_points()).tolist() == [[0.0, 0.0, 5.0, 90.0]]
+
+
+def test_cells_over_max_points_are_kept():
+    """A cell too large for the budget is skipped for a smaller one further down, and checked again by the next call.
+    """
+    values = {(0, 0) : 0.0, (10, 0) : 5.0, (0, 10) : 3.0, (10, 10) : 3.0, (0, 20) : 5.0, (10, 20) : 5.0}
+    points = grid([0, 10], [0], [0, 10, 20])
+    refiner = Adaptive_Refiner(1.0, min_spacing=1.0)
+    refiner.start([points])
+    refiner.add_data(points, [values[(x, z)] for x, y, z, rot in points.tolist()])
+
+    # the lower cell has the largest error and needs 5 points, the upper one needs 2
+    new_points = refiner.next_points(max_points=3)
+    assert new_points[:, [0, 2]].tolist() == [[0, 15], [10, 15]]
+    assert refiner.deferred == 1
+    assert len(refiner.cells) == 3
+
+    refiner.add_data(new_points, [5.0, 5.0])
+    new_points = refiner.next_points()
+    assert sorted(new_points[:, [0, 2]].tolist()) == [[0, 5], [5, 0], [5, 5], [5, 10], [10, 5]]
+    assert refiner.deferred == 0
+
+
+def test_point_keys():
+    assert point_keys([[0.0, -0.0, 1e-9, 90.0]]) == point_keys([[0.0, 0.0, 0.0, 90.0]])
@@ -0,0 +1,101 @@
+"""Continuous Z scans: columns of a path, interpolation of the readings, position sampling and a scan on the simulated stages.
+"""
+import contextlib
+import csv
+import io
+import os
+import numpy as np
+import pytest
+from mapper_base import Mapper
+from mapper_continuous_scanner import split_columns, interpolate_column, Position_Sampler
+from mapper_controller import Controller
+from mapper_path_io import iter_path_chunks
+from mapper_points_generator import Points_Generator
+from mapper_probe_simulator import quadrupole_field
+
+
+def test_split_columns():
+    points = np.array([[0, 0, -10, 90], [0, 0, 0, 90], [0, 0, 10, 90],
+                       # Z turns back
+                       [0, 0, 5, 90], [0, 0, -5, 90],
+                       # X changes
+                       [5, 0, -5, 90], [5, 0, 5, 90]], dtype=float)
+    columns = split_columns(points)
+    assert [len(column) for column in columns] == [3, 2, 2]
+    assert np.array_equal(np.concatenate(columns), points)
+    assert split_columns(np.empty((0, 4))) == []
+
+
+def test_interpolate_column():
+    # Z moves at 10 mm/s from 0 to 100, the field is 2 G/mm
+    sample_times = np.linspace(0.0, 10.0, 11)
+    positions = 10.0 * sample_times
+    reading_times = np.arange(0.05, 10.0, 0.1)
+    values = 2.0 * 10.0 * reading_times
+    result = interpolate_column([-10.0, 0.0, 25.0, 99.0, 100.0], reading_times, values, sample_times, positions)
+    assert np.isnan(result[0])
+    # 0 and 100 are not between two readings either
+    assert np.isnan(result[1]) and np.isnan(result[4])
+    assert result[2:4] == pytest.approx([50.0, 198.0])
+    assert np.all(np.isnan(interpolate_column([10.0], reading_times, values, np.empty(0), np.empty(0))))
+
+
+class Failing_Axis():
+    def get_position(self, unit = None):
+        raise ConnectionError('connection lost')
+
+
+class Fixed_Axis():
+    def get_position(self, unit = None):
+        return 510.0
+
+
+def test_position_sampler():
+    sampler = Position_Sampler(Fixed_Axis(), offset=500.0, interval=0.01)
+    sampler.start()
+    try:
+        timestamp, position, unit = sampler.wait_for_sample(0, 1.0)
+    finally:
+        sampler.stop()
+    assert (position, unit) == (10.0, 'mm')
+    with pytest.raises(RuntimeError, match='No Z position sample'):
+        sampler.wait_for_sample(timestamp + 10.0, 0.2)
+
+    sampler = Position_Sampler(Failing_Axis(), interval=0.01)
+    sampler.start()
+    try:
+        with pytest.raises(ConnectionError):
+            sampler.wait_for_sample(0, 1.0)
+    finally:
+        sampler.stop()
+
+
+@pytest.mark.skipif(not hasattr(os, 'openpty'), reason='the simulated probe needs a pseudo terminal')
+def test_continuous_run(tmp_path):
+    """Every point of the path gets one row, in path order, with the field interpolated from the readings of the sweep.
+
+    The stages run 10 times faster than real time, so the sweep at 10 mm/s gives a reading about every 1 mm.
+    """
+    Mapper.config_dict = {'path_filename' : str(tmp_path / 'path.csv'), 'path_edges_filename' : str(tmp_path / 'path_edges.csv'),
+                          'data_filename' : str(tmp_path / 'data.csv'),
+                          'comm_port_zaber' : 'simulated', 'comm_port_probe' : 'simulated',
+                          'collect_data' : 'True', 'probe_stop_time_sec' : 0.1, 'scan_mode' : 'continuous', 'scan_speed' : 10,
+                          'x_offset' : 250, 'y_offset' : 250, 'z_offset' : 500, 'x_accel' : 200, 'y_accel' : 200, 'z_accel' : 200,
+                          'x_speed' : 100, 'y_speed' : 100, 'z_speed' : 100,
+                          'motion_backend' : 'simulated', 'probe_backend' : 'simulated', 'sim_time_scale' : 10, 'sim_probe_rate_hz' : 100,
+                          'sim_probe_noise' : 0.001, 'sim_probe_oscillation' : 0.0,
+                          'shape' : 'rectangular', 'x_range' : 40, 'x_spacing' : 20, 'y_range' : 0, 'y_spacing' : 1,
+                          'rotation_points' : [90.0], 'z_range' : 100, 'z_spacing' : 25}
+    with contextlib.redirect_stdout(io.StringIO()):
+        Points_Generator().run()
+        Controller().run()
+
+    path = np.concatenate(list(iter_path_chunks(Mapper.config_dict['path_filename'])))
+    with open(str(tmp_path / 'data.csv'), 'r', newline='') as f:
+        rows = list(csv.reader(f))[1:]
+    assert len(rows) == len(path) == 15
+    assert np.array([row[:4] for row in rows], dtype=float) == pytest.approx(path)
+    expected = [quadrupole_field(*point) for point in path.tolist()]
+    assert [float(row[4]) for row in rows] == pytest.approx(expected, abs=0.02)
+    # rounded like the readings written by the Datalogger
+    assert all(len(row[4].partition('.')[2]) <= 6 for row in rows)
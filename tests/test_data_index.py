@@ -0,0 +1,112 @@
+"""Catalog of the data files of an archive folder.
+"""
+import csv
+import os
+import shutil
+import pytest
+from conftest import ROOT
+import mapper_data_store
+from mapper_data_index import Data_Catalog, convert_file, parse_run_name
+from mapper_data_store import load_store
+
+RUNS = ['BL4N-Q2-100x0x1000-5x0x25-340-220404-1720.csv', 'BL4N-STY1-00x12x80-0x2x2-220331-1336.csv']
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'data'
+    folder.mkdir()
+    for name in RUNS:
+        shutil.copy(os.path.join(ROOT, 'data', name), str(folder / name))
+    return str(folder)
+
+
+def write_run(filename, rows):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['X', 'Y', 'Z', 'Rotation', 'Data', 'Unit'])
+        writer.writerows(rows)
+
+
+def test_parse_run_name():
+    assert parse_run_name('data/BL4N-Q2-100x0x1000-5x0x25-340-220404-1645.csv') == \
+           {'beamline' : 'BL4N', 'magnet' : 'Q2', 'ranges' : [100, 0, 1000], 'spacing' : [5, 0, 25], 'tag' : '340',
+            'timestamp' : '2022-04-04T16:45:00'}
+    assert parse_run_name('data/BL4N-STY1-00x12x80-0x2x2-220331-1336.csv')['tag'] is None
+    assert parse_run_name('data/test.csv')['magnet'] is None
+
+
+def test_update_only_reads_changed_files(folder, tmp_path):
+    catalog = Data_Catalog(str(tmp_path / 'catalog.json'))
+    assert catalog.update(folder, workers=1) == (2, 0)
+    assert not os.path.exists(catalog.filename + '.tmp')
+
+    extra = os.path.join(folder, 'BL4N-Q1-10x0x20-5x0x10-220405-0900.csv')
+    write_run(extra, [[0.0, 0.0, z, 90.0, 1.5, 'G'] for z in (0.0, 10.0, 20.0)] + [[0.0, 0.0, 900.0, 90.0, 'out of motion bounds']])
+    reloaded = Data_Catalog(catalog.filename)
+    assert reloaded.update(folder, workers=1) == (1, 2)
+    entry = reloaded.entries[extra]
+    assert (entry['rows'], entry['points'], entry['no_value']) == (4, 3, 1)
+    assert entry['bounds'] == [[0.0, 0.0, 0.0], [0.0, 0.0, 20.0]]
+    assert entry['probes'][0]['min'] == entry['probes'][0]['max'] == 1.5
+
+    os.remove(extra)
+    assert reloaded.update(folder, workers=1) == (0, 2)
+    assert extra not in reloaded.entries
+
+
+def test_query(folder, tmp_path):
+    catalog = Data_Catalog(str(tmp_path / 'catalog.json'))
+    catalog.update(folder, workers=1)
+    assert [entry['magnet'] for entry in catalog.query()] == ['STY1', 'Q2']
+    assert [entry['tag'] for entry in catalog.query(magnet='Q2')] == ['340']
+    assert catalog.query(date_from='2022-04-01', date_to='2022-04-04')[0]['magnet'] == 'Q2'
+    assert catalog.query(beamline='BL1A') == []
+    assert catalog.query(contains=[0.0, 0.0, 1e6]) == []
+
+
+def test_convert(folder, tmp_path):
+    catalog = Data_Catalog(str(tmp_path / 'catalog.json'))
+    assert catalog.update(folder, workers=1, convert=True) == (4, 0)
+    stores = catalog.query(file_format='store')
+    assert len(stores) == 2
+    for store in stores:
+        source = store['filename'].replace('.mapdata', '.csv')
+        assert {key : value for key, value in store.items() if key not in ('filename', 'format', 'size', 'mtime')} == \
+               {key : value for key, value in catalog.entries[source].items() if key not in ('filename', 'format', 'size', 'mtime')}
+
+
+def test_damaged_store(folder, tmp_path):
+    """A data store damaged on the disk gets an 'error' entry, and the other files are still indexed.
+    """
+    catalog = Data_Catalog(str(tmp_path / 'catalog.json'))
+    catalog.update(folder, workers=1, convert=True)
+    store = os.path.join(folder, RUNS[0].replace('.csv', '.mapdata'))
+    with open(store, 'r+b') as f:
+        # the end of the compressed bytes of the last column
+        f.seek(-20, os.SEEK_END)
+        f.write(b'\xff' * 20)
+
+    assert catalog.update(folder, workers=1) == (1, 3)
+    assert 'error' in catalog.entries[store]
+    assert catalog.query(file_format='store', min_points=1)[0]['filename'] == store.replace(RUNS[0][:-4], RUNS[1][:-4])
+
+
+def test_conversion_cut_short(folder, monkeypatch):
+    """A conversion that fails half way leaves no store, so the next update converts the file again.
+    """
+    filename = os.path.join(folder, RUNS[0])
+    store = filename.replace('.csv', '.mapdata')
+
+    def failing_write_chunk(f, columns, compress = True):
+        f.write(b'CHNK')
+        raise OSError('No space left on device')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(mapper_data_store, 'write_chunk', failing_write_chunk)
+        with pytest.raises(OSError):
+            convert_file(filename)
+    assert not os.path.exists(store)
+
+    assert convert_file(filename) == store
+    assert len(load_store(store)[0]['X']) == 15
@@ -0,0 +1,83 @@
+"""Round trips between data CSV files and data stores.
+
+Run from the repository root::
+
+    py -3 -m pytest tests
+"""
+import csv
+import glob
+import os
+import numpy as np
+import pytest
+from conftest import ROOT
+from mapper_data_store import Data_Store, csv_to_store, store_to_csv, load_store
+from mapper_field_map import load_data
+
+ARCHIVE = sorted(glob.glob(os.path.join(ROOT, 'data', '*.csv')))
+
+
+def read_rows(filename):
+    """Reads the rows of a CSV file as text, without the empty lines.
+    """
+    with open(filename, 'r', newline='') as f:
+        return [row for row in csv.reader(f) if len(row) > 0]
+
+
+@pytest.mark.parametrize('csv_filename', ARCHIVE, ids=os.path.basename)
+def test_archive_round_trip(csv_filename, tmp_path):
+    """Every cell of the archived data files comes back with the same text, e.g. '6.610' and not '6.61'.
+    """
+    store = csv_to_store(csv_filename, str(tmp_path / 'data.mapdata'))
+    copy = store_to_csv(store, str(tmp_path / 'data.csv'))
+    assert read_rows(copy) == read_rows(csv_filename)
+
+
+def test_store_to_csv_does_not_overwrite(tmp_path):
+    csv_filename = str(tmp_path / 'data.csv')
+    with open(csv_filename, 'w', newline='') as f:
+        csv.writer(f).writerows([['X', 'Y', 'Z', 'Rotation', 'Data', 'Unit'], [0.0, 0.0, 0.0, 90.0, 1.5, 'G']])
+    store = csv_to_store(csv_filename)
+    with pytest.raises(FileExistsError):
+        store_to_csv(store, csv_filename)
+    with pytest.raises(ValueError):
+        store_to_csv(store, store)
+    assert read_rows(csv_filename)[1] == ['0.0', '0.0', '0.0', '90.0', '1.5', 'G']
+
+
+def test_csv_to_store_does_not_overwrite(tmp_path):
+    csv_filename = str(tmp_path / 'data.csv')
+    with open(csv_filename, 'w', newline='') as f:
+        csv.writer(f).writerows([['X', 'Y', 'Z', 'Rotation', 'Data', 'Unit'], [0.0, 0.0, 0.0, 90.0, 1.5, 'G']])
+    store = csv_to_store(csv_filename)
+    with open(csv_filename, 'a', newline='') as f:
+        csv.writer(f).writerow([0.0, 0.0, 10.0, 90.0, 2.5, 'G'])
+    with pytest.raises(FileExistsError):
+        csv_to_store(csv_filename)
+    with pytest.raises(ValueError):
+        csv_to_store(csv_filename, csv_filename, overwrite=True)
+    assert len(load_store(store)[0]['X']) == 1
+
+    assert csv_to_store(csv_filename, overwrite=True) == store
+    assert load_store(store)[0]['Data'].tolist() == [1.5, 2.5]
+
+
+def test_data_store_rows(tmp_path):
+    """Rows written by a run through ``Data_Store`` load like the same rows written as CSV.
+    """
+    header = ['X', 'Y', 'Z', 'Rotation', 'Data', 'Unit', 'Std', 'Samples']
+    rows = [[float(x), 0.0, -10.0, 90.0, round(0.1 * x, 6), 'G', 0.01, 25] for x in range(-50, 51, 5)]
+    rows.insert(3, [0.0, 0.0, 900.0, 90.0, 'out of motion bounds'])
+    store = str(tmp_path / 'data.mapdata')
+    with Data_Store(store, header, flush_rows=4) as sink:
+        for row in rows:
+            sink.write_row(row)
+
+    columns, metadata = load_store(store)
+    assert metadata['header'] == header
+    assert np.all(columns['Text'] == '')
+    assert np.isnan(columns['Data'][3]) and columns['Note'][3] == 'out of motion bounds'
+
+    copy = store_to_csv(store, str(tmp_path / 'data.csv'))
+    assert read_rows(copy)[1:] == [[str(cell) for cell in row] for row in rows]
+    points, values, unit = load_data(store)
+    assert len(values) == len(rows) - 1 and unit == 'G'
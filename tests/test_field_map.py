@@ -0,0 +1,105 @@
+"""Interpolation of mapped fields, on grids and on scattered points.
+"""
+import csv
+from itertools import product
+import numpy as np
+import pytest
+from mapper_field_map import Field_Map, load_data, load_field_map
+
+
+def trilinear(x, y, z):
+    """Reproduced exactly by trilinear interpolation. Its affine part is reproduced by linear interpolation on any points.
+    """
+    return 1.0 + 0.5 * x - 0.2 * y + 0.1 * z + 0.01 * x * y * z
+
+
+def affine(x, y, z):
+    return 1.0 + 0.5 * x - 0.2 * y + 0.1 * z
+
+
+def grid_points(xs, ys, zs):
+    return np.array(list(product(xs, ys, zs)), dtype=float)
+
+
+QUERIES = np.random.default_rng(0).uniform([0, -10, 0], [20, 10, 30], (200, 3))
+
+
+@pytest.mark.parametrize('zs', [[0, 10, 20, 30], [0, 5, 20, 30]], ids=['even', 'uneven'])
+def test_grid(zs):
+    points = grid_points([0, 10, 20], [-10, 0, 10], zs)
+    field_map = Field_Map(points, trilinear(*points.T), 'G')
+    assert field_map.kind == 'grid'
+    assert field_map.query(QUERIES) == pytest.approx(trilinear(*QUERIES.T))
+    assert field_map.query(points) == pytest.approx(trilinear(*points.T))
+    assert field_map.describe().startswith('grid map of %d points on a 3 X x 3 Y x 4 Z grid' % len(points))
+
+
+def test_grid_and_scattered_agree():
+    points = grid_points([0, 10, 20], [-10, 0, 10], [0, 10, 20, 30])
+    values = affine(*points.T)
+    grid = Field_Map(points, values)
+    scattered = Field_Map(points, values, method='linear')
+    assert scattered.kind == 'scattered'
+    assert scattered.query(QUERIES) == pytest.approx(grid.query(QUERIES))
+    assert scattered.query(QUERIES) == pytest.approx(affine(*QUERIES.T))
+
+
+def test_scattered_points():
+    points = np.random.default_rng(1).uniform([0, -10, 0], [20, 10, 30], (300, 3))
+    points = np.vstack((points, grid_points([0, 20], [-10, 10], [0, 30])))
+    field_map = Field_Map(points, affine(*points.T))
+    assert field_map.kind == 'scattered'
+    assert field_map.query(QUERIES) == pytest.approx(affine(*QUERIES.T))
+    with pytest.raises(ValueError):
+        Field_Map(points, affine(*points.T), method='grid')
+
+    nearest = Field_Map(points, affine(*points.T), method='nearest')
+    assert nearest.query(points) == pytest.approx(affine(*points.T))
+    assert np.isnan(nearest(100.0, 0.0, 0.0))
+
+
+def test_outside_and_flat_maps():
+    # a map of the plane Y = 0
+    points = grid_points([0, 10, 20], [0], [0, 10])
+    field_map = Field_Map(points, trilinear(*points.T))
+    assert field_map.active_axes == [0, 2]
+    assert field_map(5.0, 0.0, 5.0) == pytest.approx(trilinear(5.0, 0.0, 5.0))
+    # off the plane or outside of the mapped area
+    assert np.isnan(field_map(5.0, 1.0, 5.0))
+    assert np.isnan(field_map(25.0, 0.0, 5.0))
+    # coordinates are broadcast together
+    assert field_map(np.array([0.0, 10.0, 20.0]), 0.0, 0.0).shape == (3,)
+
+
+def test_repeated_points_are_averaged():
+    points = grid_points([0, 10], [0, 10], [0, 10])
+    values = np.arange(len(points), dtype=float)
+    field_map = Field_Map(np.vstack((points, points)), np.concatenate((values, values + 2.0)))
+    assert field_map.kind == 'grid'
+    assert field_map.query(points) == pytest.approx(values + 1.0)
+
+
+def test_load_field_map(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+    points = grid_points([0, 10], [0, 10], [0, 10])
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['X', 'Y', 'Z', 'Rotation', 'Data', 'Unit'])
+        for rotation in (0.0, 90.0):
+            for x, y, z in points.tolist():
+                writer.writerow([x, y, z, rotation, affine(x, y, z) / 1000 + rotation, 'kG'])
+        writer.writerow([0.0, 0.0, 900.0, 0.0, 'out of motion bounds'])
+        # a row after a range change of the meter
+        writer.writerow([5.0, 5.0, 5.0, 90.0, affine(5.0, 5.0, 5.0) + 90000.0, 'G'])
+
+    loaded_points, values, unit = load_data(filename)
+    assert (len(loaded_points), unit) == (2 * len(points) + 1, 'kG')
+    assert values[-1] == pytest.approx(affine(5.0, 5.0, 5.0) / 1000 + 90.0)
+
+    with pytest.raises(ValueError):
+        load_field_map(filename)
+    with pytest.raises(ValueError):
+        load_field_map(filename, rotation=45.0)
+    field_map = load_field_map(filename, rotation=0.0)
+    assert field_map.unit == 'kG'
+    assert field_map(5.0, 5.0, 5.0) == pytest.approx(affine(5.0, 5.0, 5.0) / 1000)
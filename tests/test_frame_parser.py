@@ -0,0 +1,56 @@
+"""Parsing of the frames sent by the Teslameter, and the reasons bad frames are rejected for.
+"""
+import pytest
+from mapper_frame_parser import Frame_Parser
+
+
+@pytest.mark.parametrize('frame, reading', [('-6.191G\r\n', (-6.191, 'G')),
+                                            ('+1.2e-3 T', (1.2e-3, 'T')),
+                                            ('  12.50kG ', (12.5, 'kG')),
+                                            ('0.5mT', (0.5, 'mT'))])
+def test_valid_frames(frame, reading):
+    parser = Frame_Parser()
+    assert parser.parse(frame) == pytest.approx(reading)
+    assert parser.failure_count() == 0
+
+
+@pytest.mark.parametrize('frame, reason', [('', 'empty'),
+                                           ('\r\n', 'empty'),
+                                           ('-OL G', 'overload'),
+                                           ('OL', 'overload'),
+                                           ('12.50kG*', 'range_change'),
+                                           ('6.19G', 'decimals'),
+                                           ('6.191Gauss', 'unknown_unit'),
+                                           ('-6.1#1G', 'malformed'),
+                                           ('6191G', 'malformed'),
+                                           ('.191G', 'malformed'),
+                                           ('-6.191G-6.192G', 'malformed')])
+def test_rejected_frames(frame, reason):
+    parser = Frame_Parser(decimals=3)
+    assert parser.parse(frame) is None
+    assert dict(parser.failures) == {reason : 1}
+
+
+def test_unit_conversion():
+    parser = Frame_Parser(unit='G')
+    assert parser.parse('1.250kG') == pytest.approx((1250.0, 'G'))
+    assert parser.parse('0.100T') == pytest.approx((1000.0, 'G'))
+    assert parser.parse('-5.000G') == pytest.approx((-5.0, 'G'))
+    with pytest.raises(ValueError):
+        Frame_Parser(unit='Oe')
+
+
+def test_range_change_accepted():
+    assert Frame_Parser(accept_range_change=True).parse('12.50kG*') == pytest.approx((12.5, 'kG'))
+
+
+def test_counts(capsys):
+    parser = Frame_Parser()
+    for frame in ['1.000G', 'OL', '#', '2.000G', '?', '*']:
+        parser.parse(frame)
+    assert parser.frames == 6
+    assert parser.failure_count() == 4
+    # counted since the last valid frame
+    assert parser.consecutive_failures == 2
+    parser.print_stats('Probe 1')
+    assert capsys.readouterr().out == 'Probe 1 frames: 6 received, 4 rejected (66.67%): 3 malformed, 1 overload\n'
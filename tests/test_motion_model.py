@@ -0,0 +1,86 @@
+"""Move times estimated from the speed and acceleration of the stages.
+"""
+import contextlib
+import io
+import numpy as np
+import pytest
+from mapper_base import Mapper
+from mapper_motion_model import Motion_Model
+from mapper_path_io import write_csv_chunks
+from mapper_points_generator import Points_Generator
+
+# in front of the magnet, Z below -300 mm
+SAFE_ENVELOPE = {'x' : [-100, 100], 'y' : [-50, 50], 'z' : [-1000, -300]}
+
+
+@pytest.fixture
+def model():
+    # full speed is reached after 4 mm (or degrees) on every axis
+    Mapper.config_dict = {'x_accel' : 100.0, 'y_accel' : 100.0, 'z_accel' : 100.0, 'r_accel' : 100.0,
+                          'move_overhead_sec' : 0.1}
+    return Motion_Model()
+
+
+def test_axis_times(model):
+    times = model.axis_times(np.array([[1.0, -4.0, 100.0, 0.0]]))
+    # triangular below 4 mm, 2 sqrt(d / a), then trapezoidal, d / v + v / a
+    assert times[0] == pytest.approx([0.2, 0.4, 5.2, 0.0])
+
+
+def test_phase_times(model):
+    start = np.array([[0.0, 0.0, 0.0, 0.0], [10.0, 0.0, 0.0, 90.0]])
+    end = np.array([[1.0, 100.0, 1.0, 0.0], [10.0, 0.0, 100.0, 0.0]])
+    xyr_time, z_time = model.phase_times(start, end)
+    assert xyr_time == pytest.approx([5.2, 4.7])
+    assert z_time == pytest.approx([0.2, 5.2])
+    assert model.move_time(start, end) == pytest.approx([5.4, 9.9])
+    # a move takes as long in both directions
+    assert model.move_time(end, start) == pytest.approx(model.move_time(start, end))
+
+
+def test_path_time(model):
+    points = np.array([[0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 100.0, 0.0], [0.0, 0.0, 100.0, 0.0]])
+    assert model.path_time(points) == pytest.approx(5.2 + 2 * 0.1)
+    assert model.path_time(points[:1]) == 0.0
+
+
+def test_concurrent_moves_in_safe_envelope(model):
+    start = np.array([[0.0, 0.0, -900.0, 0.0], [0.0, 0.0, -400.0, 0.0], [200.0, 0.0, -900.0, 0.0]])
+    end = np.array([[0.0, 40.0, -800.0, 0.0], [0.0, 100.0, -200.0, 0.0], [200.0, 100.0, -800.0, 0.0]])
+    sequential = model.move_time(start, end)
+    assert sequential == pytest.approx([7.4, 15.4, 10.4])
+
+    Mapper.config_dict.update(motion_mode='concurrent', safe_envelope=dict(SAFE_ENVELOPE, y=[-50, 150]))
+    concurrent = Motion_Model()
+    # only the first move stays inside the envelope, the others end in front of the magnet or start outside of the box
+    assert concurrent.safe_moves(start, end).tolist() == [True, False, False]
+    xyr_time, z_time = concurrent.phase_times(start, end)
+    assert xyr_time == pytest.approx([5.2, 5.2, 5.2])
+    assert z_time == pytest.approx([0.0, 10.2, 5.2])
+    assert concurrent.move_time(start[0], end[0]) == pytest.approx(5.2)
+
+    # an envelope is needed, and the sequential mode ignores it
+    Mapper.config_dict.update(safe_envelope=None)
+    assert not np.any(Motion_Model().safe_moves(start, end))
+    Mapper.config_dict.update(motion_mode='sequential', safe_envelope=SAFE_ENVELOPE)
+    assert Motion_Model().move_time(start, end) == pytest.approx(sequential)
+
+
+def test_estimate_time(model, tmp_path):
+    path_filename = str(tmp_path / 'path.csv')
+    write_csv_chunks(path_filename, [np.array([[0.0, 0.0, -900.0, 0.0], [0.0, 40.0, -800.0, 0.0], [0.0, 0.0, -900.0, 0.0]])])
+    Mapper.config_dict.update(path_filename=path_filename, path_edges_filename=str(tmp_path / 'path_edges.csv'),
+                              probe_stop_time_sec=0.5, x_offset=250, y_offset=250, z_offset=500, shape='rectangular',
+                              x_range=0, x_spacing=1, y_range=40, y_spacing=40, rotation_points=[0.0], z_range=100, z_spacing=100)
+
+    def estimate():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Points_Generator().estimate_time(path_filename, 0.5)
+
+    phases = estimate()
+    assert (phases['xyr_move'], phases['z_move']) == pytest.approx((2 * 2.2, 2 * 5.2))
+    assert phases['total'] == pytest.approx(4.4 + 10.4 + 2 * 0.1 + 3 * 0.5)
+
+    Mapper.config_dict.update(motion_mode='concurrent', safe_envelope=SAFE_ENVELOPE)
+    phases = estimate()
+    assert (phases['xyr_move'], phases['z_move']) == pytest.approx((2 * 5.2, 0.0))
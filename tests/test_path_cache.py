@@ -0,0 +1,75 @@
+"""Path generation skipped when the path files are current or cached.
+"""
+import contextlib
+import io
+import pytest
+from mapper_base import Mapper
+from mapper_path_cache import Path_Cache, path_key
+from mapper_points_generator import Points_Generator
+
+
+@pytest.fixture
+def config(tmp_path):
+    config_dict = {'path_filename' : str(tmp_path / 'path.csv'), 'path_edges_filename' : str(tmp_path / 'path_edges.csv'),
+                   'probe_stop_time_sec' : 0.5, 'x_offset' : 250, 'y_offset' : 250, 'z_offset' : 500,
+                   'x_accel' : 200, 'y_accel' : 200, 'z_accel' : 200,
+                   'shape' : 'rectangular', 'x_range' : 40, 'x_spacing' : 20, 'y_range' : 20, 'y_spacing' : 10,
+                   'rotation_points' : [90.0], 'z_range' : 200, 'z_spacing' : 50}
+    Mapper.config_dict = config_dict
+    return config_dict
+
+
+def generate():
+    """Runs ``Points_Generator`` and returns its banner, e.g. 'Path restored from cache'.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        Points_Generator().run()
+    return [line.strip('* ') for line in output.getvalue().splitlines() if line.startswith('****')][0]
+
+
+def test_path_key_ignores_offsets_and_number_types(config):
+    key = path_key(config)
+    assert path_key(dict(config, x_offset=123, path_filename='other.csv')) == key
+    assert path_key(dict(config, x_spacing=20.0)) == key
+    assert path_key(dict(config, x_spacing=10)) != key
+
+
+def test_hit_and_miss(config):
+    assert generate() == 'Path generated for rectangular region'
+    with open(config['path_filename'], 'r') as f:
+        path = f.read()
+    assert generate() == 'Path unchanged, files are up to date'
+
+    # a changed configuration is a miss, changing it back restores the first path without generating it
+    config['x_spacing'] = 10
+    assert generate() == 'Path generated for rectangular region'
+    config['x_spacing'] = 20
+    assert generate() == 'Path restored from cache'
+    with open(config['path_filename'], 'r') as f:
+        assert f.read() == path
+
+    # files changed by hand are not current anymore
+    with open(config['path_filename'], 'a') as f:
+        f.write('1.0,2.0,3.0,4.0\n')
+    assert generate() == 'Path restored from cache'
+    with open(config['path_filename'], 'r') as f:
+        assert f.read() == path
+
+
+def test_least_recently_used_paths_are_evicted(tmp_path):
+    filename = str(tmp_path / 'path.csv')
+    cache = Path_Cache(str(tmp_path / 'cache'), max_entries=2)
+    for key in ('a', 'b', 'c'):
+        with open(filename, 'w') as f:
+            f.write(key)
+        assert cache.restore(key, [filename]) is None
+        cache.store(key, [filename])
+
+    cache = Path_Cache(str(tmp_path / 'cache'), max_entries=2)
+    assert sorted(cache.index['entries']) == ['b', 'c']
+    assert cache.restore('c', [filename]) == 'current'
+    assert cache.restore('b', [filename]) == 'restored'
+    assert cache.restore('a', [filename]) is None
+    with open(filename, 'r') as f:
+        assert f.read() == 'b'
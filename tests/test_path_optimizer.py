@@ -0,0 +1,87 @@
+"""Reordering of paths to reduce the time spent moving between points.
+"""
+import contextlib
+import io
+import os
+import numpy as np
+import pytest
+from mapper_base import Mapper
+from mapper_motion_model import Motion_Model
+from mapper_path_io import write_csv_chunks, write_npy_chunks, iter_csv_chunks, open_npy_path, npy_filename
+from mapper_path_optimizer import Path_Optimizer
+
+
+@pytest.fixture
+def config(tmp_path):
+    Mapper.config_dict = {'path_filename' : str(tmp_path / 'path.csv'),
+                          'x_accel' : 100.0, 'y_accel' : 100.0, 'z_accel' : 100.0,
+                          'optimize_time_limit_sec' : 30.0}
+    return Mapper.config_dict
+
+
+def shuffled_grid(seed = 0):
+    points = np.array([[x, y, z, 90.0] for x in range(0, 50, 10) for y in range(0, 30, 10) for z in range(0, 100, 20)], dtype=float)
+    rng = np.random.default_rng(seed)
+    return np.vstack((points[:1], points[1:][rng.permutation(len(points) - 1)]))
+
+
+def sorted_rows(points):
+    return sorted(map(tuple, np.asarray(points).tolist()))
+
+
+def test_optimize_keeps_every_point(config):
+    points = shuffled_grid()
+    with contextlib.redirect_stdout(io.StringIO()):
+        optimized, time_before, time_after = Path_Optimizer().optimize(points)
+    assert sorted_rows(optimized) == sorted_rows(points)
+    assert optimized[0].tolist() == points[0].tolist()
+    assert time_after < 0.7 * time_before
+    assert time_after == pytest.approx(Motion_Model().path_time(optimized))
+
+
+def test_quicker_order_is_kept(config):
+    """A serpentine line is already the quickest order, it comes back unchanged.
+    """
+    points = np.array([[0.0, 0.0, z, 90.0] for z in range(0, 200, 10)])
+    optimizer = Path_Optimizer()
+    assert optimizer.optimize_section(points) is points
+    assert len(optimizer.optimize_section(points[:2])) == 2
+
+
+def test_time_limit(config):
+    config['optimize_time_limit_sec'] = 0.0
+    points = shuffled_grid()
+    with contextlib.redirect_stdout(io.StringIO()):
+        optimized, time_before, time_after = Path_Optimizer().optimize(points)
+    assert optimized.tolist() == points.tolist()
+
+    # the points not visited when the deadline passes keep their order
+    optimizer = Path_Optimizer()
+    optimizer.deadline = 0.0
+    assert optimizer.nearest_neighbour(points).tolist() == list(range(len(points)))
+
+
+@pytest.mark.parametrize('path_format', ['csv', 'npy'])
+def test_run_in_sections(config, path_format):
+    config.update(path_format=path_format, optimize_chunk_size=20)
+    points = shuffled_grid(1)
+    filename = config['path_filename']
+    write_csv_chunks(filename, [points])
+    if path_format == 'npy':
+        write_npy_chunks(npy_filename(filename), [points], len(points), {'profile' : 'grid'})
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        Path_Optimizer().run()
+    optimized = np.vstack(list(iter_csv_chunks(filename)))
+    assert not os.path.exists(filename + '.tmp')
+    # points only move within their section of 20
+    for index in range(0, len(points), 20):
+        assert sorted_rows(optimized[index:index + 20]) == sorted_rows(points[index:index + 20])
+    assert Motion_Model().path_time(optimized) < Motion_Model().path_time(points)
+    assert 'Estimated motion time' in output.getvalue()
+
+    if path_format == 'npy':
+        npy_points, header = open_npy_path(npy_filename(filename))
+        assert np.array_equal(npy_points, optimized)
+        assert header['profile'] == 'grid' and 'sections of 20 points' in header['ordering']
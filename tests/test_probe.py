@@ -0,0 +1,68 @@
+"""Probe sessions reading the simulated Teslameter on a pseudo terminal.
+
+These tests are skipped on Windows, which has no pseudo terminals.
+"""
+import os
+from time import monotonic, sleep
+import pytest
+from mapper_probe import Probe_Session
+from mapper_probe_simulator import Probe_Simulator
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'openpty'), reason='the simulated probe needs a pseudo terminal')
+
+
+def silence(simulator):
+    """Stops the frames of a simulator but keeps its pseudo terminal open, like a probe unplugged from the Arduino.
+    """
+    simulator.stop_event.set()
+    simulator.thread.join()
+
+
+@pytest.mark.parametrize('background_reader', [False, True])
+def test_silent_probe_raises(background_reader):
+    with Probe_Simulator(frame_rate=50.0) as simulator:
+        with Probe_Session(simulator.port, timeout=0.1, max_silent_timeouts=3) as session:
+            if background_reader:
+                session.start_reader()
+            session.get_reading()
+            silence(simulator)
+            with pytest.raises(RuntimeError, match=simulator.port):
+                session.get_reading()
+            with pytest.raises(RuntimeError, match='No frame received'):
+                session.get_readings(3)
+
+
+def test_stale_frames_are_dropped():
+    """Frames that the probe sent before the request, e.g. while the stages were moving, are never returned.
+    """
+    position = [(0.0, 0.0, 0.0, 0.0)]
+    field = lambda x, y, z, rot: x
+    with Probe_Simulator(lambda: position[0], field=field, frame_rate=50.0) as simulator:
+        with Probe_Session(simulator.port, timeout=0.5) as session:
+            assert session.get_reading()[1] == 0.0
+            # frames pile up in the input buffer while nobody reads
+            sleep(0.3)
+            position[0] = (1.0, 0.0, 0.0, 0.0)
+            # frames from the old position may still be in flight for one frame period
+            not_before = monotonic() + 0.05
+            for i in range(5):
+                timestamp, value, unit = session.get_reading(not_before)
+                assert timestamp >= not_before
+                assert value == 1.0
+                not_before = timestamp
+
+
+def test_latency_stats(capsys):
+    with Probe_Simulator(frame_rate=50.0) as simulator:
+        with Probe_Session(simulator.port, timeout=0.5) as session:
+            assert session.latency_stats() == {}
+            for i in range(10):
+                session.get_reading()
+            stats = session.latency_stats()
+            session.print_latency_stats('Probe 1')
+    assert stats['reads'] == 10
+    assert 0 < stats['median'] <= stats['p95'] <= stats['max']
+    assert 0 < stats['mean'] <= stats['max']
+    # a frame is sent every 20 ms, so no read waits anywhere near the timeout
+    assert stats['max'] < 0.5
+    assert capsys.readouterr().out.startswith('Probe 1 read latency over 10 readings')
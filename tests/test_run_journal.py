@@ -0,0 +1,55 @@
+"""Progress of interrupted runs, as recorded by the run journal.
+"""
+from time import sleep
+import pytest
+from mapper_run_journal import Run_Journal, journal_filename
+
+
+@pytest.fixture
+def files(tmp_path):
+    path_filename = str(tmp_path / 'path.csv')
+    data_filename = str(tmp_path / 'data.csv')
+    with open(path_filename, 'w') as f:
+        f.write('X,Y,Z,Rotation\n0.0,0.0,0.0,90.0\n0.0,0.0,10.0,90.0\n')
+    with open(data_filename, 'w') as f:
+        f.write('X,Y,Z,Rotation,Data,Unit\n0.0,0.0,0.0,90.0,1.5,G\n0.0,0.0,10')
+    return path_filename, data_filename
+
+
+def test_resume_cuts_the_data_file(files):
+    path_filename, data_filename = files
+    journal = Run_Journal(journal_filename(data_filename))
+    journal.start(path_filename, data_filename)
+    journal.save(1, len('X,Y,Z,Rotation,Data,Unit\n0.0,0.0,0.0,90.0,1.5,G\n'))
+
+    assert Run_Journal(journal.filename).check_resume(path_filename, data_filename) == 1
+    with open(data_filename, 'r') as f:
+        assert f.read().endswith('1.5,G\n')
+
+    with open(path_filename, 'a') as f:
+        f.write('0.0,0.0,20.0,90.0\n')
+    with pytest.raises(ValueError, match='has changed'):
+        Run_Journal(journal.filename).check_resume(path_filename, data_filename)
+
+
+def test_elapsed_time_adds_up_over_sessions(files):
+    path_filename, data_filename = files
+    journal = Run_Journal(journal_filename(data_filename))
+    journal.start(path_filename, data_filename)
+    sleep(0.2)
+    journal.save(1, 10)
+    first_session = journal.state['elapsed_sec']
+    assert first_session >= 0.2
+
+    # time between the sessions is not counted
+    sleep(0.2)
+    resumed = Run_Journal(journal.filename)
+    resumed.load()
+    assert first_session <= resumed.elapsed() < first_session + 0.1
+    sleep(0.1)
+    resumed.save(2, 20, completed=True)
+    assert resumed.state['elapsed_sec'] >= first_session + 0.1
+
+    # a new run starts from 0
+    journal.start(path_filename, data_filename)
+    assert journal.elapsed() < 0.1
@@ -0,0 +1,53 @@
+"""Statistics of the readings taken at one point.
+"""
+import numpy as np
+import pytest
+from mapper_sample_averager import Sample_Averager
+
+# readings around 10 G with one spike, e.g. a garbled frame that still parsed
+READINGS = [10.0, 10.2, 9.8, 10.1, 9.9, 10.0, 10.1, 9.9, 10.0, 50.0]
+
+
+def test_mean_and_median():
+    value, std, count = Sample_Averager(10, 'mean').estimate(READINGS)
+    assert value == pytest.approx(np.mean(READINGS))
+    assert std == pytest.approx(np.std(READINGS, ddof=1))
+    assert count == 10
+    assert Sample_Averager(10, 'median').estimate(READINGS)[0] == pytest.approx(10.0)
+
+
+def test_trimmed_mean_drops_both_ends():
+    averager = Sample_Averager(10, 'trimmed_mean', trim_fraction=0.1)
+    value, std, count = averager.estimate(READINGS)
+    assert count == 8
+    assert value == pytest.approx(np.mean(sorted(READINGS)[1:9]))
+    assert averager.rejected == 2
+
+
+def test_mad_rejects_the_spike_only():
+    averager = Sample_Averager(10, 'mad')
+    value, std, count = averager.estimate(READINGS)
+    assert count == 9
+    assert value == pytest.approx(np.mean(READINGS[:9]))
+    assert std == pytest.approx(np.std(READINGS[:9], ddof=1))
+    averager.estimate(READINGS)
+    assert averager.rejected == 2
+
+
+def test_mad_matches_standard_deviation_of_gaussian_noise():
+    """With Gaussian noise, 3.5 scaled MADs are 3.5 standard deviations, so almost every reading is kept.
+    """
+    readings = np.random.default_rng(0).normal(5.0, 0.1, 10000)
+    value, std, count = Sample_Averager(len(readings), 'mad').estimate(readings)
+    assert count > 0.999 * len(readings)
+    assert value == pytest.approx(5.0, abs=0.01)
+    assert std == pytest.approx(0.1, rel=0.05)
+
+
+def test_single_reading():
+    assert Sample_Averager().estimate([3.5]) == (3.5, 0.0, 1)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        Sample_Averager(5, 'mode')
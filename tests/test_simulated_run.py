@@ -0,0 +1,102 @@
+"""Short mapping runs on the simulated stages and probe, interrupted and resumed as with ``main.py --resume``.
+
+The probe is simulated on a pseudo terminal, so these tests are skipped on Windows.
+"""
+import contextlib
+import csv
+import io
+import os
+import pytest
+from mapper_base import Mapper
+from mapper_controller import Controller
+from mapper_path_io import iter_path_chunks
+from mapper_points_generator import Points_Generator
+from mapper_probe import Probe_Session
+from mapper_probe_simulator import Probe_Simulator, quadrupole_field
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'openpty'), reason='the simulated probe needs a pseudo terminal')
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Profile of a 3 x 5 points map on the simulated stages, with a clock running 100 times faster than real time
+    and short waits for the probe, which runs in real time.
+    """
+    config_dict = {'path_filename' : str(tmp_path / 'path.csv'), 'path_edges_filename' : str(tmp_path / 'path_edges.csv'),
+                   'data_filename' : str(tmp_path / 'data.csv'), 'comm_port_zaber' : 'simulated', 'comm_port_probe' : 'simulated',
+                   'collect_data' : 'True', 'probe_stop_time_sec' : 0.05, 'data_flush_rows' : 2,
+                   'settle_window_sec' : 0.1, 'settle_min_readings' : 3, 'settle_min_sec' : 0.05, 'sim_probe_oscillation' : 0.0,
+                   'x_offset' : 250, 'y_offset' : 250, 'z_offset' : 500, 'x_accel' : 200, 'y_accel' : 200, 'z_accel' : 200,
+                   'x_speed' : 100, 'y_speed' : 100, 'z_speed' : 100,
+                   'motion_backend' : 'simulated', 'probe_backend' : 'simulated', 'sim_time_scale' : 100, 'sim_probe_rate_hz' : 100,
+                   'shape' : 'rectangular', 'x_range' : 40, 'x_spacing' : 20, 'y_range' : 0, 'y_spacing' : 1,
+                   'rotation_points' : [90.0], 'z_range' : 200, 'z_spacing' : 50}
+    Mapper.config_dict = config_dict
+    with contextlib.redirect_stdout(io.StringIO()):
+        Points_Generator().run()
+    return config_dict
+
+
+def read_rows(filename):
+    with open(filename, 'r', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_probe_read():
+    """``Probe_Session`` reads the frames sent by ``Probe_Simulator`` on a pseudo terminal, with and without the background reader.
+    """
+    position = (10.0, -5.0, 0.0, 90.0)
+    with Probe_Simulator(lambda: position, frame_rate=50.0, seed=1) as simulator:
+        with Probe_Session(simulator.port, timeout=0.5) as session:
+            timestamp, value, unit = session.get_reading()
+            assert unit == 'G'
+            assert value == pytest.approx(quadrupole_field(*position), abs=1e-3)
+
+            session.start_reader()
+            not_before = timestamp + 0.1
+            later, value, unit = session.get_reading(not_before)
+            assert later >= not_before
+            assert value == pytest.approx(quadrupole_field(*position), abs=1e-3)
+    assert simulator.frames_sent > 0
+
+
+@pytest.mark.parametrize('settle_mode', ['fixed', 'adaptive'])
+def test_interrupted_run_resumes_without_duplicates(config, settle_mode, monkeypatch):
+    """A run interrupted with Ctrl-C and resumed maps every point of the path exactly once, in path order.
+    """
+    config['settle_mode'] = settle_mode
+    path = [tuple(point) for chunk in iter_path_chunks(config['path_filename']) for point in chunk.tolist()]
+    assert len(path) == 15
+
+    move = Controller.moveXYZR
+    moves = []
+    def interrupted_move(self, *args, **kwargs):
+        moves.append(args)
+        if len(moves) == 8:
+            raise KeyboardInterrupt
+        return move(self, *args, **kwargs)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        monkeypatch.setattr(Controller, 'moveXYZR', interrupted_move)
+        with pytest.raises(KeyboardInterrupt):
+            Controller().run()
+        monkeypatch.setattr(Controller, 'moveXYZR', move)
+        rows_before_resume = len(read_rows(config['data_filename'])) - 1
+        Controller().run(resume=True)
+
+    assert 0 < rows_before_resume < len(path)
+    rows = read_rows(config['data_filename'])
+    assert rows[0][:5] == ['X', 'Y', 'Z', 'Rotation', 'Data']
+    positions = [tuple(float(cell) for cell in row[:4]) for row in rows[1:]]
+    assert len(positions) == len(set(positions))
+    assert positions == pytest.approx(path)
+
+
+def test_clock_without_waiting_needs_the_serial_probe(config):
+    """The simulated probe runs in real time, so it cannot follow stages that move in simulated time only.
+    """
+    config['sim_time_scale'] = 0
+    with pytest.raises(ValueError, match='sim_time_scale'):
+        Controller()
+    config['probe_backend'] = 'serial'
+    assert Controller().backend.now() == 0.0
@@ -0,0 +1,54 @@
+"""Warning flags of the stages polled during a run.
+"""
+from time import sleep
+import pytest
+from zaber_motion.ascii import WarningFlags
+from mapper_motion_backend import Simulated_Clock, Simulated_Device
+from mapper_warning_monitor import Stage_Warning_Error, Warning_Monitor
+
+
+def devices(count = 2):
+    clock = Simulated_Clock()
+    return [Simulated_Device(address, clock, 20.0, 100.0, (0.0, 500.0)) for address in range(1, count + 1)]
+
+
+def test_flags_from_before_the_run(capsys):
+    """Warnings left over from before the run are cleared, a latched fault is kept and stops the run before it starts.
+    """
+    device_list = devices()
+    device_list[1].flags.update({'WL', 'NC'})
+    monitor = Warning_Monitor(interval=0.01)
+    monitor.start(device_list)
+    monitor.stop()
+    assert device_list[1].flags == set()
+    assert "Cleared warning flags ['NC', 'WL'] of device 2" in capsys.readouterr().out
+
+    device_list[0].flags.add('WL')
+    device_list[1].flags.add(WarningFlags.STALLED_AND_STOPPED)
+    with pytest.raises(Stage_Warning_Error, match='Device 2'):
+        monitor.start(device_list)
+    assert not monitor.is_running()
+    # no flag was cleared
+    assert (device_list[0].flags, device_list[1].flags) == ({'WL'}, {WarningFlags.STALLED_AND_STOPPED})
+
+    # unless the flag is not actionable
+    monitor = Warning_Monitor(actionable_flags=['FE'])
+    monitor.start(device_list)
+    monitor.stop()
+    assert device_list[1].flags == set()
+
+
+def test_fault_during_the_run():
+    device_list = devices()
+    monitor = Warning_Monitor(interval=0.01)
+    monitor.start(device_list)
+    try:
+        monitor.check()
+        device_list[0].flags.add('WL')
+        device_list[1].flags.add(WarningFlags.STALLED_AND_STOPPED)
+        sleep(0.1)
+        with pytest.raises(Stage_Warning_Error, match='Device 2'):
+            monitor.check()
+    finally:
+        monitor.stop()
+    assert monitor.counts == {(1, 'WL') : 1, (2, WarningFlags.STALLED_AND_STOPPED) : 1}